@@ -0,0 +1,162 @@
+# analytics.py
+# Columnar session analytics: events are held as typed NumPy arrays and every
+# per-(session, topic) statistic is computed with grouped array operations, so
+# summarizing thousands of sessions costs a handful of vectorized passes.
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+import numpy as np
+
+PERCENTILES = (50, 90)
+
+# The sessions are resolved first, so both filters can use an index (an OR across the
+# joined tables can only be answered by scanning question_session; see schema.py)
+ANALYTICS_SQL = """
+    WITH sids AS (
+        SELECT unnest($1::uuid[]) AS id
+        UNION
+        SELECT id FROM session WHERE "userId"::text = ANY($2::text[])
+    )
+    SELECT qs."sessionId"::text AS session_id, qs."questionId" AS question_id,
+           qs.correct, qs."timeTaken" AS time_taken
+    FROM question_session qs
+    WHERE qs."sessionId" IN (SELECT id FROM sids) AND qs.response <> ''
+    ORDER BY qs."sessionId", qs.timestamp
+"""
+
+
+class SessionColumns:
+    """Answer events of many sessions as parallel typed arrays (in answer order per session)."""
+    __slots__ = ("session_ids", "topics", "session", "topic", "correct", "time_taken", "difficulty")
+
+    def __init__(self, session_ids: List[str], topics: List[str], session: np.ndarray, topic: np.ndarray,
+                 correct: np.ndarray, time_taken: np.ndarray, difficulty: np.ndarray):
+        self.session_ids = session_ids
+        self.topics = topics
+        self.session = session          # int32 index into session_ids
+        self.topic = topic              # int16 index into topics
+        self.correct = correct          # bool
+        self.time_taken = time_taken    # float32 seconds
+        self.difficulty = difficulty    # int8 (0 when unknown)
+
+    def __len__(self) -> int:
+        return len(self.session)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, bool, float, int]]) -> "SessionColumns":
+        """Build from (sessionId, topic, wasCorrect, timeTaken, difficulty) tuples."""
+        session_codes: Dict[str, int] = {}
+        topic_codes: Dict[str, int] = {}
+        s, t, c, tt, d = [], [], [], [], []
+        for sid, topic, correct, time_taken, difficulty in rows:
+            s.append(session_codes.setdefault(sid, len(session_codes)))
+            t.append(topic_codes.setdefault(topic, len(topic_codes)))
+            c.append(bool(correct))
+            tt.append(time_taken or 0.0)
+            d.append(difficulty or 0)
+        return cls(
+            list(session_codes), list(topic_codes),
+            np.asarray(s, dtype=np.int32), np.asarray(t, dtype=np.int16),
+            np.asarray(c, dtype=bool), np.asarray(tt, dtype=np.float32), np.asarray(d, dtype=np.int8),
+        )
+
+    @classmethod
+    def from_sessions(cls, sessions: Dict[str, List[Dict[str, Any]]]) -> "SessionColumns":
+        """Build from event dicts (the shape the session store keeps) keyed by sessionId."""
+        return cls.from_rows(
+            (sid, e["topic"], e["wasCorrect"], e["timeTaken"], e.get("difficulty"))
+            for sid, events in sessions.items() for e in events
+        )
+
+
+def _group_percentiles(group: np.ndarray, values: np.ndarray, counts: np.ndarray,
+                       pcts: Iterable[int]) -> Dict[int, np.ndarray]:
+    """Nearest-rank percentiles of `values` within each group, without a Python loop over groups."""
+    order = np.lexsort((values, group))
+    sorted_vals = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    out = {}
+    for p in pcts:
+        offs = np.rint((counts - 1).clip(min=0) * (p / 100.0)).astype(np.int64)
+        idx = np.minimum(starts + offs, max(len(sorted_vals) - 1, 0))
+        out[p] = np.where(counts > 0, sorted_vals[idx] if len(sorted_vals) else 0.0, 0.0)
+    return out
+
+
+def summarize(cols: SessionColumns) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Per-session, per-topic statistics:
+    count, correct, total_time, accuracy, avg_time, p50/p90 time and difficulty progression.
+    """
+    n_topics = max(len(cols.topics), 1)
+    n_groups = len(cols.session_ids) * n_topics
+    if len(cols) == 0:
+        return {}
+    group = cols.session.astype(np.int64) * n_topics + cols.topic
+
+    counts = np.bincount(group, minlength=n_groups)
+    correct = np.bincount(group, weights=cols.correct, minlength=n_groups)
+    total_time = np.bincount(group, weights=cols.time_taken, minlength=n_groups)
+    safe = np.maximum(counts, 1)
+    accuracy = np.round(100 * correct / safe, 2)
+    avg_time = np.round(total_time / safe, 2)
+    pct = _group_percentiles(group, cols.time_taken, counts, PERCENTILES)
+
+    # difficulty progression: first and last difficulty seen in each group (events are in answer order)
+    positions = np.arange(len(group))
+    first = np.full(n_groups, len(group), dtype=np.int64)
+    np.minimum.at(first, group, positions)
+    last = np.full(n_groups, -1, dtype=np.int64)
+    np.maximum.at(last, group, positions)
+    max_diff = np.zeros(n_groups, dtype=np.int8)
+    np.maximum.at(max_diff, group, cols.difficulty)
+
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for g in np.flatnonzero(counts):
+        sid = cols.session_ids[g // n_topics]
+        topic = cols.topics[g % n_topics]
+        out.setdefault(sid, {})[topic] = {
+            "count": int(counts[g]),
+            "correct": int(correct[g]),
+            "total_time": round(float(total_time[g]), 2),
+            "accuracy": float(accuracy[g]),
+            "avg_time": float(avg_time[g]),
+            **{f"p{p}_time": round(float(pct[p][g]), 2) for p in PERCENTILES},
+            "difficulty_start": int(cols.difficulty[first[g]]),
+            "difficulty_end": int(cols.difficulty[last[g]]),
+            "difficulty_max": int(max_diff[g]),
+        }
+    return out
+
+
+def overall_accuracy(per_topic: Dict[str, Dict[str, Any]]) -> float:
+    """Accuracy across all topics of one session, in percent."""
+    total = sum(v["count"] for v in per_topic.values())
+    correct = sum(v["correct"] for v in per_topic.values())
+    return round(100 * correct / total, 2) if total else 0.0
+
+
+def recommendations(per_topic: Dict[str, Dict[str, Any]]) -> List[str]:
+    """The end-of-session heuristics: review below 70%, practice below 90%, otherwise advance."""
+    topics = list(per_topic)
+    acc = np.fromiter((per_topic[t]["accuracy"] for t in topics), dtype=np.float32, count=len(topics))
+    kind = np.select([acc < 70, acc < 90], [0, 1], default=2)
+    templates = (
+        "Review basics of {} and try 10 easy questions.",
+        "Practice more problems in {} at current difficulty to improve speed.",
+        "Try advanced questions in {} to challenge yourself.",
+    )
+    return [templates[k].format(t) for k, t in zip(kind, topics)]
+
+
+async def load_columns(pool, question_index, session_ids: Optional[List[str]] = None,
+                       user_ids: Optional[List[str]] = None) -> SessionColumns:
+    """Fetch answered questions for many sessions/users in one query and map them through the question index."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(ANALYTICS_SQL, session_ids or [], user_ids or [])
+
+    def gen():
+        for r in rows:
+            rec = question_index.get(r["question_id"])
+            if rec is not None:
+                yield r["session_id"], rec.topic, r["correct"], r["time_taken"], rec.difficulty
+    return SessionColumns.from_rows(gen())
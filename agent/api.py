@@ -1,109 +1,274 @@
 import datetime
-import json
 # from email.mime import message
 from multiprocessing import pool
+import uuid
+import json
+import asyncio
+import logging
+from typing import Optional
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
 
 from models import (
     StartSessionRequest,
     StartSessionResponse,
     SuggestResponse,
+    SuggestBatchRequest,
+    SuggestBatchResponse,
     AnswerEvent,
     EndSessionRequest,
     SessionSummary,
-    session_store
+    SessionAnalyticsRequest,
+    SessionAnalyticsResponse,
+    UserRollupResponse
 )
+from session_store import session_store, SessionRecord
 
 from helper import (
     make_session_id,
     now_utc,
     pick_strategy_tip,
-    decide_next_difficulty,
     fetch_question_id_for_topic,
     compute_session_stats,
     generate_message_with_optional_llm,
     get_pg_pool,
-    compute_mastery,
-    fetch_candidate_questions,
-    pick_question_from_candidates,
+    close_pg_pool,
+    pg_pool_stats,
+    mongo_client,
+    fetch_suggest_context,
+    fetch_batch_context,
+    record_answers,
+    answer_time,
+    SUGGEST_BATCH_MAX,
+    ensure_agent_tables,
+    fetch_candidate_tiers,
     questions_coll,
-    get_llm_response
+    get_question_doc,
+    get_llm_response,
+    call_llm_for_text,
+    strategy_tip_of
 )
+from question_index import question_index
+from exclusion import session_exclusions
+from policy import next_difficulty, candidate_tiers, pick_context, pick_question_from_candidates
+from sampling import question_sampler
+from irt import item_calibration, ability_step
+from mastery_store import MasteryState
+from feedback_stream import feedback_streams
+from llm_cache import llm_cache, timing_class
+from message_pool import message_pool, answer_key, summary_key
+from decision_writer import decision_writer
+from prompts import feedback_prompt, summary_prompt
+from prefetch import speculation, PREFETCH_ENABLED
+from rollup import rollup_args, user_rollups
+from schema import ensure_indexes, SCHEMA_ENSURE_INDEXES
+from wire import wire_server, WIRE_PORT
+import analytics
+import metrics
+from metrics import span
+
+from llm_instance import llm_initialized, llm_service, llm_batcher
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm everything a request needs before the worker accepts traffic,
+    and release it in reverse order on shutdown.
+    """
+    pool = await get_pg_pool()                # sized Postgres pool, min_size connections opened
+    await ensure_agent_tables()
+    if SCHEMA_ENSURE_INDEXES:
+        # idempotent; workers that find another one building skip rather than wait
+        await ensure_indexes(pool, questions_coll, wait=False)
+    await question_index.load(questions_coll)  # also opens the Mongo pool
+    question_index.start_refresh(questions_coll)
+    await item_calibration.load(pool)          # keyed by index ordinals, so after the index
+    item_calibration.start_refresh(pool)
+    await session_store.start()
+    decision_writer.start(pool)
+    if llm_service is not None:
+        if await llm_service.check_server():  # opens keep-alive connections, sets the breakers
+            logger.info("llama.cpp server reachable")
+        llm_service.start_probing()
+    message_pool.start(llm_service, call_llm_for_text)
+    metrics.snapshots.start()                 # with --prod, /metrics reports every worker
+    if WIRE_PORT:
+        await wire_server.start(int(WIRE_PORT))  # the routes registered below, over msgpack
+    try:
+        yield
+    finally:
+        await wire_server.stop()
+        await message_pool.stop()
+        await feedback_streams.stop()             # their decision traces are queued on completion
+        await speculation.stop()
+        await question_index.stop_refresh()
+        await item_calibration.stop_refresh()
+        await decision_writer.stop()
+        await session_store.close()
+        if llm_service is not None:
+            await llm_service.close()
+        await close_pg_pool()
+        mongo_client.close()
+        await metrics.snapshots.stop()
+
+app = FastAPI(title="MentalMath Agent", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Gauges and cumulative counts owned by other components, read when /metrics is scraped
+metrics.Callback("agent_pg_pool_connections", "asyncpg pool connections by state", pg_pool_stats, ("state",))
+metrics.Callback("agent_llm_in_flight", "Completions running on llama.cpp",
+                 lambda: llm_service.in_flight if llm_service else None)
+metrics.Callback("agent_llm_queued", "Completions waiting for a llama.cpp slot",
+                 lambda: llm_service.queued if llm_service else None)
+metrics.Callback("agent_llm_servers", "llama.cpp servers by circuit breaker state",
+                 lambda: {(state,): sum(s["state"] == state for s in llm_service.stats()["servers"])
+                          for state in ("closed", "half_open", "open")} if llm_service else None, ("state",))
+metrics.Callback("agent_llm_gateway_events_total", "Hedged requests, hedge wins, failovers and short circuits",
+                 lambda: {(k,): v for k, v in llm_service.stats().items()
+                          if k in ("hedges", "hedge_wins", "failovers", "short_circuits")} if llm_service else None,
+                 ("event",), kind="counter")
+metrics.Callback("agent_llm_batch_waiting", "Prompts waiting in the batcher window",
+                 lambda: llm_batcher.stats()["waiting"] if llm_batcher else None)
+metrics.Callback("agent_llm_cache_lookups_total", "LLM response cache lookups by result",
+                 lambda: {("hit",): llm_cache.hits, ("miss",): llm_cache.misses}, ("result",), kind="counter")
+metrics.Callback("agent_decision_queue", "Decision traces waiting to be written",
+                 lambda: decision_writer.stats()["queued"])
+metrics.Callback("agent_decision_traces_total", "Decision traces by outcome",
+                 lambda: {(k,): decision_writer.stats()[k] for k in ("written", "dropped", "failed")},
+                 ("outcome",), kind="counter")
+metrics.Callback("agent_rollup_queue", "Answer rollup updates waiting to be applied",
+                 lambda: decision_writer.stats()["rollups_queued"])
+metrics.Callback("agent_rollup_updates_total", "Answer rollup updates by outcome (retried counts failed attempts)",
+                 lambda: {(k,): decision_writer.stats()["rollups_" + k] for k in ("written", "retried", "lost")},
+                 ("outcome",), kind="counter")
+metrics.Callback("agent_question_index_size", "Questions in the in-process index", lambda: len(question_index))
+metrics.Callback("agent_sampler_events_total", "Sampler alias-table rebuilds and exact-pass fallbacks",
+                 lambda: {("rebuild",): question_sampler.rebuilds, ("fallback",): question_sampler.fallbacks},
+                 ("event",), kind="counter")
+metrics.Callback("agent_calibrated_items", "Questions with fitted IRT parameters", lambda: item_calibration.items)
+metrics.Callback("agent_session_exclusions", "Sessions with a cached exclusion set", lambda: len(session_exclusions))
+metrics.Callback("agent_prefetch_sessions", "Sessions with a speculative plan", lambda: len(speculation))
+metrics.Callback("agent_prefetch_events_total", "Speculative plans made, confirmed and missed, and write-behind outcomes",
+                 lambda: {(k,): v for k, v in speculation.stats().items() if k not in ("sessions", "unreplayed")},
+                 ("event",), kind="counter")
+metrics.Callback("agent_wire_connections", "Open wire protocol connections", lambda: len(wire_server))
 
-from llm_instance import llm_initialized
-
-app = FastAPI(title="MentalMath Agent")
 @app.post("/session/start", response_model=StartSessionResponse)
 async def start_session(req: StartSessionRequest):
     sid = req.sessionId or make_session_id()
     started = now_utc()
-    session_store[sid] = {
-        "sessionId": sid,
-        "userId": req.userId,
-        "topicOrder": req.topicOrder,
-        "startedAt": started,
-        "events": [],
-        "stats": {},
-        "last_prompt_time": started
-    }
+    await session_store.put(SessionRecord(
+        sessionId=sid,
+        userId=req.userId,
+        topicOrder=req.topicOrder,
+        startedAt=started,
+    ))
     return StartSessionResponse(sessionId=sid, startedAt=started)
 
 @app.post("/agent/suggest-next-question-final", response_model=SuggestResponse)
-async def suggest_next_question(event: AnswerEvent):
-    # Get Session from postgresql
-    pool = await get_pg_pool()
-    async with pool.acquire() as conn:
-        sess = await conn.fetchrow('SELECT id, "topicOrder", "startTime" FROM session WHERE id=$1', event.sessionId)
-    if not sess:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    # Compute Mastery of User in this topic
-    mastery = await compute_mastery(event.userId or "anonymous", event.topic)
+async def suggest_next_question(event: AnswerEvent, stream_message: bool = False):
+    """
+    Suggest the next question. With `stream_message=true` the response carries the
+    fallback message right away and the LLM message streams from
+    `/agent/feedback/{sessionId}/{decisionId}/stream`.
+    """
+    # With the index loaded, answered questions live in the session's exclusion set, and the
+    # next question was planned for each likely answer while this one was being answered:
+    # a confirmed plan answers without I/O and the answer is recorded behind the response.
+    exclude = session_exclusions.get(event.sessionId) if question_index.loaded else None
+    branch = None
+    if exclude is not None and PREFETCH_ENABLED:
+        await speculation.settle(event.sessionId)
+        plan = speculation.take(event.sessionId)
+        confirmed = speculation.confirm(plan, event, exclude) if plan is not None else None
+        if confirmed is not None:
+            branch, mastery = confirmed
+            theta = plan.theta
+    if branch is None:
+        # Session row, answered ids, updated mastery and ability in a single Postgres round trip;
+        # with an exclusion set only the rows it hasn't seen yet come back
+        with span("suggest_context"):
+            sess, answered_ids, mastery, theta = await fetch_suggest_context(event, exclude)
+        if not sess:
+            raise HTTPException(status_code=404, detail="Session not found")
 
     # Decide next difficulty based upon that mastery
-    next_diff = max(1, min(5, event.difficulty + (1 if (mastery >= 0.8 and event.wasCorrect and event.timeTaken <= event.estimatedTime*0.9) else (-1 if (not event.wasCorrect or event.timeTaken > event.estimatedTime*1.5) else 0))))
+    next_diff = next_difficulty(event.difficulty, event.wasCorrect, event.timeTaken, event.estimatedTime, mastery)
 
     # Decide selection policy
     remedial = False
     if not event.wasCorrect:
         remedial = True
 
-    # Gather Exclude lists (Questions already put in to user session)
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT "questionId" FROM question_session WHERE "sessionId"=$1', event.sessionId)
-    answered_ids = [r['questionId'] for r in rows]
-
-    print("Answered IDs:", answered_ids)
-
-    # Candidate selection based upon subtopic/skill at same or difficult level
-    candidates = []
-    if remedial:
-        # try same subtopic with same difficulty for now
-        candidates = await fetch_candidate_questions(event.topic, event.difficulty, answered_ids, subtopic=event.subtopic)
-        if not candidates:
-            candidates = await fetch_candidate_questions(event.topic, event.difficulty-1, answered_ids, subtopic=event.subtopic)
+    # The answered question's subtopic (the backend sends it; the index is authoritative)
+    answered = question_index.get(event.questionId)
+    subtopic = answered.subtopic if answered else event.subTopic
+
+    candidates = None
+    if branch is not None:
+        # speculative hit: the branch's pick, made against the same exclusion set and index version
+        question_sampler.record_answer(event.questionId, event.wasCorrect)
+        rec = branch.record
+        if rec is not None:
+            question_sampler.commit(rec)
+        picked = rec.id if rec else None
+        speculation.persist(event, exclude, mastery, rec)
     else:
-        candidates = await fetch_candidate_questions(event.topic, next_diff, answered_ids)
-
-    # Fallback to any question if no candidates found
-    if not candidates:
-        candidates = await fetch_candidate_questions(event.topic, None, answered_ids)
+        # Candidate tiers based upon subtopic/skill at same or easier level, falling back to any question
+        tiers = candidate_tiers(event.wasCorrect, event.difficulty, next_diff, subtopic)
+        remaining_seconds = max(0, 3600 - int((datetime.datetime.utcnow() - sess['startTime']).total_seconds()))
+        if exclude is not None:
+            # index loaded: weighted O(1) draw from the tier's cached alias table
+            question_sampler.record_answer(event.questionId, event.wasCorrect)
+            ctx = pick_context(event.wasCorrect, answered.mentalSkill if answered else (), remaining_seconds,
+                               theta=theta)
+            with span("pick"):
+                rec = question_sampler.pick(event.topic, tiers, exclude, ctx)
+            picked = rec.id if rec else None
+            if rec is not None and PREFETCH_ENABLED:
+                with span("prefetch_plan"):
+                    speculation.schedule(event.sessionId, rec, sess, theta, exclude)
+        else:
+            # tiers resolved together in one Mongo query
+            candidates = await fetch_candidate_tiers(event.topic, tiers, answered_ids)
+            with span("pick"):
+                picked = pick_question_from_candidates(candidates, remaining_seconds)
+
+    if metrics.sampled():
+        logger.info(json.dumps({
+            "event": "suggest",
+            "sessionId": event.sessionId,
+            "answered": len(exclude) if exclude is not None else len(answered_ids),
+            "candidates": [str(c["_id"]) for c in candidates] if candidates is not None else "sampled",
+            "picked": str(picked) if picked else None,
+            "nextDifficulty": next_diff,
+            "mastery": round(mastery, 3),
+            "theta": round(theta, 3) if theta is not None else None,
+        }))
 
-    print("Candidates:", candidates)
+    if branch is not None:
+        strategy_tip = branch.strategy_tip
+    elif picked:
+        with span("question_doc"):
+            strategy_tip = strategy_tip_of(await get_question_doc(picked) or {})
+    else:
+        strategy_tip = strategy_tip_of(None)
 
-    # Now compose message for user
-    remaining_seconds = max(0, 3600 - int((datetime.datetime.utcnow() - sess['startTime']).total_seconds()))
-    picked = pick_question_from_candidates(candidates, remaining_seconds)
+    return await _respond(event, picked, next_diff, mastery, remedial, subtopic, strategy_tip,
+                          stream_message, branch)
 
-    print("Picked:", picked)
+async def _respond(event: AnswerEvent, picked, next_diff: int, mastery: float, remedial: bool,
+                   subtopic: Optional[str], strategy_tip: Optional[str], stream_message: bool,
+                   branch=None) -> SuggestResponse:
+    """The message for a decided suggestion, its queued decision trace, and the response."""
+    # the answer's rollup update goes on its own queue, which never drops (traces may)
+    with span("rollup_submit"):
+        await decision_writer.submit_rollup(rollup_args(event.userId, event.topic, subtopic, event.difficulty,
+                                                        event.wasCorrect, event.timeTaken, event.questionId))
 
-    chosen_doc = None
-    if picked:
-        chosen_doc = await questions_coll.find_one({"_id": picked})
-        strategy_tip = chosen_doc.get("strategyTip") or (chosen_doc.get("hints") or [None])[0]
-    else:
-        strategy_tip = "Try breaking problems into smaller parts."
-    
     # compose message (LLM optional) - here we use simple fallback
     if not event.wasCorrect:
         fallback_msg = f"Don't worry — try this: {strategy_tip}"
@@ -112,50 +277,53 @@ async def suggest_next_question(event: AnswerEvent):
 
     # Generate personalized agent message using LLaMA
     agent_message = fallback_msg  # default fallback
-    if event.wasCorrect:
-        prompt = f"""As a supportive math tutor, give a brief encouraging response (max 2 sentences) to a student who just correctly solved a {event.topic} question in {event.timeTaken} seconds (estimated time was {event.estimatedTime} seconds).
-        Their mastery level is {mastery:.1%}.
-        Next question will be difficulty level {next_diff}/5.
-        Keep the tone positive and motivating."""
+    cache_key, prompt = feedback_prompt(event.topic, event.wasCorrect, mastery,
+                                        timing_class(event.timeTaken, event.estimatedTime), next_diff, strategy_tip)
+
+    def record(llm_response: Optional[str]) -> None:
+        # queue agent decision trace (written behind to the agent_decision table)
+        with span("decision_submit"):
+            decision_writer.submit(
+                event.sessionId,
+                event.questionId,
+                str(picked) if picked else None,
+                next_diff,
+                mastery,
+                "remedial" if remedial else "progress",
+                {
+                    "mastery": mastery,
+                    "prompt": prompt.text,
+                    "llm_response": llm_response if llm_response else None,
+                    "decision_id": decision_id
+                })
+
+    decision_id = None
+    llm_response = None
+    cached = llm_cache.get(cache_key) if stream_message else None
+    if branch is not None and branch.message and branch.cache_key == cache_key:
+        agent_message = llm_response = branch.message  # generated while the question was answered
+    elif cached:
+        agent_message = cached
+    elif stream_message:
+        # the trace is queued with the streamed text once generation finishes
+        decision_id = uuid.uuid4().hex
+        feedback_streams.start(event.sessionId, decision_id, prompt, fallback_msg, cache_key, on_done=record)
     else:
-        prompt = f"""As a supportive math tutor, give a brief encouraging response (max 2 sentences) to a student who just attempted a {event.topic} question but made a mistake.
-        Their mastery level is {mastery:.1%}.
-        Include this strategy tip: {strategy_tip}
-        Keep the tone supportive and constructive."""
-
-    llm_response = await get_llm_response(prompt)
-    if llm_response:
-        agent_message = llm_response.strip()
+        # when llama.cpp is saturated, don't queue behind it: a cached variant, else a pre-generated message
+        if llm_service is None or not llm_service.saturated:
+            with span("llm"):
+                llm_response = await get_llm_response(prompt, cache_key=cache_key)
+        else:
+            llm_response = llm_cache.get(cache_key)
+        if llm_response:
+            agent_message = llm_response.strip()
+        else:
+            pooled = message_pool.take(answer_key(event.topic, event.wasCorrect, next_diff))
+            if pooled:
+                agent_message = pooled if event.wasCorrect else f"{pooled} Try this: {strategy_tip}"
 
-    # store agent decision trace (insert into Postgres agent_decisions table)
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS agent_decision (
-                id SERIAL PRIMARY KEY,
-                session_id UUID NOT NULL,
-                prev_question_id VARCHAR(32),
-                next_question_id VARCHAR(32),
-                next_difficulty INT,
-                mastery FLOAT,
-                reason VARCHAR(32),
-                trace JSONB,
-                created_at TIMESTAMP DEFAULT NOW()
-            )
-        """)
-        await conn.execute("""
-            INSERT INTO agent_decision(session_id, prev_question_id, next_question_id, next_difficulty, mastery, reason, trace)
-            VALUES ($1,$2,$3,$4,$5,$6,$7)
-        """, event.sessionId, 
-        event.questionId, 
-        str(picked) if picked else None, 
-        next_diff, 
-        float(mastery), 
-        "remedial" if remedial else "progress", 
-        json.dumps({
-            "mastery": mastery,
-            "prompt": prompt,
-            "llm_response": llm_response if llm_response else None
-        }))
+    if decision_id is None:
+        record(llm_response)
 
     reflection = "What method did you try?" if not event.wasCorrect else None
 
@@ -165,9 +333,81 @@ async def suggest_next_question(event: AnswerEvent):
         strategyTip=strategy_tip,
         message=agent_message,
         reflectionPrompt=reflection,
+        decisionId=decision_id,
         trace={"mastery": mastery, "remedial": remedial}
     )
 
+@app.post("/agent/suggest-next-questions", response_model=SuggestBatchResponse)
+async def suggest_next_questions(req: SuggestBatchRequest, defer_message: bool = False):
+    """
+    Suggestions for many AnswerEvents, across sessions, in request order. Answers of one
+    session are applied in order, as if sent one by one, but sessions, mastery and ability
+    are read with two set-based queries and the answers written in one pipelined batch.
+    With `defer_message=true` LLM messages stream from the feedback endpoint, as with
+    `stream_message` on the single call.
+    """
+    events = req.events
+    if len(events) > SUGGEST_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {SUGGEST_BATCH_MAX} events per batch")
+    if not question_index.loaded:
+        # no exclusion sets to fold a session's answers into: one call per event
+        return SuggestBatchResponse(suggestions=[await suggest_next_question(e, defer_message) for e in events])
+
+    session_ids = list(dict.fromkeys(e.sessionId for e in events))
+    for sid in session_ids:
+        await speculation.settle(sid)  # a pending speculative write is recorded first
+        speculation.drop(sid)          # and plans for a single next answer don't apply
+    exclusions = {sid: session_exclusions.get(sid) for sid in session_ids}
+    with span("batch_context"):
+        sessions, states, abilities = await fetch_batch_context(events, exclusions)
+    missing = [sid for sid in session_ids if sid not in sessions]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Sessions not found: {', '.join(missing)}")
+
+    # Each event's decision, as the single call makes it; mastery and ability are stepped
+    # locally with the same updates the write applies
+    decisions = []
+    now = datetime.datetime.utcnow()
+    with span("batch_pick"):
+        for event in events:
+            user = event.userId or "anonymous"
+            state = states.setdefault((user, event.topic), MasteryState())
+            state.apply(event.wasCorrect, answer_time(event), event.questionId)
+            mastery = state.mastery()
+            ability = abilities[user] = ability_step(
+                abilities.get(user), *item_calibration.params(event.questionId), event.wasCorrect, event.questionId)
+            theta = ability[0] if ability else None
+
+            next_diff = next_difficulty(event.difficulty, event.wasCorrect, event.timeTaken, event.estimatedTime, mastery)
+            answered = question_index.get(event.questionId)
+            subtopic = answered.subtopic if answered else event.subTopic
+            tiers = candidate_tiers(event.wasCorrect, event.difficulty, next_diff, subtopic)
+            started = sessions[event.sessionId]["startTime"]
+            remaining_seconds = max(0, 3600 - int((now - started).total_seconds()))
+            question_sampler.record_answer(event.questionId, event.wasCorrect)
+            ctx = pick_context(event.wasCorrect, answered.mentalSkill if answered else (), remaining_seconds,
+                               theta=theta)
+            rec = question_sampler.pick(event.topic, tiers, exclusions[event.sessionId], ctx)
+            decisions.append((event, rec.id if rec else None, next_diff, mastery, not event.wasCorrect,
+                              subtopic, strategy_tip_of(rec.as_doc() if rec else None)))
+
+    with span("batch_record"):
+        await record_answers(events)
+    # messages for the whole batch at once, so the LLM batcher can coalesce them
+    suggestions = await asyncio.gather(*(_respond(*d, stream_message=defer_message) for d in decisions))
+    return SuggestBatchResponse(suggestions=list(suggestions))
+
+@app.get("/agent/feedback/{session_id}/{decision_id}/stream")
+async def stream_feedback(session_id: str, decision_id: str):
+    """Server-Sent Events stream of the LLM message for one suggestion."""
+    if feedback_streams.get(session_id, decision_id) is None:
+        raise HTTPException(status_code=404, detail="Feedback not found")
+    return StreamingResponse(
+        feedback_streams.sse_events(session_id, decision_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Implemented for backend service
 # @app.post("/agent/suggest-next-question", response_model=SuggestResponse)
 # async def suggest_next(event: AnswerEvent):
@@ -231,55 +471,88 @@ async def suggest_next_question(event: AnswerEvent):
 
 @app.post("/session/end", response_model=SessionSummary)
 async def end_session(req: EndSessionRequest):
-    if req.sessionId not in session_store:
+    s = await session_store.get(req.sessionId)
+    if s is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    s = session_store[req.sessionId]
     endedAt = now_utc()
-    events = s.get("events", [])
+    events = s.events
+    try:
+        await speculation.settle(req.sessionId)  # records a speculative answer write that failed
+    except Exception as e:
+        logger.warning(f"Replaying a failed answer write for {req.sessionId} failed; retried on shutdown: {e!r}")
+    session_exclusions.drop(req.sessionId)
+    speculation.drop(req.sessionId)
 
     per_topic = compute_session_stats(events)
-    total_questions = sum(v["count"] for v in per_topic.values()) if per_topic else 0
-    total_correct = sum(v["correct"] for v in per_topic.values()) if per_topic else 0
-    overall_accuracy = round(100 * total_correct / total_questions, 2) if total_questions else 0.0
+    overall_accuracy = analytics.overall_accuracy(per_topic)
 
     # Create recommendations (simple heuristics)
-    recommendations = []
-    for topic, stats in per_topic.items():
-        if stats["accuracy"] < 70:
-            recommendations.append(f"Review basics of {topic} and try 10 easy questions.")
-        elif stats["accuracy"] < 90:
-            recommendations.append(f"Practice more problems in {topic} at current difficulty to improve speed.")
-        else:
-            recommendations.append(f"Try advanced questions in {topic} to challenge yourself.")
+    recommendations = analytics.recommendations(per_topic)
 
     # Optionally, generate a nicer summary with LLM
-    prompt = f"""Session summary:
-    sessionId: {req.sessionId}
-    perTopic: {per_topic}
-    overall accuracy: {overall_accuracy}
-    Provide a concise friendly summary + 2 actionable recommendations."""
+    cache_key, prompt = summary_prompt(overall_accuracy, per_topic)
 
-    llm_summary = await generate_message_with_optional_llm(prompt, "")
+    if llm_service is None or not llm_service.saturated:
+        llm_summary = await generate_message_with_optional_llm(prompt, "", cache_key=cache_key)
+    else:
+        llm_summary = llm_cache.get(cache_key) or ""
+    if not llm_summary:
+        llm_summary = message_pool.take(summary_key(overall_accuracy))
 
     if llm_summary:
         recommendations.insert(0, llm_summary)
 
-    # persist summary into session store (in real life -> write to SQL)
-    s["endedAt"] = endedAt
-    s["perTopicStats"] = per_topic
-    s["overallAccuracy"] = overall_accuracy
-    s["recommendations"] = recommendations
+    # persist summary into session store
+    s.endedAt = endedAt
+    s.perTopicStats = per_topic
+    s.overallAccuracy = overall_accuracy
+    s.recommendations = recommendations
+    await session_store.put(s)
 
     return SessionSummary(
         sessionId=req.sessionId,
-        startedAt=s["startedAt"],
+        startedAt=s.startedAt,
         endedAt=endedAt,
         perTopicStats=per_topic,
         overallAccuracy=overall_accuracy,
         recommendations=recommendations
     )
 
+@app.post("/analytics/sessions", response_model=SessionAnalyticsResponse)
+async def session_analytics(req: SessionAnalyticsRequest):
+    """Per-topic stats for many sessions (by id and/or user) in one vectorized pass."""
+    cols = await analytics.load_columns(await get_pg_pool(), question_index, req.sessionIds, req.userIds)
+    sessions = analytics.summarize(cols)
+    return SessionAnalyticsResponse(
+        sessions=sessions,
+        overallAccuracy={sid: analytics.overall_accuracy(per_topic) for sid, per_topic in sessions.items()},
+    )
+
+@app.get("/analytics/users/{user_id}/rollup", response_model=UserRollupResponse)
+async def user_rollup(user_id: str, topic: Optional[str] = None):
+    """A user's lifetime and recent stats per topic, subtopic and difficulty, from the maintained rollups."""
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        rows = await user_rollups(conn, user_id, topic)
+    return UserRollupResponse(userId=user_id, rollups=rows)
+
+# The same routes over the binary wire protocol (wire.py): same models, same handlers
+wire_server.route("/session/start", StartSessionRequest, start_session)
+wire_server.route("/agent/suggest-next-question-final", AnswerEvent, suggest_next_question, stream_message=bool)
+wire_server.route("/agent/suggest-next-questions", SuggestBatchRequest, suggest_next_questions, defer_message=bool)
+wire_server.route("/session/end", EndSessionRequest, end_session)
+wire_server.route("/analytics/sessions", SessionAnalyticsRequest, session_analytics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text exposition: this worker's metrics, or all workers' under --prod (AGENT_METRICS_DIR)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Health check
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "llm_initialized": llm_initialized}
\ No newline at end of file
+    return {"status": "ok", "llm_initialized": llm_initialized, "llm_cache": llm_cache.stats(),
+            "llm_batcher": llm_batcher.stats() if llm_batcher else None,
+            "llm_gateway": llm_service.stats() if llm_service else None,
+            "decision_writer": decision_writer.stats(), "sampler": question_sampler.stats(),
+            "prefetch": speculation.stats(), "wire": {"port": wire_server.port, "connections": len(wire_server)}}
\ No newline at end of file
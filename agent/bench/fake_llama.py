@@ -0,0 +1,113 @@
+# bench/fake_llama.py
+# Local stand-in for llama.cpp's server: GET / and POST /completion
+# (plain, multi-prompt and `stream: true`), with configurable latency and token rate.
+# With --prompt-ms-per-token, prompt processing costs time per token not found in a slot's
+# KV cache (`cache_prompt: true` reuses the longest common prefix with a recent prompt).
+# Standalone: python -m bench.fake_llama --port 8080 --latency-ms 200 --tokens-per-sec 30
+import os
+import json
+import random
+import asyncio
+from collections import deque
+import argparse
+from aiohttp import web
+
+REPLY = "Great effort — you are getting faster. Keep breaking problems into smaller steps!"
+
+
+class FakeLlamaServer:
+    def __init__(self, latency_ms: float = 200, tokens_per_sec: float = 30, reply_tokens: int = 24,
+                 slow_fraction: float = 0.0, slow_factor: float = 10.0,
+                 prompt_ms_per_token: float = 0.0, slots: int = 8):
+        self.latency = latency_ms / 1000.0
+        self.slow_fraction = slow_fraction  # share of requests that take slow_factor x as long (tail latency)
+        self.slow_factor = slow_factor
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self._slots: "deque[str]" = deque(maxlen=slots)  # recent prompts, standing in for slot KV caches
+        self.tokens_evaluated = 0
+        self.tokens_cached = 0
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.requests = 0
+        self.prompts = 0
+        self._runner = None
+
+    def _tokens(self, n_predict: int) -> list:
+        words = REPLY.split(" ")
+        n = min(n_predict, self.reply_tokens)
+        return [(" " if i else "") + words[i % len(words)] for i in range(n)]
+
+    def _process_prompt(self, prompt: str, cache_prompt: bool) -> dict:
+        """Token accounting (about 4 characters per token) and the simulated prompt time."""
+        cached = 0
+        if cache_prompt:
+            cached = max((len(os.path.commonprefix([prompt, p])) for p in self._slots), default=0)
+        self._slots.append(prompt)
+        n_cached, n_prompt = cached // 4, max(1, len(prompt) // 4)
+        evaluated = n_prompt - n_cached
+        self.tokens_evaluated += evaluated
+        self.tokens_cached += n_cached
+        return {"tokens_evaluated": evaluated, "tokens_cached": n_cached,
+                "timings": {"prompt_n": evaluated, "prompt_ms": evaluated * self.prompt_ms_per_token}}
+
+    async def _root(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def _completion(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+        self.requests += 1
+        self.prompts += len(prompts)
+        tokens = self._tokens(int(payload.get("n_predict", 512)))
+        slow = self.slow_factor if random.random() < self.slow_fraction else 1.0
+        stats = [self._process_prompt(p, bool(payload.get("cache_prompt"))) for p in prompts]
+        prompt_seconds = sum(st["timings"]["prompt_ms"] for st in stats) / 1000.0
+        await asyncio.sleep(self.latency * slow + prompt_seconds)
+
+        if payload.get("stream"):
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            for tok in tokens:
+                await asyncio.sleep(1.0 / self.tokens_per_sec)
+                await resp.write(f"data: {json.dumps({'content': tok, 'stop': False})}\n\n".encode())
+            await resp.write(f"data: {json.dumps({'content': '', 'stop': True, **stats[0]})}\n\n".encode())
+            await resp.write_eof()
+            return resp
+
+        await asyncio.sleep(len(tokens) / self.tokens_per_sec * slow)
+        results = [{"content": "".join(tokens), "stop": True, **st} for st in stats]
+        return web.json_response(results if isinstance(payload["prompt"], list) else results[0])
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving; returns the base URL (port 0 picks a free port)."""
+        app = web.Application()
+        app.router.add_get("/", self._root)
+        app.router.add_post("/completion", self._completion)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _serve(args) -> None:
+    server = FakeLlamaServer(args.latency_ms, args.tokens_per_sec, args.reply_tokens,
+                             prompt_ms_per_token=args.prompt_ms_per_token)
+    url = await server.start(port=args.port)
+    print(f"fake llama.cpp listening on {url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake llama.cpp /completion server")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-sec", type=float, default=30)
+    parser.add_argument("--reply-tokens", type=int, default=24)
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0.0)
+    asyncio.run(_serve(parser.parse_args()))
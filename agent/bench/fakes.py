@@ -0,0 +1,278 @@
+# bench/fakes.py
+# In-memory stand-ins for the asyncpg pool and the motor questions collection.
+# They understand exactly the statements the agent issues (matched by identity with
+# the SQL constants) and count every round trip, attributed to the current request.
+import random
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+import helper
+from mastery_store import MasteryState, SELECT_SQL, RECORD_SQL, UPSERT_SQL, MASTERY_DDL
+from decision_writer import AGENT_DECISION_DDL
+from irt import ITEM_PARAMS_SQL, ability_step
+import rollup
+import schema
+from models import STRATEGY_TIPS
+
+# per-request counters; the driver sets a fresh dict around each call
+request_counters: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar(
+    "request_counters", default=None)
+
+totals: Dict[str, int] = {"pg": 0, "mongo": 0}
+
+
+def _count(kind: str) -> None:
+    totals[kind] += 1
+    counters = request_counters.get()
+    if counters is not None:
+        counters[kind] = counters.get(kind, 0) + 1
+
+
+# ---------------- Postgres ----------------
+
+class FakeDatabase:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000  # per round trip
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.question_sessions: Dict[str, List[Dict[str, Any]]] = {}
+        self.mastery: Dict[tuple, MasteryState] = {}
+        self.abilities: Dict[str, list] = {}  # user -> [theta, info, last_question_id]
+        self.decisions: List[tuple] = []
+        self.rollups: Dict[tuple, rollup.RollupState] = {}
+
+    def add_session(self, session_id: str, user_id: str, topic_order: List[str]) -> None:
+        self.sessions[session_id] = {"id": session_id, "userId": user_id,
+                                     "topicOrder": topic_order, "startTime": datetime.utcnow()}
+        self.question_sessions[session_id] = []
+
+    def serve_question(self, session_id: str, question_id: str) -> None:
+        """What the backend does after a suggestion: add a question_session row."""
+        self.question_sessions[session_id].append({"questionId": question_id})
+
+    def _record(self, user_id, topic, correct, time_taken, question_id) -> Optional[MasteryState]:
+        state = self.mastery.get((user_id, topic))
+        if state is None:
+            state = self.mastery[(user_id, topic)] = MasteryState()
+        elif state.last_question_id == question_id:
+            return None
+        state.apply(bool(correct), time_taken, question_id)
+        return state
+
+    def _ability(self, user_id, correct, question_id, a, b) -> Optional[float]:
+        ability = ability_step(self.abilities.get(user_id), a, b, correct, question_id)
+        if ability is not None:
+            self.abilities[user_id] = ability
+        return ability[0] if ability else None
+
+
+class FakeConnection:
+    def __init__(self, db: FakeDatabase):
+        self.db = db
+
+    async def _round_trip(self) -> None:
+        _count("pg")
+        if self.db.latency:
+            await asyncio.sleep(self.db.latency)
+
+    async def execute(self, sql: str, *args) -> str:
+        await self._round_trip()
+        if sql in (MASTERY_DDL, AGENT_DECISION_DDL) or sql.lstrip().startswith("CREATE"):
+            return "CREATE TABLE"
+        raise NotImplementedError(sql)
+
+    async def fetchrow(self, sql: str, *args):
+        await self._round_trip()
+        return self._fetchrow(sql, *args)
+
+    def _fetchrow(self, sql: str, *args):
+        if sql is helper.SUGGEST_CONTEXT_SQL:
+            user_id, topic, correct, time_taken, question_id = args[:5]
+            sess = self.db.sessions.get(args[8])
+            if sess is None:
+                return None
+            state = self.db._record(user_id, topic, correct, time_taken, question_id) \
+                or self.db.mastery[(user_id, topic)]
+            row = dict(sess)
+            row["answered_ids"] = [r["questionId"] for r in self.db.question_sessions[sess["id"]]][args[9]:]
+            row.update({f: getattr(state, f) for f in MasteryState.__slots__ if f != "last_question_id"})
+            row["theta"] = self.db._ability(user_id, correct, question_id, args[10], args[11])
+            return row
+        if sql is RECORD_SQL:
+            state = self.db._record(*args[:5])
+            return None if state is None else {f: getattr(state, f) for f in MasteryState.__slots__}
+        if sql is SELECT_SQL:
+            state = self.db.mastery.get((args[0], args[1]))
+            return None if state is None else {f: getattr(state, f) for f in MasteryState.__slots__}
+        raise NotImplementedError(sql)
+
+    async def fetch(self, sql: str, *args):
+        await self._round_trip()
+        if sql in (ITEM_PARAMS_SQL, schema.PG_INDEX_STATE_SQL):
+            return []
+        if sql is helper.BATCH_SESSIONS_SQL:
+            return [{**self.db.sessions[sid], "n": n,
+                     "answered_ids": [r["questionId"] for r in self.db.question_sessions[sid]][known:]}
+                    for n, (sid, known) in enumerate(zip(*args), 1) if sid in self.db.sessions]
+        if sql is helper.BATCH_STATE_SQL:
+            rows = []
+            for user_id, topic in zip(*args):
+                state, ability = self.db.mastery.get((user_id, topic)), self.db.abilities.get(user_id)
+                row = {"user_id": user_id, "topic": topic,
+                       **{f: getattr(state, f) if state else None for f in MasteryState.__slots__}}
+                row.update(zip(("theta", "info", "ability_question_id"), ability or (None, None, None)))
+                rows.append(row)
+            return rows
+        if sql is rollup.SELECT_SQL:
+            return [{**dict(zip(rollup.ROLLUP_KEY, key)), **{f: getattr(state, f) for f in rollup.ROLLUP_STATE}}
+                    for key, state in sorted(self.db.rollups.items())
+                    if key[0] == args[0] and args[1] in (None, key[1])]
+        raise NotImplementedError(sql)
+
+    async def executemany(self, sql: str, rows) -> None:
+        await self._round_trip()
+        if sql is UPSERT_SQL:
+            return
+        if sql is helper.SUGGEST_CONTEXT_SQL:
+            for args in rows:
+                self._fetchrow(sql, *args)
+            return
+        if sql is rollup.RECORD_SQL:
+            for args in rows:
+                state = self.db.rollups.setdefault(tuple(args[:4]), rollup.RollupState())
+                state.apply(args[4], args[5], args[6])
+            return
+        self.db.decisions.extend(rows)
+
+    async def copy_records_to_table(self, table: str, records, columns=None) -> str:
+        await self._round_trip()
+        if table == "agent_decision":
+            self.db.decisions.extend(records)
+        return f"COPY {len(records)}"
+
+
+class FakePool:
+    def __init__(self, db: FakeDatabase, size: int = 10):
+        self.db = db
+        self.size = size
+        self.in_use = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.in_use += 1
+        try:
+            yield FakeConnection(self.db)
+        finally:
+            self.in_use -= 1
+
+    def get_size(self) -> int:
+        return self.size
+
+    def get_idle_size(self) -> int:
+        return self.size - self.in_use
+
+    async def close(self) -> None:
+        pass
+
+
+# ---------------- Mongo ----------------
+
+def make_question_bank(per_bucket: int = 20, subtopics: int = 3) -> List[Dict[str, Any]]:
+    """Synthetic questions for every STRATEGY_TIPS topic x difficulty x subtopic."""
+    docs = []
+    now = datetime.utcnow()
+    for topic in STRATEGY_TIPS:
+        for difficulty in range(1, 6):
+            for s in range(subtopics):
+                for _ in range(per_bucket):
+                    docs.append({
+                        "_id": ObjectId(), "topic": topic, "subtopic": f"{topic}-{s}",
+                        "difficulty": difficulty, "mentalSkill": [random.choice(["chunking", "complements", "visualization"])],
+                        "estimatedTime": random.choice([20, 30, 45, 60]),
+                        "hints": ["Break it down."] if random.random() < 0.5 else [],
+                        "strategyTip": random.choice(STRATEGY_TIPS[topic]), "updatedAt": now,
+                    })
+    return docs
+
+
+def _matches(doc: Dict[str, Any], q: Dict[str, Any]) -> bool:
+    for k, v in q.items():
+        if isinstance(v, dict):
+            if "$nin" in v and doc.get(k) in v["$nin"]:
+                return False
+            if "$in" in v and doc.get(k) not in v["$in"]:
+                return False
+            if "$gt" in v and not (doc.get(k) and doc[k] > v["$gt"]):
+                return False
+        elif doc.get(k) != v:
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    if not projection:
+        return dict(doc)
+    return {k: doc[k] for k in projection if k in doc}
+
+
+class _Cursor:
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self._docs = docs
+
+    def __aiter__(self):
+        self._it = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return self._docs if length is None else self._docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self.docs = docs
+
+    def find(self, q=None, projection=None) -> _Cursor:
+        _count("mongo")
+        return _Cursor([_project(d, projection) for d in self.docs if _matches(d, q or {})])
+
+    async def find_one(self, q=None, projection=None):
+        _count("mongo")
+        return next((_project(d, projection) for d in self.docs if _matches(d, q or {})), None)
+
+    def aggregate(self, pipeline) -> _Cursor:
+        _count("mongo")
+        docs = [d for d in self.docs if _matches(d, pipeline[0]["$match"])]
+        out = {}
+        for name, stages in pipeline[1]["$facet"].items():
+            sub = docs
+            for stage in stages:
+                if "$match" in stage:
+                    sub = [d for d in sub if _matches(d, stage["$match"])]
+                elif "$limit" in stage:
+                    sub = sub[:stage["$limit"]]
+                elif "$project" in stage:
+                    sub = [_project(d, stage["$project"]) for d in sub]
+            out[name] = sub
+        return _Cursor([out])
+
+    async def create_indexes(self, models) -> List[str]:
+        _count("mongo")
+        return [m.document["name"] for m in models]
+
+    async def estimated_document_count(self) -> int:
+        return len(self.docs)
+
+    def watch(self, *args, **kwargs):
+        # behave like a standalone server: the index falls back to polling
+        raise OperationFailure("The $changeStream stage is only supported on replica sets")
@@ -0,0 +1,250 @@
+# bench/run.py
+# Load test for the agent API against local stand-ins (fake llama.cpp, in-memory Postgres/Mongo).
+# Simulated students run concurrently: /session/start, N x /agent/suggest-next-question-final, /session/end.
+#
+#   cd agent
+#   python -m bench.run --students 200 --answers 10 --concurrency 50
+#   python -m bench.run --save-baseline            # write bench/baseline.json
+#   python -m bench.run --compare                  # fail if p95/p99/rps regress past --tolerance
+#   python -m bench.run --llm-servers 3 --llm-down 1 --llm-slow-fraction 0.05   # gateway failover/hedging
+#   python -m bench.run --batch                    # offline sync: each session's answers in one batch call
+#
+# Reports p50/p95/p99 latency and requests/sec per endpoint, plus Postgres and Mongo
+# round trips and LLM calls per answer.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import List, Dict, Any
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def summarize(latencies: Dict[str, List[float]], elapsed: float) -> Dict[str, Any]:
+    out = {}
+    for endpoint, values in latencies.items():
+        out[endpoint] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        }
+    return out
+
+
+async def run(args) -> Dict[str, Any]:
+    # stand-ins must be configured before the agent modules are imported
+    from bench.fake_llama import FakeLlamaServer
+    servers = [FakeLlamaServer(args.llm_latency_ms, args.llm_tokens_per_sec, slow_fraction=args.llm_slow_fraction,
+                               prompt_ms_per_token=args.llm_prompt_ms_per_token)
+               for _ in range(args.llm_servers)]
+    urls = [await s.start() for s in servers]
+    for s in servers[:args.llm_down]:
+        await s.stop()  # refuses connections: the gateway's breakers should route around it
+    os.environ["LLAMA_SERVER_URLS"] = ",".join(urls)
+    os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1/bench")
+    os.environ.setdefault("DATABASE_URL", "postgresql://bench@127.0.0.1:1/bench")
+    os.environ.setdefault("SESSION_STORE", "memory")
+
+    import httpx
+    import helper
+    import api
+    from bench import fakes
+
+    db = fakes.FakeDatabase(args.pg_latency_ms)
+    coll = fakes.FakeCollection(fakes.make_question_bank(args.questions_per_bucket))
+    helper.pg_pool = fakes.FakePool(db)
+    helper.questions_coll = coll
+    api.questions_coll = coll
+    topics = sorted({d["topic"] for d in coll.docs})
+    by_id = {str(d["_id"]): d for d in coll.docs}
+
+    suggest_name = "suggest_batch" if args.batch else "suggest"
+    latencies: Dict[str, List[float]] = {"start": [], suggest_name: [], "end": []}
+    suggest_counts: List[Dict[str, int]] = []
+    answered = 0
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def timed(client, name: str, path: str, body: dict, params=None):
+        counters: Dict[str, int] = {}
+        token = fakes.request_counters.set(counters)
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post(path, json=body, params=params)
+        finally:
+            fakes.request_counters.reset(token)
+        latencies[name].append(time.perf_counter() - t0)
+        if name == suggest_name:
+            suggest_counts.append(counters)
+        return resp
+
+    def answer(uid: str, sid: str, topic: str, question: Dict[str, Any]) -> Dict[str, Any]:
+        est = question.get("estimatedTime", 30)
+        return {
+            "userId": uid, "sessionId": sid, "questionId": str(question["_id"]),
+            "topic": topic, "subTopic": question.get("subtopic"),
+            "difficulty": question["difficulty"], "wasCorrect": random.random() < 0.7,
+            "timeTaken": max(1.0, random.gauss(est, est / 3)), "estimatedTime": est,
+        }
+
+    async def student(client, n: int) -> None:
+        nonlocal errors, answered
+        async with sem:
+            sid, uid = str(uuid.uuid4()), f"user-{n}"
+            topic = random.choice(topics)
+            db.add_session(sid, uid, [topic])
+            await timed(client, "start", "/session/start", {"sessionId": sid, "userId": uid, "topicOrder": [topic]})
+            if args.batch:
+                # answered offline, synced in one call
+                questions = random.sample([d for d in coll.docs if d["topic"] == topic], args.answers)
+                for q in questions:
+                    db.serve_question(sid, str(q["_id"]))
+                params = {"defer_message": "true"} if args.stream else None
+                resp = await timed(client, suggest_name, "/agent/suggest-next-questions",
+                                   {"events": [answer(uid, sid, topic, q) for q in questions]}, params)
+                if resp.status_code != 200:
+                    errors += 1
+                else:
+                    answered += len(questions)
+            else:
+                question = random.choice([d for d in coll.docs if d["topic"] == topic])
+                db.serve_question(sid, str(question["_id"]))
+                for _ in range(args.answers):
+                    if args.think_ms:
+                        await asyncio.sleep(args.think_ms / 1000)  # the student working on the question
+                    params = {"stream_message": "true"} if args.stream else None
+                    resp = await timed(client, suggest_name, "/agent/suggest-next-question-final",
+                                       answer(uid, sid, topic, question), params)
+                    if resp.status_code != 200:
+                        errors += 1
+                        break
+                    answered += 1
+                    next_id = resp.json().get("nextQuestionId")
+                    if not next_id:
+                        break
+                    db.serve_question(sid, next_id)
+                    question = by_id[next_id]
+            resp = await timed(client, "end", "/session/end", {"sessionId": sid})
+            if resp.status_code != 200:
+                errors += 1
+
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://agent", timeout=None) as client:
+            llm_before = sum(s.requests for s in servers)
+            t0 = time.perf_counter()
+            await asyncio.gather(*(student(client, n) for n in range(args.students)))
+            elapsed = time.perf_counter() - t0
+            llm_requests = sum(s.requests for s in servers) - llm_before
+            health = (await client.get("/health")).json()
+    for s in servers[args.llm_down:]:
+        await s.stop()
+
+    n_answers = answered or 1
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "errors": errors,
+        "endpoints": summarize(latencies, elapsed),
+        "per_suggest": {
+            "pg_round_trips": round(sum(c.get("pg", 0) for c in suggest_counts) / n_answers, 3),
+            "mongo_round_trips": round(sum(c.get("mongo", 0) for c in suggest_counts) / n_answers, 3),
+            # includes background work (message pool, streamed feedback) started during the run
+            "llm_calls": round(llm_requests / n_answers, 3),
+        },
+        "background": {
+            "pg_round_trips_total": fakes.totals["pg"],
+            "llm_requests_total": llm_requests,
+            "llm_prompt_tokens_evaluated": sum(s.tokens_evaluated for s in servers),
+            "llm_prompt_tokens_cached": sum(s.tokens_cached for s in servers),
+            # answers folded into agent_rollup by the decision writer (flushed on shutdown)
+            "rollup_answers": sum(r.answers for r in db.rollups.values()),
+        },
+        "health": health,
+    }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of more than `tolerance` (fraction) in latency percentiles or throughput."""
+    problems = []
+    for endpoint, cur in result["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if not base:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if base[metric] and cur[metric] > base[metric] * (1 + tolerance):
+                problems.append(f"{endpoint} {metric}: {cur[metric]} > {base[metric]} (+{tolerance:.0%})")
+        if base["rps"] and cur["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{endpoint} rps: {cur['rps']} < {base['rps']} (-{tolerance:.0%})")
+    for metric, cur in result["per_suggest"].items():
+        base = baseline.get("per_suggest", {}).get(metric)
+        if base is not None and cur > base * (1 + tolerance) + 1e-9:
+            problems.append(f"per-suggest {metric}: {cur} > {base}")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="MentalMath agent load test")
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--answers", type=int, default=10, help="answers per student session")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--questions-per-bucket", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=30)
+    parser.add_argument("--llm-prompt-ms-per-token", type=float, default=0.0,
+                        help="prompt processing cost per token missing from the KV cache")
+    parser.add_argument("--llm-servers", type=int, default=1, help="fake llama.cpp servers behind the gateway")
+    parser.add_argument("--llm-down", type=int, default=0, help="how many of them are unreachable")
+    parser.add_argument("--llm-slow-fraction", type=float, default=0.0,
+                        help="share of completions that take 10x as long (exercises hedging)")
+    parser.add_argument("--pg-latency-ms", type=float, default=0.0, help="added to every Postgres round trip")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="time a student spends on each question")
+    parser.add_argument("--stream", action="store_true",
+                        help="use stream_message=true on suggestions (defer_message=true with --batch)")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit each session's answers in one /agent/suggest-next-questions call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the JSON result here")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    print(json.dumps({k: v for k, v in result.items() if k != "config"}, indent=2, default=str))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+        print(f"baseline saved to {BASELINE_PATH}")
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            print("no baseline to compare against; run with --save-baseline first")
+            return 1
+        with open(BASELINE_PATH) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for p in problems:
+            print("REGRESSION:", p)
+        return 1 if problems else 0
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# bench/wire.py
+# Agent CPU per call over REST (uvicorn, HTTP/1.1 keep-alive, JSON) vs the msgpack wire
+# protocol (wire.py), with the stand-ins of bench/run.py.
+#
+#   cd agent
+#   python -m bench.wire --students 100 --answers 10 --rounds 3
+#
+# The agent (uvicorn on a loopback port plus the wire server) runs in its own thread and
+# event loop; the load generator and fake llama.cpp run in the main thread. CPU time is
+# read from the agent thread's clock around each phase, so the figures are the agent's
+# own cost per call. The handlers do the same work on both transports; the difference is
+# HTTP parsing, routing, middleware, JSON and validation of the request and the response.
+# Phases alternate (rest, wire, rest, wire, ...), each with fresh sessions, after a warm-up.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from typing import List, Dict, Any
+
+from bench.run import percentile
+
+SUGGEST = "/agent/suggest-next-question-final"
+
+
+class Agent:
+    """The agent app served over both transports from a background thread."""
+    def __init__(self, questions_per_bucket: int):
+        self.questions_per_bucket = questions_per_bucket
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._main()), daemon=True)
+        self.loop = None
+        self.server = None
+        self.db = None
+        self.docs = None
+        self.http_port = None
+        self.wire_port = None
+
+    async def _main(self) -> None:
+        import uvicorn
+        import helper
+        import api
+        from wire import wire_server
+        from bench import fakes
+
+        self.loop = asyncio.get_running_loop()
+        self.db = fakes.FakeDatabase()
+        coll = fakes.FakeCollection(fakes.make_question_bank(self.questions_per_bucket))
+        helper.pg_pool = fakes.FakePool(self.db)
+        helper.questions_coll = coll
+        api.questions_coll = coll
+        self.docs = coll.docs
+        self.server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=0, lifespan="on",
+                                                    log_level="warning", access_log=False))
+        serving = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+        self.http_port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.wire_port = wire_server.port
+        self.ready.set()
+        await serving
+
+    def start(self) -> None:
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+    def cpu(self) -> float:
+        """CPU seconds used by the agent thread so far."""
+        return time.clock_gettime(time.pthread_getcpuclockid(self.thread.ident))
+
+    async def run(self, fn, *args):
+        """Call `fn` on the agent's loop (the fake database isn't thread-safe)."""
+        async def call():
+            return fn(*args)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(), self.loop))
+
+
+async def phase(agent: Agent, call, students: int, answers: int, concurrency: int,
+                rng: random.Random) -> Dict[str, Any]:
+    """`students` sessions through `call(path, body) -> (status, body)`; the agent's CPU and latencies."""
+    topics = sorted({d["topic"] for d in agent.docs})
+    by_id = {str(d["_id"]): d for d in agent.docs}
+    latencies: Dict[str, List[float]] = {"start": [], "suggest": [], "end": []}
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def timed(name: str, path: str, body: Dict[str, Any]):
+        t0 = time.perf_counter()
+        status, data = await call(path, body)
+        latencies[name].append(time.perf_counter() - t0)
+        return status, data
+
+    async def student(n: int) -> None:
+        nonlocal errors
+        async with sem:
+            sid, uid = str(uuid.uuid4()), f"user-{n}"
+            topic = rng.choice(topics)
+            question = rng.choice([d for d in agent.docs if d["topic"] == topic])
+            await agent.run(agent.db.add_session, sid, uid, [topic])
+            await agent.run(agent.db.serve_question, sid, str(question["_id"]))
+            status, _ = await timed("start", "/session/start", {"sessionId": sid, "userId": uid, "topicOrder": [topic]})
+            errors += status != 200
+            for _ in range(answers):
+                est = question.get("estimatedTime", 30)
+                status, data = await timed("suggest", SUGGEST, {
+                    "userId": uid, "sessionId": sid, "questionId": str(question["_id"]),
+                    "topic": topic, "subTopic": question.get("subtopic"),
+                    "difficulty": question["difficulty"], "wasCorrect": rng.random() < 0.7,
+                    "timeTaken": max(1.0, rng.gauss(est, est / 3)), "estimatedTime": est,
+                })
+                if status != 200:
+                    errors += 1
+                    break
+                if not data.get("nextQuestionId"):
+                    break
+                question = by_id[data["nextQuestionId"]]
+                await agent.run(agent.db.serve_question, sid, data["nextQuestionId"])
+            status, _ = await timed("end", "/session/end", {"sessionId": sid})
+            errors += status != 200
+
+    cpu0, client0, t0 = agent.cpu(), time.thread_time(), time.perf_counter()
+    await asyncio.gather(*(student(n) for n in range(students)))
+    return {
+        "agent_cpu": agent.cpu() - cpu0,
+        "client_cpu": time.thread_time() - client0,
+        "elapsed": time.perf_counter() - t0,
+        "latencies": latencies,
+        "errors": errors,
+    }
+
+
+def report(phases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    calls = sum(len(v) for p in phases for v in p["latencies"].values())
+    elapsed = sum(p["elapsed"] for p in phases)
+    endpoints = {}
+    for name in ("start", "suggest", "end"):
+        values = [v for p in phases for v in p["latencies"][name]]
+        endpoints[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return {
+        "calls": calls,
+        "errors": sum(p["errors"] for p in phases),
+        "agent_cpu_us_per_call": round(sum(p["agent_cpu"] for p in phases) / calls * 1e6, 1),
+        # the Python load generator (httpx vs WireClient), for reference only
+        "client_cpu_us_per_call": round(sum(p["client_cpu"] for p in phases) / calls * 1e6, 1),
+        "calls_per_s": round(calls / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    from bench.fake_llama import FakeLlamaServer
+    llama = FakeLlamaServer(args.llm_latency_ms, args.llm_tokens_per_sec)
+    os.environ["LLAMA_SERVER_URLS"] = await llama.start()
+    os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1/bench")
+    os.environ.setdefault("DATABASE_URL", "postgresql://bench@127.0.0.1:1/bench")
+    os.environ.setdefault("SESSION_STORE", "memory")
+    os.environ["AGENT_WIRE_PORT"] = "0"
+
+    import httpx
+    from wire import WireClient
+
+    agent = Agent(args.questions_per_bucket)
+    await asyncio.get_running_loop().run_in_executor(None, agent.start)
+    http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{agent.http_port}", timeout=None,
+                             limits=httpx.Limits(max_keepalive_connections=args.concurrency))
+    wire = await WireClient().connect("127.0.0.1", agent.wire_port)
+
+    async def rest_call(path: str, body: Dict[str, Any]):
+        resp = await http.post(path, json=body)
+        return resp.status_code, resp.json()
+
+    transports = {"rest": rest_call, "wire": wire.call}
+    results: Dict[str, List[Dict[str, Any]]] = {name: [] for name in transports}
+    try:
+        for name, call in transports.items():  # connections, caches and the LLM message cache warm up
+            await phase(agent, call, args.warmup_students, args.answers, args.concurrency, random.Random(args.seed))
+        for r in range(args.rounds):
+            for name, call in transports.items():
+                rng = random.Random(args.seed + 1 + r)  # the same students on both transports
+                results[name].append(await phase(agent, call, args.students, args.answers, args.concurrency, rng))
+    finally:
+        await http.aclose()
+        await wire.close()
+        await asyncio.get_running_loop().run_in_executor(None, agent.stop)
+        await llama.stop()
+
+    out = {name: report(phases) for name, phases in results.items()}
+    rest, wire_ = out["rest"]["agent_cpu_us_per_call"], out["wire"]["agent_cpu_us_per_call"]
+    out["agent_cpu_saved"] = {
+        "us_per_call": round(rest - wire_, 1),
+        "fraction": round((rest - wire_) / rest, 3) if rest else 0.0,
+    }
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Agent CPU per call: REST vs the msgpack wire protocol")
+    parser.add_argument("--students", type=int, default=100, help="sessions per phase")
+    parser.add_argument("--answers", type=int, default=10, help="answers per session")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3, help="rest/wire phase pairs")
+    parser.add_argument("--warmup-students", type=int, default=20)
+    parser.add_argument("--questions-per-bucket", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON result here")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["rest"]["errors"] or result["wire"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
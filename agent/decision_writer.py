@@ -0,0 +1,221 @@
+# decision_writer.py
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, List, Tuple, Any
+
+from metrics import span
+from rollup import record_rollups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DECISION_QUEUE_MAX = int(os.getenv("DECISION_QUEUE_MAX", 10000))
+DECISION_BATCH_SIZE = int(os.getenv("DECISION_BATCH_SIZE", 500))
+DECISION_FLUSH_SECONDS = float(os.getenv("DECISION_FLUSH_SECONDS", 0.5))
+ROLLUP_QUEUE_MAX = int(os.getenv("ROLLUP_QUEUE_MAX", 50000))
+ROLLUP_RETRY_MAX_SECONDS = 30.0
+ROLLUP_STOP_ATTEMPTS = 3
+
+AGENT_DECISION_DDL = """
+    CREATE TABLE IF NOT EXISTS agent_decision (
+        id SERIAL PRIMARY KEY,
+        session_id UUID NOT NULL,
+        prev_question_id VARCHAR(32),
+        next_question_id VARCHAR(32),
+        next_difficulty INT,
+        mastery FLOAT,
+        reason VARCHAR(32),
+        trace JSONB,
+        created_at TIMESTAMP DEFAULT NOW()
+    )
+"""
+
+DECISION_COLUMNS = (
+    "session_id", "prev_question_id", "next_question_id", "next_difficulty",
+    "mastery", "reason", "trace", "created_at",
+)
+
+INSERT_SQL = """
+    INSERT INTO agent_decision(session_id, prev_question_id, next_question_id, next_difficulty, mastery, reason, trace, created_at)
+    VALUES ($1,$2,$3,$4,$5,$6,$7,$8)
+"""
+
+
+class DecisionWriter:
+    """
+    Bounded write-behind queue for agent_decision traces.
+    Handlers enqueue without waiting; a background task flushes batches with COPY
+    (falling back to executemany). When the queue is full, traces are dropped and
+    counted rather than slowing down the student's response.
+    Answer rollup updates (rollup.rollup_args) feed dashboards, so they take their own
+    path, which never drops: a bounded queue whose `submit_rollup` waits when it is full,
+    flushed in batches and retried with backoff until written.
+    """
+    def __init__(self, max_queue: int = DECISION_QUEUE_MAX, batch_size: int = DECISION_BATCH_SIZE,
+                 flush_seconds: float = DECISION_FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "asyncio.Queue[Tuple[Any, ...]]" = asyncio.Queue(maxsize=max_queue)
+        self._rollups: "asyncio.Queue[Tuple[Any, ...]]" = asyncio.Queue(maxsize=ROLLUP_QUEUE_MAX)
+        self._pool = None
+        self._task: Optional[asyncio.Task] = None
+        self._rollup_task: Optional[asyncio.Task] = None
+        self._held: List[Tuple[Any, ...]] = []  # taken off the queue, not yet flushing
+        self._held_rollups: List[Tuple[Any, ...]] = []  # taken off the rollup queue, not yet written
+        self._flushing: Optional[asyncio.Future] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rollups_written = 0
+        self.rollups_retried = 0
+        self.rollups_lost = 0
+
+    def submit(self, session_id: str, prev_question_id: Optional[str], next_question_id: Optional[str],
+               next_difficulty: int, mastery: float, reason: str, trace: dict) -> None:
+        """Queue one decision trace; never blocks."""
+        record = (
+            session_id, prev_question_id, next_question_id, next_difficulty,
+            float(mastery), reason, json.dumps(trace), datetime.utcnow(),
+        )
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Decision queue full; dropped {self.dropped} traces so far")
+
+    async def submit_rollup(self, rollup: Tuple[Any, ...]) -> None:
+        """Queue one answer's rollup update; waits only when ROLLUP_QUEUE_MAX are already queued."""
+        await self._rollups.put(rollup)
+
+    def start(self, pool) -> None:
+        self._pool = pool
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self._rollup_task is None or self._rollup_task.done():
+            self._rollup_task = asyncio.create_task(self._run_rollups())
+
+    async def stop(self) -> None:
+        """Stop the flushers and write out everything still queued."""
+        for task in (self._task, self._rollup_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._rollup_task = None
+        if self._flushing is not None:
+            await self._flushing
+        held, self._held = self._held, []
+        await self._flush(held)
+        while not self._queue.empty():
+            await self._flush(self._drain(self._queue))
+        rollups, self._held_rollups = self._held_rollups, []
+        while not self._rollups.empty():
+            rollups.append(self._rollups.get_nowait())
+        for i in range(0, len(rollups), self.batch_size):
+            batch = rollups[i:i + self.batch_size]
+            for attempt in range(ROLLUP_STOP_ATTEMPTS):
+                if await self._flush_rollups(batch):
+                    break
+                await asyncio.sleep(0.1 * 2 ** attempt)
+            else:
+                self.rollups_lost += len(batch)
+                logger.error(f"Lost {len(batch)} rollup updates on shutdown; rebuild with `python rollup.py backfill`")
+
+    def _drain(self, queue: asyncio.Queue, limit: Optional[int] = None) -> List[Tuple[Any, ...]]:
+        batch = []
+        limit = self.batch_size if limit is None else limit
+        while len(batch) < limit and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            self._held = [await self._queue.get()]
+            # let a batch build up unless the queue is already large
+            if self._queue.qsize() < self.batch_size:
+                await asyncio.sleep(self.flush_seconds)
+            batch, self._held = self._held + self._drain(self._queue), []
+            # shielded, so stop() cancelling the loop doesn't lose a batch mid-write
+            self._flushing = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._flushing)
+
+    async def _run_rollups(self) -> None:
+        delay = self.flush_seconds
+        while True:
+            if not self._held_rollups:
+                self._held_rollups = [await self._rollups.get()]
+                if self._rollups.qsize() < self.batch_size:
+                    await asyncio.sleep(self.flush_seconds)
+            self._held_rollups += self._drain(self._rollups, self.batch_size - len(self._held_rollups))
+            # held until written: a failed batch is retried first, in order, and the
+            # queue behind it fills up until submit_rollup waits
+            if await self._flush_rollups(self._held_rollups):
+                self._held_rollups = []
+                delay = self.flush_seconds
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ROLLUP_RETRY_MAX_SECONDS)
+
+    async def _flush_rollups(self, rollups: List[Tuple[Any, ...]]) -> bool:
+        if not rollups:
+            return True
+        if self._pool is None:
+            return False
+        try:
+            with span("rollup_flush"):
+                async with self._pool.acquire() as conn:
+                    # executemany is atomic, so a failed batch applied nothing and is safe to retry
+                    await record_rollups(conn, rollups)
+        except Exception as e:
+            self.rollups_retried += len(rollups)
+            logger.error(f"Failed to apply {len(rollups)} rollup updates, will retry: {e!r}")
+            return False
+        self.rollups_written += len(rollups)
+        return True
+
+    async def _flush(self, records: List[Tuple[Any, ...]]) -> None:
+        if not records or self._pool is None:
+            return
+        try:
+            with span("decision_flush"):
+                async with self._pool.acquire() as conn:
+                    try:
+                        await conn.copy_records_to_table("agent_decision", records=records, columns=DECISION_COLUMNS)
+                        self.written += len(records)
+                    except Exception as e:
+                        logger.warning(f"COPY into agent_decision failed ({e!r}); retrying with executemany")
+                        try:
+                            await conn.executemany(INSERT_SQL, records)
+                            self.written += len(records)
+                        except Exception as e:
+                            self.failed += len(records)
+                            logger.error(f"Failed to write {len(records)} decision traces: {e!r}")
+        except Exception as e:
+            self.failed += len(records)
+            logger.error(f"Failed to write {len(records)} decision traces: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "rollups_queued": self._rollups.qsize() + len(self._held_rollups),
+            "rollups_written": self.rollups_written,
+            "rollups_retried": self.rollups_retried,
+            "rollups_lost": self.rollups_lost,
+        }
+
+
+async def ensure_decision_table(conn) -> None:
+    """Create the agent_decision table if missing (startup only)."""
+    await conn.execute(AGENT_DECISION_DDL)
+
+
+decision_writer = DecisionWriter()
@@ -0,0 +1,64 @@
+# exclusion.py
+# Per-session sets of answered questions over the question index's dense ordinals.
+# A set is a sparse bitset (64-bit words keyed by word number), so membership is one
+# dict lookup and a shift however many questions the student has answered.
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+EXCLUSION_SESSIONS_MAX = int(os.getenv("EXCLUSION_SESSIONS_MAX", 100000))
+EXCLUSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 3600 + 15 * 60))
+
+
+class ExclusionSet:
+    """Sparse bitset of question ordinals, plus how many question_session rows it has absorbed."""
+    __slots__ = ("_words", "_count", "seen")
+
+    def __init__(self, ordinals: Iterable[int] = ()):
+        self._words: Dict[int, int] = {}
+        self._count = 0
+        self.seen = 0
+        for o in ordinals:
+            self.add(o)
+
+    def add(self, ordinal: int) -> None:
+        word = ordinal >> 6
+        bits = self._words.get(word, 0)
+        bit = 1 << (ordinal & 63)
+        if not bits & bit:
+            self._words[word] = bits | bit
+            self._count += 1
+
+    def __contains__(self, ordinal: int) -> bool:
+        return bool((self._words.get(ordinal >> 6, 0) >> (ordinal & 63)) & 1)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class SessionExclusions:
+    """Per-process cache of session exclusion sets, LRU-bounded and expired with the session."""
+    def __init__(self, max_sessions: int = EXCLUSION_SESSIONS_MAX, ttl: int = EXCLUSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sets: "OrderedDict[str, tuple]" = OrderedDict()  # sid -> (expires, ExclusionSet)
+
+    def get(self, session_id: str) -> ExclusionSet:
+        """The session's set, created empty on first use (and after expiry)."""
+        now = time.monotonic()
+        entry = self._sets.pop(session_id, None)
+        excl = entry[1] if entry is not None and entry[0] > now else ExclusionSet()
+        self._sets[session_id] = (now + self.ttl, excl)
+        while len(self._sets) > self.max_sessions or next(iter(self._sets.values()))[0] <= now:
+            self._sets.popitem(last=False)
+        return excl
+
+    def drop(self, session_id: str) -> None:
+        self._sets.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sets)
+
+
+session_exclusions = SessionExclusions()
@@ -0,0 +1,155 @@
+# feedback_stream.py
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, AsyncIterator, Callable
+
+from helper import stream_llm_response
+from llm_cache import llm_cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How long a finished (or abandoned) message stays available for late subscribers
+FEEDBACK_TTL_SECONDS = float(os.getenv("FEEDBACK_TTL_SECONDS", 300))
+# On shutdown, how long messages still generating get to finish before they're cancelled
+FEEDBACK_STOP_SECONDS = float(os.getenv("FEEDBACK_STOP_SECONDS", 5))
+
+
+class FeedbackMessage:
+    """An LLM message being generated in the background, with its chunks buffered for replay."""
+    __slots__ = ("fallback", "chunks", "done", "created", "_changed", "task")
+
+    def __init__(self, fallback: str):
+        self.fallback = fallback
+        self.chunks: List[str] = []
+        self.done = False
+        self.created = time.monotonic()
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def llm_text(self) -> Optional[str]:
+        """What the LLM produced, or None if it produced nothing."""
+        return "".join(self.chunks).strip() or None
+
+    def text(self) -> str:
+        """Final message: the LLM text if any was produced, otherwise the fallback."""
+        return self.llm_text() or self.fallback
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every chunk, past and future, until generation finishes."""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                return
+            await changed.wait()
+
+
+class FeedbackStreams:
+    """
+    Registry of in-progress agent messages keyed by (sessionId, decisionId).
+    `suggest_next_question` registers the prompt and returns immediately;
+    the SSE endpoint replays and follows the generated chunks.
+    Entries are kept in creation order, so expired ones are popped from the front;
+    a delivered message is removed once its `done` event is sent.
+    """
+    def __init__(self, ttl: float = FEEDBACK_TTL_SECONDS):
+        self.ttl = ttl
+        self._messages: "OrderedDict[Tuple[str, str], FeedbackMessage]" = OrderedDict()
+
+    def _evict_expired(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self._messages:
+            key, msg = next(iter(self._messages.items()))
+            if msg.created >= cutoff:
+                return
+            del self._messages[key]
+            if msg.task is not None and not msg.task.done():
+                msg.task.cancel()
+
+    def start(self, session_id: str, decision_id: str, prompt: str, fallback: str,
+              cache_key: Optional[str] = None,
+              on_done: Optional[Callable[[Optional[str]], None]] = None) -> FeedbackMessage:
+        """
+        Begin generating a message in the background. `on_done` gets the LLM text (None if
+        generation failed or was cancelled) once it finishes.
+        """
+        self._evict_expired()
+        msg = FeedbackMessage(fallback)
+        msg.task = asyncio.create_task(self._generate(msg, prompt, cache_key, on_done))
+        self._messages[(session_id, decision_id)] = msg
+        # also runs when no new message comes after this one, so idle workers free the buffers
+        asyncio.get_running_loop().call_later(self.ttl + 1, self._evict_expired)
+        return msg
+
+    async def stop(self, timeout: float = FEEDBACK_STOP_SECONDS) -> None:
+        """Let the messages still generating finish (or cancel them), so their traces are queued."""
+        tasks = [m.task for m in self._messages.values() if m.task is not None and not m.task.done()]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def get(self, session_id: str, decision_id: str) -> Optional[FeedbackMessage]:
+        return self._messages.get((session_id, decision_id))
+
+    async def _generate(self, msg: FeedbackMessage, prompt: str, cache_key: Optional[str],
+                        on_done: Optional[Callable[[Optional[str]], None]]) -> None:
+        try:
+            async for chunk in stream_llm_response(prompt):
+                msg.append(chunk)
+            if cache_key is not None and msg.chunks:
+                llm_cache.add(cache_key, "".join(msg.chunks))
+        except Exception as e:
+            logger.warning(f"Feedback generation failed: {e!r}")
+        finally:
+            msg.finish()
+            if on_done is not None:
+                try:
+                    on_done(msg.llm_text())
+                except Exception as e:
+                    logger.error(f"Feedback completion callback failed: {e!r}")
+
+    async def sse_events(self, session_id: str, decision_id: str) -> AsyncIterator[str]:
+        """
+        Server-Sent Events for one message: `token` events while generating,
+        then a single `done` event carrying the final message.
+        """
+        msg = self.get(session_id, decision_id)
+        if msg is None:
+            yield _sse("error", {"detail": "Feedback not found"})
+            return
+        async for chunk in msg.follow():
+            yield _sse("token", {"content": chunk})
+        yield _sse("done", {"message": msg.text()})
+        if self._messages.get((session_id, decision_id)) is msg:
+            del self._messages[(session_id, decision_id)]
+        self._evict_expired()
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+feedback_streams = FeedbackStreams()
@@ -1,6 +1,9 @@
 from typing import Optional, List, Dict, Any
 from datetime import datetime
-from llm_instance import llm_service, llm_initialized
+from llm_instance import llm_service, llm_batcher, llm_initialized
+from llm_cache import llm_cache
+from metrics import span, mongo_pool_listener, LLM_ERRORS
+from prompts import Prompt
 import uuid
 import motor.motor_asyncio
 import asyncpg
@@ -10,36 +13,58 @@ import os
 from dotenv import load_dotenv
 from bson import ObjectId
 
-import aiohttp
 import asyncio
-from typing import Optional
+from typing import AsyncIterator
 
-async def get_llm_response(prompt: str, timeout: int = 300) -> Optional[str]:
+async def get_llm_response(prompt: Prompt, timeout: Optional[float] = None, cache_key: Optional[str] = None) -> Optional[str]:
     """
-    Call local LLaMA.cpp server with timeout
+    Call local LLaMA.cpp server with timeout (LLM_MESSAGE_BUDGET_SECONDS by default).
+    With a `cache_key` the response is served from / stored in the LLM response cache.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'http://127.0.0.1:8080/completion',
-                json={
-                    "prompt": prompt,
-                    "n_predict": 512,
-                    "temperature": 0.7,
-                    "stop": ["</s>"]
-                },
-                timeout=timeout
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get('content', '')
-                return None
-    except (aiohttp.ClientError, asyncio.TimeoutError):
+    if llm_service is None:
         return None
 
+    async def generate() -> Optional[str]:
+        try:
+            return await llm_batcher.generate(
+                prompt.text, deadline=timeout or LLM_MESSAGE_BUDGET_SECONDS, **prompt.params)
+        except RuntimeError:
+            LLM_ERRORS.inc("generate")
+            return None
+
+    if cache_key is None:
+        return await generate()
+    return await llm_cache.get_or_generate(cache_key, generate)
+
+async def stream_llm_response(prompt: Prompt, timeout: int = 300) -> AsyncIterator[str]:
+    """
+    Stream the LLaMA.cpp completion chunk by chunk; yields nothing if the server is unavailable.
+    """
+    if llm_service is None:
+        return
+    try:
+        async for chunk in llm_service.stream(prompt.text, deadline=timeout, **prompt.params):
+            yield chunk
+    except RuntimeError:
+        LLM_ERRORS.inc("stream")
+        return
+
 from models import (
     STRATEGY_TIPS
 )
+from question_index import question_index
+from exclusion import ExclusionSet
+from mastery_store import (
+    get_mastery, record_args, ensure_mastery_table, MasteryState,
+    MASTERY_COLUMNS, RECORD_VALUES, RECORD_ON_CONFLICT, STATE_COLUMNS, DEFAULT_MASTERY, normalized_time
+)
+from irt import (
+    item_calibration, ensure_irt_tables, ABILITY_COLUMNS, ABILITY_VALUES, ABILITY_ON_CONFLICT
+)
+from decision_writer import ensure_decision_table
+from rollup import ensure_rollup_table
+from policy import pick_question_from_candidates, decide_next_difficulty
+from analytics import SessionColumns, summarize
 
 llm = llm_service
 LLM_AVAILABLE = llm_initialized is not None
@@ -58,7 +83,16 @@ if not PG_DSN:
     sys.exit(1)
 
 
-mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", 5))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", 20))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 5))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+# Longest a student-facing request waits for a generated message before using the fallback
+LLM_MESSAGE_BUDGET_SECONDS = float(os.getenv("LLM_MESSAGE_BUDGET_SECONDS", 5))
+
+mongo_client = motor.motor_asyncio.AsyncIOMotorClient(
+    MONGO_URL, minPoolSize=MONGO_MIN_POOL_SIZE, maxPoolSize=MONGO_MAX_POOL_SIZE,
+    event_listeners=[mongo_pool_listener])
 questions_coll = mongo_client.test.questions
 
 # lightweight Postgres pool for aggregates; adapt to your orm
@@ -68,9 +102,32 @@ async def get_pg_pool():
     """Get a connection pool for PostgreSQL."""
     global pg_pool
     if pg_pool is None:
-        pg_pool = await asyncpg.create_pool(dsn=PG_DSN)
+        pg_pool = await asyncpg.create_pool(dsn=PG_DSN, min_size=PG_POOL_MIN_SIZE, max_size=PG_POOL_MAX_SIZE)
     return pg_pool
 
+async def close_pg_pool():
+    """Close the PostgreSQL pool (shutdown)."""
+    global pg_pool
+    if pg_pool is not None:
+        await pg_pool.close()
+        pg_pool = None
+
+def pg_pool_stats() -> Optional[Dict[tuple, int]]:
+    """Connections of the Postgres pool by state, for /metrics (None until the pool exists)."""
+    if pg_pool is None:
+        return None
+    size, idle = pg_pool.get_size(), pg_pool.get_idle_size()
+    return {("open",): size, ("idle",): idle, ("in_use",): size - idle, ("max",): PG_POOL_MAX_SIZE}
+
+async def ensure_agent_tables():
+    """Create the tables the agent owns (once, at startup)."""
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        await ensure_mastery_table(conn)
+        await ensure_decision_table(conn)
+        await ensure_irt_tables(conn)
+        await ensure_rollup_table(conn)
+
 def now_utc():
     """Get the current UTC time."""
     return datetime.utcnow()
@@ -91,28 +148,29 @@ def pick_strategy_tip(topic: str, was_correct: bool, timeTaken: float, estimated
         return tips[1] if len(tips) > 1 else tips[0]
     return ""  # empty means no tip necessary
 
-async def call_llm_for_text(prompt: str, max_tokens: int = 80) -> str:
+async def call_llm_for_text(prompt: Prompt, deadline: Optional[float] = None) -> str:
     """
     Call the LLM service to generate text based on the prompt.
     """
     if not LLM_AVAILABLE or llm is None:
         return ""
-    # simple sync call through python binding; in heavy usage make this threaded or run in process pool
     try:
-        resp = llm.generate(prompt, n_predict=max_tokens)
-        # llama_cpp returns a dictionary with "choices" or "text" depending on version
-        text = getattr(resp, "text", None) or resp.get("text") or resp.get("choices", [{}])[0].get("text", "")
+        text = await llm_batcher.generate(prompt.text, deadline=deadline, **prompt.params)
         return (text or "").strip()
-    except Exception:
+    except RuntimeError:
         return ""
 
-async def generate_message_with_optional_llm(template_prompt: str, fallback: str) -> str:
+async def generate_message_with_optional_llm(template_prompt: Prompt, fallback: str, cache_key: Optional[str] = None) -> str:
     """
     Generate a message using the LLM if available, otherwise return a fallback message.
     """
     # If an LLM is available, try to generate a nicer message. Otherwise return fallback.
     if LLM_AVAILABLE:
-        llm_text = await call_llm_for_text(template_prompt)
+        if cache_key is None:
+            llm_text = await call_llm_for_text(template_prompt, deadline=LLM_MESSAGE_BUDGET_SECONDS)
+        else:
+            llm_text = await llm_cache.get_or_generate(
+                cache_key, lambda: call_llm_for_text(template_prompt, deadline=LLM_MESSAGE_BUDGET_SECONDS))
         if llm_text:
             return llm_text
     return fallback
@@ -121,19 +179,7 @@ def compute_session_stats(events: List[Dict[str, Any]]) -> Dict[str, Dict[str, A
     """
     Compute statistics for a user's session based on the events.
     """
-    per_topic: Dict[str, Dict[str, Any]] = {}
-    for e in events:
-        topic = e["topic"]
-        if topic not in per_topic:
-            per_topic[topic] = {"count": 0, "correct": 0, "total_time": 0.0}
-        per_topic[topic]["count"] += 1
-        per_topic[topic]["correct"] += 1 if e["wasCorrect"] else 0
-        per_topic[topic]["total_time"] += e["timeTaken"]
-    # finalize metrics
-    for topic, stats in per_topic.items():
-        stats["accuracy"] = round(100 * stats["correct"] / stats["count"], 2) if stats["count"] > 0 else 0.0
-        stats["avg_time"] = round(stats["total_time"] / stats["count"], 2) if stats["count"] > 0 else 0.0
-    return per_topic
+    return summarize(SessionColumns.from_sessions({"": events})).get("", {})
 
 # A stub question fetcher:
 # In production, this should call the backend (NestJS) or query Mongo to find a question id by topic & difficulty.
@@ -145,42 +191,196 @@ async def fetch_question_id_for_topic(topic: str, difficulty: int) -> Optional[s
 async def compute_mastery(user_id: str, topic: str) -> float:
     """
     Compute the user's mastery level for a specific topic.
+    Reads the incrementally maintained state, so the cost does not grow with history.
+    """
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        return await get_mastery(conn, user_id, topic)
+
+def answer_time(event) -> float:
+    """The event's answer time normalized by the question's expected time (see mastery_store)."""
+    return normalized_time(
+        event.timeTaken, item_calibration.expected_seconds(event.questionId, event.estimatedTime))
+
+# Everything the suggest path needs from Postgres in one round trip: the session row,
+# the session's answered question ids (from row $10 on, for callers that already hold
+# the first ones), the mastery upsert for this answer and the user's IRT ability step
+# ($11/$12: the answered item's calibrated parameters, NULL when uncalibrated).
+# Data-modifying CTEs see the pre-update snapshot, so `prev`/`prev_ability` cover a
+# deduplicated retry. The upserts only run when the session exists.
+SUGGEST_CONTEXT_SQL = f"""
+    WITH sess AS (
+        SELECT id, "topicOrder", "startTime" FROM session WHERE id = $9::uuid
+    ), answered AS (
+        SELECT COALESCE(array_agg(q."questionId" ORDER BY q.timestamp, q."questionId"), '{{}}'::text[]) AS ids
+        FROM (
+            SELECT qs."questionId", qs.timestamp FROM question_session qs
+            WHERE qs."sessionId" = $9::uuid
+            ORDER BY qs.timestamp, qs."questionId" OFFSET $10::int
+        ) q
+    ), prev AS (
+        SELECT {STATE_COLUMNS} FROM agent_mastery WHERE user_id = $1 AND topic = $2
+    ), rec AS (
+        INSERT INTO agent_mastery AS m {MASTERY_COLUMNS}
+        SELECT {RECORD_VALUES} FROM sess
+        {RECORD_ON_CONFLICT}
+        RETURNING {STATE_COLUMNS}
+    ), prev_ability AS (
+        SELECT theta FROM agent_user_ability WHERE user_id = $1
+    ), ability AS (
+        INSERT INTO agent_user_ability AS u {ABILITY_COLUMNS}
+        SELECT {ABILITY_VALUES} FROM sess WHERE $11::real IS NOT NULL
+        {ABILITY_ON_CONFLICT}
+        RETURNING theta
+    )
+    SELECT sess.id, sess."topicOrder", sess."startTime", answered.ids AS answered_ids,
+           {", ".join(f"COALESCE(rec.{c}, prev.{c}) AS {c}" for c in STATE_COLUMNS.split(", "))},
+           COALESCE(ability.theta, prev_ability.theta) AS theta
+    FROM sess CROSS JOIN answered
+    LEFT JOIN rec ON TRUE
+    LEFT JOIN prev ON TRUE
+    LEFT JOIN ability ON TRUE
+    LEFT JOIN prev_ability ON TRUE
+"""
+
+async def fetch_suggest_context(event, exclude: Optional[ExclusionSet] = None):
+    """
+    Load the session row, answered ids, updated mastery and IRT ability for an AnswerEvent.
+    Returns (session_row, answered_ids, mastery, theta); session_row is None if the session
+    doesn't exist, theta is None until the user has answered a calibrated question.
+    With an ExclusionSet only the rows it hasn't absorbed yet are fetched; they are folded in
+    and returned as answered_ids.
     """
-    question_ids = await questions_coll.find({"topic": topic}, {"_id": 1}).to_list(length=None)
-    question_id_list = [str(q["_id"]) for q in question_ids]
+    known = exclude.seen if exclude is not None else 0
+    a, b = item_calibration.params(event.questionId)
     pool = await get_pg_pool()
-    # Select last 50 rows in db for this user on this particular topic
     async with pool.acquire() as conn:
-        rec = await conn.fetchrow(
-            """
-             SELECT
-            SUM(CASE WHEN qs.correct THEN 1 ELSE 0 END) as correct_count,
-            COUNT(*) as total,
-            AVG(qs."timeTaken"::float) as avg_time
+        row = await conn.fetchrow(
+            SUGGEST_CONTEXT_SQL,
+            *record_args(event.userId or "anonymous", event.topic, event.wasCorrect,
+                         answer_time(event), event.questionId),
+            event.sessionId, known, a, b)
+    if row is None:
+        return None, [], DEFAULT_MASTERY, None
+    mastery = MasteryState.from_row(row).mastery() if row["total"] is not None else DEFAULT_MASTERY
+    answered_ids = list(row["answered_ids"])
+    if exclude is not None:
+        for qid in answered_ids:
+            ordinal = question_index.ordinal(qid)
+            if ordinal is not None:
+                exclude.add(ordinal)
+        # max(): a concurrent request for the same session may have absorbed these rows already
+        exclude.seen = max(exclude.seen, known + len(answered_ids))
+    return row, answered_ids, mastery, row["theta"]
+
+# Batch suggestions: the sessions of many AnswerEvents with their answered ids (from each
+# session's own offset on), and the mastery and ability of every (user, topic), in two
+# set-based queries. The answers are then written with SUGGEST_CONTEXT_SQL itself,
+# pipelined, so a batch records exactly what the same calls one by one would.
+BATCH_SESSIONS_SQL = """
+    SELECT k.n, s."topicOrder", s."startTime",
+           (SELECT COALESCE(array_agg(q."questionId" ORDER BY q.timestamp, q."questionId"), '{}'::text[])
             FROM (
-            SELECT qs.*
-            FROM question_session qs
-            JOIN session s ON qs."sessionId" = s.id
-            WHERE s."userId" = $1 AND qs."questionId" = ANY($2::text[])
-            ORDER BY qs.timestamp DESC
-            LIMIT 50
-            ) qs
-            """, user_id, question_id_list)
-        # Compute mastery based on these rows
-        if not rec or rec['total'] == 0:
-            return 0.5
-        correct_rate = rec['correct_count'] / rec['total']
-        avg_time = rec['avg_time'] or 999
-        # convert time to score relative to estimatedTime (use 1.0 if <= est)
-        time_score = 1.0 if avg_time <= 30 else max(0, 1 - (avg_time-30)/60)
-        mastery = 0.6*correct_rate + 0.4*time_score
-        return max(0.0, min(1.0, mastery))
-    
+                SELECT qs."questionId", qs.timestamp FROM question_session qs
+                WHERE qs."sessionId" = k.sid
+                ORDER BY qs.timestamp, qs."questionId" OFFSET k.known
+            ) q) AS answered_ids
+    FROM unnest($1::uuid[], $2::int[]) WITH ORDINALITY AS k(sid, known, n)
+    JOIN session s ON s.id = k.sid
+"""
+
+BATCH_STATE_SQL = f"""
+    SELECT k.user_id, k.topic, {", ".join(f"m.{c}" for c in STATE_COLUMNS.split(", "))},
+           m.last_question_id, u.theta, u.info, u.last_question_id AS ability_question_id
+    FROM unnest($1::text[], $2::text[]) AS k(user_id, topic)
+    LEFT JOIN agent_mastery m ON m.user_id = k.user_id AND m.topic = k.topic
+    LEFT JOIN agent_user_ability u ON u.user_id = k.user_id
+"""
+
+SUGGEST_BATCH_MAX = int(os.getenv("SUGGEST_BATCH_MAX", 500))
+NO_ANSWERED_ROWS = 2 ** 31 - 1  # OFFSET for SUGGEST_CONTEXT_SQL when the answered ids aren't wanted
+
+async def fetch_batch_context(events, exclusions: Dict[str, ExclusionSet]):
+    """
+    Sessions, mastery states and abilities for a batch of AnswerEvents.
+    Returns ({sessionId: session_row}, {(user, topic): MasteryState}, {user: [theta, info, last_question_id]});
+    answered ids are folded into `exclusions` (one ExclusionSet per session).
+    """
+    sids = list(dict.fromkeys(e.sessionId for e in events))
+    keys = list(dict.fromkeys((e.userId or "anonymous", e.topic) for e in events))
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        session_rows = await conn.fetch(BATCH_SESSIONS_SQL, sids, [exclusions[sid].seen for sid in sids])
+        state_rows = await conn.fetch(BATCH_STATE_SQL, [k[0] for k in keys], [k[1] for k in keys])
+    sessions = {}
+    for row in session_rows:
+        sid = sids[row["n"] - 1]
+        exclude, known = exclusions[sid], exclusions[sid].seen
+        for qid in row["answered_ids"]:
+            ordinal = question_index.ordinal(qid)
+            if ordinal is not None:
+                exclude.add(ordinal)
+        exclude.seen = max(exclude.seen, known + len(row["answered_ids"]))
+        sessions[sid] = row
+    states, abilities = {}, {}
+    for row in state_rows:
+        if row["total"] is not None:
+            state = states[(row["user_id"], row["topic"])] = MasteryState.from_row(row)
+            state.last_question_id = row["last_question_id"]
+        if row["theta"] is not None:
+            abilities[row["user_id"]] = [row["theta"], row["info"], row["ability_question_id"]]
+    return sessions, states, abilities
+
+async def record_answers(events) -> None:
+    """Write a batch of AnswerEvents (mastery and ability) in order, in one pipelined round trip."""
+    args = []
+    for e in events:
+        a, b = item_calibration.params(e.questionId)
+        args.append((*record_args(e.userId or "anonymous", e.topic, e.wasCorrect, answer_time(e), e.questionId),
+                     e.sessionId, NO_ANSWERED_ROWS, a, b))
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        await conn.executemany(SUGGEST_CONTEXT_SQL, args)
+
+CANDIDATE_PROJECTION = {"_id": 1, "estimatedTime": 1, "hints": 1, "strategyTip": 1}
+
+async def fetch_candidate_tiers(topic, tiers, exclude_ids=None, limit=50, exclude=None):
+    """
+    Candidates from the first non-empty tier. Each tier is a dict with optional
+    "difficulty"/"subtopic" filters; an empty dict means any question in the topic.
+    Served from the question index (where `exclude`, a session ExclusionSet, applies),
+    or resolved with a single Mongo $facet query.
+    """
+    if question_index.loaded:
+        for i, tier in enumerate(tiers):
+            with span(f"candidates_tier{i}"):
+                candidates = question_index.candidates(
+                    topic, tier.get("difficulty"), exclude_ids, tier.get("subtopic"), limit=limit, exclude=exclude)
+            if candidates:
+                return candidates
+        return []
+    match = {"topic": topic}
+    if exclude_ids:
+        match["_id"] = {"$nin": [ObjectId(eid) for eid in exclude_ids]}
+    facets = {}
+    for i, tier in enumerate(tiers):
+        cond = {k: tier[k] for k in ("difficulty", "subtopic") if tier.get(k) is not None}
+        facets[str(i)] = ([{"$match": cond}] if cond else []) + [{"$limit": limit}, {"$project": CANDIDATE_PROJECTION}]
+    with span("candidates_facet"):
+        res = await questions_coll.aggregate([{"$match": match}, {"$facet": facets}]).to_list(length=1)
+    for i in range(len(tiers)):
+        if res and res[0].get(str(i)):
+            return res[0][str(i)]
+    return []
+
 # helper: fetch candidate question ids from Mongo
 async def fetch_candidate_questions(topic, difficulty=None, exclude_ids=None, subtopic=None, mental_skill=None, limit=50):
     """
     Fetch candidate question IDs from MongoDB based on various filters.
+    Served from the in-process question index once it is loaded.
     """
+    if question_index.loaded:
+        return question_index.candidates(topic, difficulty, exclude_ids, subtopic, mental_skill, limit)
     q = {"topic": topic}
     if difficulty is not None:
         q["difficulty"] = difficulty
@@ -192,7 +392,7 @@ async def fetch_candidate_questions(topic, difficulty=None, exclude_ids=None, su
         # Convert string IDs to ObjectId
         exclude_obj_ids = [ObjectId(eid) for eid in exclude_ids]
         q["_id"] = {"$nin": exclude_obj_ids}
-    cursor = questions_coll.find(q, {"_id": 1, "estimatedTime":1, "hints":1, "strategyTip":1})
+    cursor = questions_coll.find(q, CANDIDATE_PROJECTION)
     res = []
     async for doc in cursor:
         res.append(doc)
@@ -200,61 +400,23 @@ async def fetch_candidate_questions(topic, difficulty=None, exclude_ids=None, su
             break
     return res
 
-# helper: pick from candidates with weighting (prefer unattempted + estimatedTime fit)
-def pick_question_from_candidates(candidates, remaining_seconds=None):
-    """
-    Pick a question from the candidates based on a weighted random choice.
-    """
-    if not candidates:
-        return None
-    import random, math
-    weights = []
-    for c in candidates:
-        # prefer shorter estimatedTime if low remaining_seconds
-        est = c.get("estimatedTime",30)
-        w = 1.0
-        if remaining_seconds and est > remaining_seconds/6:
-            w *= 0.5
-        # slightly prefer ones with no hints? (example)
-        if not c.get("hints"):
-            w *= 1.1
-        weights.append(w)
-    idx = random.choices(range(len(candidates)), weights=weights, k=1)[0]
-    return candidates[idx]["_id"]
-
-# Decide next difficulty (basic rules)
-def decide_next_difficulty(current: int, was_correct: bool, timeTaken: float, estimated: Optional[float]) -> int:
-    if was_correct and (estimated is None or timeTaken <= max(estimated * 0.9, 1.0)):
-        # quick and correct: bump difficulty by 1 (cap at 5)
-        return min(current + 1, 5)
-    if not was_correct or (estimated and timeTaken > (estimated * 1.5)):
-        # struggle: reduce difficulty (min 1)
-        return max(current - 1, 1)
-    return current
-
-import aiohttp
-import asyncio
-from typing import Optional
+DEFAULT_STRATEGY_TIP = "Try breaking problems into smaller parts."
 
-async def get_llm_response(prompt: str, timeout: int = 300) -> Optional[str]:
+def strategy_tip_of(doc: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The tip shown with a question: its strategyTip, else its first hint (the default without a question)."""
+    if doc is None:
+        return DEFAULT_STRATEGY_TIP
+    return doc.get("strategyTip") or (doc.get("hints") or [None])[0]
+
+async def get_question_doc(question_id) -> Optional[Dict[str, Any]]:
     """
-    Call local LLaMA.cpp server with timeout
+    Look up a single question, from the question index when loaded, otherwise from Mongo.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'http://127.0.0.1:8080/completion',
-                json={
-                    "prompt": prompt,
-                    "n_predict": 512,
-                    "temperature": 0.7,
-                    "stop": ["</s>"]
-                },
-                timeout=timeout
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get('content', '')
-                return None
-    except (aiohttp.ClientError, asyncio.TimeoutError):
-        return None
\ No newline at end of file
+    rec = question_index.get(question_id)
+    if rec is not None:
+        return rec.as_doc()
+    if question_index.loaded:
+        return None
+    if not isinstance(question_id, ObjectId):
+        question_id = ObjectId(question_id)
+    return await questions_coll.find_one({"_id": question_id})
@@ -0,0 +1,380 @@
+# irt.py
+# Two-parameter logistic item response model: P(correct) = 1 / (1 + exp(-a * (theta - b))).
+# The batch calibration fits item discrimination a and difficulty b, plus each user's
+# ability theta, from question_session history. It is a MAP fit by alternating Fisher-scoring
+# steps, vectorized with NumPy over the sparse response list and split into chunks across
+# threads. Results go to agent_item_params / agent_user_ability. The agent loads item
+# parameters into ItemCalibration and moves a user's theta by one online Newton step
+# per AnswerEvent, inside the suggest round trip.
+#
+#   python irt.py calibrate --workers 8
+import os
+import math
+import asyncio
+import logging
+import argparse
+from array import array
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple, Any, Iterable
+
+import numpy as np
+
+from question_index import question_index
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IRT_RELOAD_SECONDS = float(os.getenv("IRT_RELOAD_SECONDS", 3600))
+
+THETA_PRIOR_SD = 1.0
+B_PRIOR_SD = 1.0
+LOG_A_PRIOR_SD = 0.5
+B_PER_LEVEL = 0.8      # prior difficulty of a hand-set level: (difficulty - 3) * B_PER_LEVEL
+THETA_LIMIT = 4.0
+TIME_SHRINK = 5.0      # pseudo-responses at estimatedTime behind each item's expected time
+THETA_INFO_PRIOR = 1.0 / THETA_PRIOR_SD ** 2
+
+IRT_DDL = """
+    CREATE TABLE IF NOT EXISTS agent_item_params (
+        question_id TEXT PRIMARY KEY,
+        discrimination REAL NOT NULL,
+        difficulty REAL NOT NULL,
+        expected_time REAL NOT NULL,
+        responses INT NOT NULL,
+        calibrated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS agent_user_ability (
+        user_id TEXT PRIMARY KEY,
+        theta REAL NOT NULL DEFAULT 0,
+        info REAL NOT NULL DEFAULT 1,
+        answers INT NOT NULL DEFAULT 0,
+        last_question_id TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+ITEM_PARAMS_SQL = "SELECT question_id, discrimination, difficulty, expected_time FROM agent_item_params"
+
+CALIBRATION_SQL = """
+    SELECT s."userId"::text AS user_id, qs."questionId" AS question_id,
+           qs.correct, qs."timeTaken" AS time_taken
+    FROM question_session qs
+    JOIN session s ON qs."sessionId" = s.id
+    WHERE s."userId" IS NOT NULL AND qs.response <> ''
+"""
+
+
+# ---------------- online ability update ----------------
+
+def ability_update(theta, info, a, b, correct):
+    """
+    One Newton step of a user's ability for an answer to item (a, b); `info` is the
+    accumulated Fisher information. Works on scalars or NumPy arrays; mirrors ABILITY_ON_CONFLICT.
+    """
+    p = 1.0 / (1.0 + np.exp(-a * (theta - b)))
+    info = info + a * a * p * (1.0 - p)
+    theta = np.clip(theta + a * (correct - p) / info, -THETA_LIMIT, THETA_LIMIT)
+    return theta, info
+
+
+def ability_step(ability: Optional[list], a: Optional[float], b: Optional[float], correct: bool,
+                 question_id: Optional[str]) -> Optional[list]:
+    """
+    A user's [theta, info, last_question_id] after an answer, as ABILITY_VALUES/ABILITY_ON_CONFLICT
+    store it: unchanged for an uncalibrated item (a is None) or a retry of the last question.
+    """
+    if a is None or (ability is not None and ability[2] == question_id):
+        return ability
+    theta, info = ability_update(ability[0] if ability else 0.0, ability[1] if ability else THETA_INFO_PRIOR,
+                                 a, b, int(correct))
+    return [float(theta), float(info), question_id]
+
+
+# The answer's outcome as the backend stored it in question_session ($9 session, $5 question),
+# the same rows `calibrate` fits from; the AnswerEvent's $3 (0/1) only if the row isn't there.
+STORED_CORRECT = """COALESCE((SELECT qs.correct::int FROM question_session qs
+    WHERE qs."sessionId" = $9::uuid AND qs."questionId" = $5 AND qs.response <> ''
+    ORDER BY qs.timestamp DESC LIMIT 1), $3::int)"""
+
+def _ability_sql(theta: str, info: str) -> Tuple[str, str]:
+    # $11 discrimination, $12 difficulty of the answered item
+    p = f"(1.0 / (1.0 + exp(-$11::real * ({theta} - $12::real))))"
+    new_info = f"({info} + $11::real * $11::real * {p} * (1.0 - {p}))"
+    new_theta = f"LEAST({THETA_LIMIT}, GREATEST(-{THETA_LIMIT}, {theta} + $11::real * ({STORED_CORRECT} - {p}) / {new_info}))"
+    return new_theta, new_info
+
+_FIRST_THETA, _FIRST_INFO = _ability_sql("0.0", str(THETA_INFO_PRIOR))
+_NEXT_THETA, _NEXT_INFO = _ability_sql("u.theta", "u.info")
+
+ABILITY_COLUMNS = "(user_id, theta, info, answers, last_question_id, updated_at)"
+
+# First-answer values; $1 user, $5 questionId (statements embedding these bind $9 to the session)
+ABILITY_VALUES = f"$1::text, {_FIRST_THETA}, {_FIRST_INFO}, 1, $5::text, NOW()"
+
+# Like RECORD_ON_CONFLICT, a retried AnswerEvent for the same question is a no-op
+ABILITY_ON_CONFLICT = f"""
+    ON CONFLICT (user_id) DO UPDATE SET
+        theta = {_NEXT_THETA},
+        info = {_NEXT_INFO},
+        answers = u.answers + 1,
+        last_question_id = $5,
+        updated_at = NOW()
+    WHERE u.last_question_id IS DISTINCT FROM $5
+"""
+
+
+# ---------------- calibrated items in the agent ----------------
+
+class ItemCalibration:
+    """Fitted item parameters by question ordinal (QuestionIndex.ordinal)."""
+    def __init__(self, index):
+        self.index = index
+        self.a = np.zeros(0)
+        self.b = np.zeros(0)
+        self.expected_time = np.zeros(0)
+        self.calibrated = np.zeros(0, dtype=bool)
+        self.items = 0
+        self.loaded_rows: List[Tuple[str, float, float, float]] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def load_rows(self, rows: Iterable[Tuple[str, float, float, float]]) -> None:
+        """Replace the parameters with (question_id, discrimination, difficulty, expected_time) rows."""
+        self.loaded_rows = list(rows)
+        rows = [(self.index.ordinal(r[0]), r[1], r[2], r[3]) for r in self.loaded_rows]
+        rows = [r for r in rows if r[0] is not None]
+        size = max((r[0] for r in rows), default=-1) + 1
+        a, b, t = np.ones(size), np.zeros(size), np.zeros(size)
+        calibrated = np.zeros(size, dtype=bool)
+        for o, disc, diff, expected in rows:
+            a[o], b[o], t[o], calibrated[o] = disc, diff, expected, True
+        # swap in one go so readers never see half-loaded parameters
+        self.a, self.b, self.expected_time, self.calibrated = a, b, t, calibrated
+        self.items = len(rows)
+
+    async def load(self, pool) -> None:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(ITEM_PARAMS_SQL)
+        self.load_rows((r["question_id"], r["discrimination"], r["difficulty"], r["expected_time"]) for r in rows)
+        logger.info(f"Item calibration loaded: {self.items} items")
+
+    def params(self, question_id: Any) -> Tuple[Optional[float], Optional[float]]:
+        """(discrimination, difficulty) of a calibrated question, else (None, None)."""
+        o = self.index.ordinal(question_id)
+        if o is None or o >= len(self.calibrated) or not self.calibrated[o]:
+            return None, None
+        return float(self.a[o]), float(self.b[o])
+
+    def p_correct(self, ordinal: int, theta: float) -> Optional[float]:
+        if ordinal >= len(self.calibrated) or not self.calibrated[ordinal]:
+            return None
+        return 1.0 / (1.0 + math.exp(-self.a[ordinal] * (theta - self.b[ordinal])))
+
+    def expected_seconds(self, question_id: Any, fallback: Optional[float] = None) -> Optional[float]:
+        """Calibrated typical answer time, else the question's estimatedTime, else `fallback`."""
+        o = self.index.ordinal(question_id)
+        if o is not None and o < len(self.calibrated) and self.calibrated[o]:
+            return float(self.expected_time[o])
+        rec = self.index.get(question_id)
+        return rec.estimatedTime if rec is not None and rec.estimatedTime else fallback
+
+    def start_refresh(self, pool) -> None:
+        """Reload every IRT_RELOAD_SECONDS, picking up new calibration runs."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(pool))
+
+    async def stop_refresh(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self, pool) -> None:
+        while True:
+            await asyncio.sleep(IRT_RELOAD_SECONDS)
+            try:
+                await self.load(pool)
+            except Exception as e:
+                logger.warning(f"Item calibration reload failed: {e!r}")
+
+
+async def ensure_irt_tables(conn) -> None:
+    """Create the calibration tables if missing."""
+    await conn.execute(IRT_DDL)
+
+
+item_calibration = ItemCalibration(question_index)
+
+
+# ---------------- batch calibration ----------------
+
+class Responses:
+    """Response history as a sparse user x item matrix in coordinate form."""
+    __slots__ = ("users", "items", "correct", "log_time", "user_ids", "question_ids")
+
+    def __init__(self, users: np.ndarray, items: np.ndarray, correct: np.ndarray, log_time: np.ndarray,
+                 user_ids: List[str], question_ids: List[str]):
+        self.users = users          # int32 index into user_ids
+        self.items = items          # int32 index into question_ids
+        self.correct = correct      # float64 0/1
+        self.log_time = log_time    # float32 log seconds, NaN when unknown
+        self.user_ids = user_ids
+        self.question_ids = question_ids
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+
+async def load_responses(pool, chunk_size: int = 10000) -> Responses:
+    """Stream the history through a server-side cursor into compact typed arrays."""
+    user_codes: Dict[str, int] = {}
+    item_codes: Dict[str, int] = {}
+    users, items, correct, log_time = array("i"), array("i"), array("b"), array("f")
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            async for r in conn.cursor(CALIBRATION_SQL, prefetch=chunk_size):
+                users.append(user_codes.setdefault(r["user_id"], len(user_codes)))
+                items.append(item_codes.setdefault(r["question_id"], len(item_codes)))
+                correct.append(1 if r["correct"] else 0)
+                t = r["time_taken"]
+                log_time.append(math.log(max(t, 1.0)) if t else math.nan)
+    return Responses(
+        np.array(users, dtype=np.int32), np.array(items, dtype=np.int32),
+        np.array(correct, dtype=np.float64), np.array(log_time, dtype=np.float32),
+        list(user_codes), list(item_codes),
+    )
+
+
+def fit(resp: Responses, b_prior: np.ndarray, iterations: int = 50, tol: float = 1e-3,
+        workers: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    MAP estimates of theta (per user), a and b (per item). Each iteration takes one damped
+    Fisher-scoring step for theta, then b, then log a; the per-parameter gradient and
+    information sums are bincounts over response chunks, computed on a thread pool
+    (NumPy releases the GIL on large arrays).
+    """
+    n_users, n_items = len(resp.user_ids), len(resp.question_ids)
+    theta = np.zeros(n_users)
+    b = b_prior.astype(np.float64).copy()
+    log_a = np.zeros(n_items)
+    workers = max(1, workers or os.cpu_count() or 1)
+    bounds = np.linspace(0, len(resp), workers + 1).astype(np.int64)
+    chunks = [slice(bounds[k], bounds[k + 1]) for k in range(workers) if bounds[k] < bounds[k + 1]]
+
+    def partial(target: str, sl: slice) -> Tuple[np.ndarray, np.ndarray]:
+        u, i, y = resp.users[sl], resp.items[sl], resp.correct[sl]
+        a = np.exp(log_a[i])
+        d = theta[u] - b[i]
+        p = 1.0 / (1.0 + np.exp(-a * d))
+        r, w = y - p, p * (1.0 - p)
+        if target == "theta":
+            return np.bincount(u, a * r, n_users), np.bincount(u, a * a * w, n_users)
+        if target == "b":
+            return np.bincount(i, -a * r, n_items), np.bincount(i, a * a * w, n_items)
+        return np.bincount(i, a * d * r, n_items), np.bincount(i, (a * d) ** 2 * w, n_items)
+
+    def sums(ex: ThreadPoolExecutor, target: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts = list(ex.map(lambda sl: partial(target, sl), chunks))
+        return sum(p[0] for p in parts), sum(p[1] for p in parts)
+
+    with ThreadPoolExecutor(workers) as ex:
+        for it in range(iterations):
+            g, h = sums(ex, "theta")
+            d_theta = np.clip((g - theta / THETA_PRIOR_SD ** 2) / (h + 1 / THETA_PRIOR_SD ** 2), -1, 1)
+            theta = np.clip(theta + d_theta, -THETA_LIMIT, THETA_LIMIT)
+            g, h = sums(ex, "b")
+            d_b = np.clip((g - (b - b_prior) / B_PRIOR_SD ** 2) / (h + 1 / B_PRIOR_SD ** 2), -1, 1)
+            b += d_b
+            g, h = sums(ex, "a")
+            d_log_a = np.clip((g - log_a / LOG_A_PRIOR_SD ** 2) / (h + 1 / LOG_A_PRIOR_SD ** 2), -0.5, 0.5)
+            log_a += d_log_a
+            change = max(np.abs(d_theta).max(initial=0), np.abs(d_b).max(initial=0), np.abs(d_log_a).max(initial=0))
+            if change < tol:
+                break
+        _, info = sums(ex, "theta")
+    logger.info(f"IRT fit: {len(resp)} responses, {n_users} users, {n_items} items, "
+                f"{it + 1} iterations, last change {change:.2e}")
+    return {"theta": theta, "info": info + THETA_INFO_PRIOR, "a": np.exp(log_a), "b": b}
+
+
+def expected_times(resp: Responses, time_prior: np.ndarray) -> np.ndarray:
+    """Per-item geometric mean answer time, shrunk towards estimatedTime for sparse items."""
+    n_items = len(resp.question_ids)
+    known = ~np.isnan(resp.log_time)
+    total = np.bincount(resp.items[known], resp.log_time[known].astype(np.float64), n_items)
+    count = np.bincount(resp.items[known], minlength=n_items)
+    return np.exp((total + TIME_SHRINK * np.log(time_prior)) / (count + TIME_SHRINK))
+
+
+ITEM_UPSERT_SQL = """
+    INSERT INTO agent_item_params SELECT * FROM irt_items
+    ON CONFLICT (question_id) DO UPDATE SET
+        discrimination = EXCLUDED.discrimination,
+        difficulty = EXCLUDED.difficulty,
+        expected_time = EXCLUDED.expected_time,
+        responses = EXCLUDED.responses,
+        calibrated_at = EXCLUDED.calibrated_at
+"""
+
+# batch estimates replace online ones; last_question_id is kept for retry deduplication
+USER_UPSERT_SQL = """
+    INSERT INTO agent_user_ability SELECT * FROM irt_users
+    ON CONFLICT (user_id) DO UPDATE SET
+        theta = EXCLUDED.theta,
+        info = EXCLUDED.info,
+        answers = EXCLUDED.answers,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+async def calibrate(pool, question_index, iterations: int = 50, workers: Optional[int] = None) -> Dict[str, int]:
+    """Fit the model on the whole history and upsert item parameters and user abilities."""
+    resp = await load_responses(pool)
+    if not len(resp):
+        logger.info("No responses to calibrate")
+        return {"responses": 0, "users": 0, "items": 0}
+    recs = [question_index.get(qid) for qid in resp.question_ids]
+    b_prior = np.array([(rec.difficulty - 3) * B_PER_LEVEL if rec and rec.difficulty else 0.0 for rec in recs])
+    time_prior = np.array([rec.estimatedTime if rec and rec.estimatedTime else 30.0 for rec in recs])
+
+    loop = asyncio.get_running_loop()
+    est = await loop.run_in_executor(None, fit, resp, b_prior, iterations, 1e-3, workers)
+    expected = expected_times(resp, time_prior)
+    item_counts = np.bincount(resp.items, minlength=len(resp.question_ids))
+    user_counts = np.bincount(resp.users, minlength=len(resp.user_ids))
+
+    now = datetime.utcnow()
+    item_rows = list(zip(resp.question_ids, est["a"].tolist(), est["b"].tolist(), expected.tolist(),
+                         item_counts.tolist(), [now] * len(resp.question_ids)))
+    user_rows = list(zip(resp.user_ids, est["theta"].tolist(), est["info"].tolist(), user_counts.tolist(),
+                         [None] * len(resp.user_ids), [now] * len(resp.user_ids)))
+    async with pool.acquire() as conn:
+        await ensure_irt_tables(conn)
+        async with conn.transaction():
+            await conn.execute("CREATE TEMP TABLE irt_items (LIKE agent_item_params) ON COMMIT DROP")
+            await conn.execute("CREATE TEMP TABLE irt_users (LIKE agent_user_ability) ON COMMIT DROP")
+            await conn.copy_records_to_table("irt_items", records=item_rows)
+            await conn.copy_records_to_table("irt_users", records=user_rows)
+            await conn.execute(ITEM_UPSERT_SQL)
+            await conn.execute(USER_UPSERT_SQL)
+    logger.info(f"Calibration wrote {len(item_rows)} items and {len(user_rows)} users")
+    return {"responses": len(resp), "users": len(user_rows), "items": len(item_rows)}
+
+
+async def _main(args) -> None:
+    from helper import get_pg_pool, close_pg_pool, questions_coll
+
+    await question_index.load(questions_coll)
+    print(await calibrate(await get_pg_pool(), question_index, args.iterations, args.workers))
+    await close_pg_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IRT calibration of question difficulty and user ability")
+    parser.add_argument("command", choices=["calibrate"])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="threads for the fit (default: CPU count)")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,182 @@
+# llm_batcher.py
+import os
+import json
+import asyncio
+import logging
+from typing import Optional, List, Dict, Any, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", 5))
+BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", 16))
+# Newer llama.cpp servers accept a list of prompts in one /completion request
+BATCH_MULTI_PROMPT = os.getenv("LLM_BATCH_MULTI_PROMPT", "0") == "1"
+
+
+class CompletionBatcher:
+    """
+    Micro-batching front for LlamaCppService.generate.
+    Prompts arriving within a few milliseconds are collected, identical prompts
+    (same sampling parameters) are merged, and the batch is either sent as one
+    multi-prompt request or spread over the server's parallel slots.
+    Every waiting coroutine gets its own result back.
+    A dispatched completion gets the latest deadline among its waiters; a caller whose
+    deadline runs past it starts a new request instead of joining. It is cancelled
+    (freeing the llama.cpp slot) once every waiter has given up.
+    """
+    def __init__(self, llm, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX_SIZE,
+                 multi_prompt: bool = BATCH_MULTI_PROMPT):
+        self.llm = llm
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.multi_prompt = multi_prompt
+        self._waiting: Dict[Tuple, asyncio.Future] = {}   # not yet dispatched
+        self._in_flight: Dict[Tuple, asyncio.Future] = {}  # dispatched, awaiting llama.cpp
+        # per completion future: a key can be in flight and waiting again at the same time
+        self._params: Dict[asyncio.Future, Dict[str, Any]] = {}
+        self._expires: Dict[asyncio.Future, float] = {}   # latest waiter deadline; the request's once dispatched
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._requests: Dict[asyncio.Future, asyncio.Future] = {}  # the llama.cpp request serving it
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.submitted = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.abandoned = 0
+
+    @staticmethod
+    def _key(prompt: str, params: Dict[str, Any]) -> Tuple:
+        return (prompt, json.dumps(params, sort_keys=True))
+
+    async def generate(self, prompt: str, deadline: Optional[float] = None, **params) -> str:
+        """Drop-in for `llm.generate`; raises RuntimeError like the service does."""
+        self.submitted += 1
+        loop = asyncio.get_running_loop()
+        key = self._key(prompt, params)
+        timeout = deadline or self.llm.timeout
+        expires = loop.time() + timeout
+        fut = self._waiting.get(key)
+        if fut is not None:
+            self._expires[fut] = max(self._expires[fut], expires)
+        else:
+            fut = self._in_flight.get(key)
+            if fut is not None and self._expires[fut] < expires:
+                fut = None  # its request gives up before this caller would: send another
+        if fut is not None:
+            self.deduplicated += 1
+        else:
+            fut = loop.create_future()
+            self._waiting[key] = fut
+            self._params[fut] = params
+            self._expires[fut] = expires
+            if len(self._waiting) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        self._waiters[fut] = self._waiters.get(fut, 0) + 1
+        try:
+            # shield: one caller's deadline must not cancel the shared completion
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError as e:
+            raise RuntimeError(f"Failed to generate completion: {e!r}")
+        finally:
+            self._leave(fut)
+
+    def _leave(self, fut: asyncio.Future) -> None:
+        """A waiter is done; cancel the request if nobody is waiting for any of its prompts."""
+        left = self._waiters.get(fut, 1) - 1
+        if left > 0:
+            self._waiters[fut] = left
+            return
+        self._waiters.pop(fut, None)
+        if fut.done():
+            return
+        request = self._requests.get(fut)
+        if request is None:
+            return  # not dispatched yet: _dispatch skips futures nobody waits for
+        if not any(self._waiters.get(f) for f, r in self._requests.items() if r is request):
+            self.abandoned += 1
+            request.cancel()
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._waiting:
+            return
+        batch = self._waiting
+        self._waiting = {}
+        self._in_flight.update(batch)
+        self.batches += 1
+        asyncio.create_task(self._dispatch(batch))
+
+    def _deadline(self, futs: List[asyncio.Future]) -> float:
+        """
+        Seconds left until the latest deadline among the futures' waiters, which becomes
+        the expiry of all of them: later callers only join when it covers their own deadline.
+        """
+        loop = asyncio.get_running_loop()
+        expires = max(self._expires[f] for f in futs)
+        for f in futs:
+            self._expires[f] = expires
+        return max(0.001, expires - loop.time())
+
+    async def _dispatch(self, batch: Dict[Tuple, asyncio.Future]) -> None:
+        # waiters that timed out while the window was open have nothing to wait for
+        keys = [k for k, f in batch.items() if self._waiters.get(f) and not f.done()]
+        try:
+            if self.multi_prompt and len(keys) > 1:
+                # one request per distinct parameter set, each carrying all of its prompts
+                groups: Dict[str, List[Tuple]] = {}
+                for key in keys:
+                    groups.setdefault(key[1], []).append(key)
+                requests = []
+                for group in groups.values():
+                    futs = [batch[k] for k in group]
+                    requests.append((group, asyncio.ensure_future(self.llm.generate_batch(
+                        [k[0] for k in group], deadline=self._deadline(futs), **self._params[futs[0]])), True))
+            else:
+                requests = [([key], asyncio.ensure_future(self.llm.generate(
+                    key[0], deadline=self._deadline([batch[key]]), **self._params[batch[key]])), False)
+                    for key in keys]
+            for group, request, _ in requests:
+                for key in group:
+                    self._requests[batch[key]] = request
+            await asyncio.gather(*(r for _, r, _ in requests), return_exceptions=True)
+            for group, request, batched in requests:
+                if request.cancelled():
+                    results = [RuntimeError("Failed to generate completion: abandoned by every waiter")] * len(group)
+                elif request.exception() is not None:
+                    results = [request.exception()] * len(group)
+                else:
+                    results = request.result() if batched else [request.result()]
+                for key, res in zip(group, results):
+                    self._resolve(batch[key], res)
+        finally:
+            for key, fut in batch.items():
+                self._resolve(fut, RuntimeError("Failed to generate completion: not dispatched"))
+                if self._in_flight.get(key) is fut:  # a later request for the key may have replaced it
+                    del self._in_flight[key]
+                self._params.pop(fut, None)
+                self._expires.pop(fut, None)
+                self._requests.pop(fut, None)
+
+    @staticmethod
+    def _resolve(fut: asyncio.Future, res: Any) -> None:
+        if fut.done():
+            return
+        if isinstance(res, BaseException):
+            fut.set_exception(res)
+            fut.exception()  # waiters may all have timed out; don't warn about it
+        else:
+            fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "batches": self.batches,
+            "waiting": len(self._waiting),
+            "in_flight": len(self._in_flight),
+            "abandoned": self.abandoned,
+        }
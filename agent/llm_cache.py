@@ -0,0 +1,180 @@
+# llm_cache.py
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Callable, Awaitable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_MAX_BUCKETS = int(os.getenv("LLM_CACHE_MAX_BUCKETS", 5000))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+LLM_CACHE_VARIANTS = int(os.getenv("LLM_CACHE_VARIANTS", 3))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")  # optional sqlite file for a persistent cache
+
+
+def mastery_band(mastery: float, width: int = 10) -> int:
+    """Round mastery down to a percentage band, e.g. 0.734 -> 70."""
+    return min(100, int(mastery * 100) // width * width)
+
+def timing_class(time_taken: float, estimated: Optional[float]) -> str:
+    """Coarse answer speed relative to the question's estimated time."""
+    if not estimated:
+        return "unknown"
+    if time_taken <= estimated * 0.9:
+        return "fast"
+    if time_taken > estimated * 1.5:
+        return "slow"
+    return "on-time"
+
+def bucket_key(kind: str, **fields: Any) -> str:
+    """Stable cache key for a message type and its already-bucketed prompt fields."""
+    return kind + ":" + json.dumps(fields, sort_keys=True, separators=(",", ":"))
+
+
+class _Bucket:
+    __slots__ = ("variants", "expires")
+
+    def __init__(self, variants: List[str], expires: float):
+        self.variants = variants
+        self.expires = expires
+
+
+class _SqliteBackend:
+    """Write-through persistent copy of the cache so warm buckets survive restarts."""
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, variants TEXT, expires REAL)"
+        )
+        self._db.commit()
+
+    def load(self, now: float) -> List[tuple]:
+        return self._db.execute(
+            "SELECT key, variants, expires FROM llm_cache WHERE expires > ? ORDER BY expires", (now,)
+        ).fetchall()
+
+    def save(self, key: str, variants: List[str], expires: float) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, variants, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(variants), expires),
+        )
+        self._db.commit()
+
+    def delete(self, key: str) -> None:
+        self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+        self._db.commit()
+
+
+class LLMResponseCache:
+    """
+    LRU/TTL cache of LLM tutor messages keyed by prompt bucket.
+    Each bucket collects up to `variants` different generations before it starts
+    serving from them, so students in the same bucket don't all see the same text.
+    """
+    def __init__(
+        self,
+        max_buckets: int = LLM_CACHE_MAX_BUCKETS,
+        ttl: float = LLM_CACHE_TTL_SECONDS,
+        variants: int = LLM_CACHE_VARIANTS,
+        path: Optional[str] = LLM_CACHE_PATH,
+    ):
+        self.max_buckets = max_buckets
+        self.ttl = ttl
+        self.variants = variants
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._backend = _SqliteBackend(path) if path else None
+        if self._backend is not None:
+            for key, variants_json, expires in self._backend.load(time.time()):
+                self._buckets[key] = _Bucket(json.loads(variants_json), expires)
+            self._trim()
+
+    def _trim(self) -> None:
+        while len(self._buckets) > self.max_buckets:
+            key, _ = self._buckets.popitem(last=False)
+            self.evictions += 1
+            if self._backend is not None:
+                self._backend.delete(key)
+
+    def _live(self, key: str) -> Optional[_Bucket]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        if bucket.expires <= time.time():
+            del self._buckets[key]
+            self.evictions += 1
+            return None
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def get(self, key: str) -> Optional[str]:
+        """A random variant once the bucket is full, otherwise None (caller should generate)."""
+        bucket = self._live(key)
+        if bucket is not None and len(bucket.variants) >= self.variants:
+            self.hits += 1
+            return random.choice(bucket.variants)
+        self.misses += 1
+        return None
+
+    def add(self, key: str, text: str) -> None:
+        """Store a freshly generated variant in its bucket."""
+        text = (text or "").strip()
+        if not text:
+            return
+        bucket = self._live(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket([], time.time() + self.ttl)
+        if text not in bucket.variants and len(bucket.variants) < self.variants:
+            bucket.variants.append(text)
+            if self._backend is not None:
+                self._backend.save(key, bucket.variants, bucket.expires)
+        self._trim()
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        Serve from the bucket, or run `generate` and remember its output.
+        Concurrent misses on one bucket share a single generation.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[key] = fut
+        try:
+            text = await generate()
+            if text:
+                self.add(key, text)
+            fut.set_result(text)
+            return text
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self._pending.pop(key, None)
+            if fut.done() and not fut.cancelled():
+                fut.exception()  # mark retrieved; waiters re-raise it themselves
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "buckets": len(self._buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,394 @@
+# llm_gateway.py
+# Front for several llama.cpp servers with the LlamaCppService interface, so the batcher,
+# the message pool and the request handlers use it unchanged.
+# - each request goes to the server with the fewest outstanding requests
+# - a circuit breaker per server: after LLM_BREAKER_FAILURES consecutive failures the server
+#   is skipped; with every server open, requests fail at once and callers use their
+#   rule-based fallbacks instead of waiting out a timeout
+# - background probes close a breaker again once its server answers
+# - a completion still running after the recent p90 latency is hedged to a second server;
+#   the first answer wins and the other request is cancelled
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, Optional, Dict, Any, AsyncIterator
+
+from llm_service import LlamaCppService
+from metrics import LLM_FIRST_TOKEN_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", 10))
+PROBE_INTERVAL_SECONDS = float(os.getenv("LLM_PROBE_INTERVAL_SECONDS", 5))
+PROBE_TIMEOUT_SECONDS = float(os.getenv("LLM_PROBE_TIMEOUT_SECONDS", 2))
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.9))  # 0 disables hedging
+HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", 100))
+HEDGE_MAX_FRACTION = float(os.getenv("LLM_HEDGE_MAX_FRACTION", 0.1))  # hedges per request, at most
+LATENCY_WINDOW = 256
+MIN_LATENCY_SAMPLES = 20
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    closed: requests flow. open: requests are refused until the cooldown passes or a probe
+    succeeds. half_open: one trial request; success closes the breaker, failure reopens it.
+    """
+    __slots__ = ("failures", "threshold", "cooldown", "state", "opened_at", "trial", "opens")
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial = False
+        self.opens = 0
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.trial = False
+        if self.state == HALF_OPEN:
+            return not self.trial
+        return self.state == CLOSED
+
+    def acquire(self) -> None:
+        """Called when a request is sent; in half_open it takes the single trial."""
+        if self.state == HALF_OPEN:
+            self.trial = True
+
+    def release(self) -> None:
+        """A request ended without an outcome (cancelled): give the trial back."""
+        self.trial = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = CLOSED
+        self.trial = False
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.opens += 1
+            self.state = OPEN
+            self.opened_at = now
+            self.trial = False
+
+    def trip(self, now: float) -> None:
+        """Open right away (a failed health probe)."""
+        if self.state != OPEN:
+            self.opens += 1
+        self.state = OPEN
+        self.opened_at = now
+        self.trial = False
+
+    def half_open(self) -> None:
+        """A probe reached the server: let the next request through as a trial."""
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            self.trial = False
+
+
+class Backend:
+    """One llama.cpp server: its client, breaker and recent latency."""
+    __slots__ = ("service", "breaker", "latency_ewma")
+
+    def __init__(self, service: LlamaCppService, breaker: CircuitBreaker):
+        self.service = service
+        self.breaker = breaker
+        self.latency_ewma = 0.0
+
+    @property
+    def outstanding(self) -> int:
+        return self.service.in_flight + self.service.queued
+
+    def observe(self, seconds: float) -> None:
+        self.latency_ewma = seconds if not self.latency_ewma else 0.8 * self.latency_ewma + 0.2 * seconds
+
+
+class LLMGateway:
+    """
+    Drop-in for LlamaCppService over several servers. `saturated` is also True when
+    every breaker is open, so handlers that check it skip the LLM without trying.
+    """
+    def __init__(self, services: List[LlamaCppService], timeout: Optional[float] = None,
+                 hedge_quantile: float = HEDGE_QUANTILE):
+        if not services:
+            raise ValueError("LLMGateway needs at least one llama.cpp server")
+        self.backends = [Backend(s, CircuitBreaker()) for s in services]
+        self.timeout = timeout or max(s.timeout for s in services)
+        self.hedge_quantile = hedge_quantile
+        self._latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+        self._hedge_after: Optional[float] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.short_circuits = 0
+
+    # ---------------- LlamaCppService interface ----------------
+
+    @property
+    def in_flight(self) -> int:
+        return sum(b.service.in_flight for b in self.backends)
+
+    @property
+    def queued(self) -> int:
+        return sum(b.service.queued for b in self.backends)
+
+    @property
+    def saturated(self) -> bool:
+        now = time.monotonic()
+        return not any(b.breaker.available(now) and not b.service.saturated for b in self.backends)
+
+    @property
+    def available(self) -> bool:
+        """At least one server's breaker lets requests through."""
+        now = time.monotonic()
+        return not self._closed and any(b.breaker.available(now) for b in self.backends)
+
+    async def check_server(self) -> bool:
+        """Probe every server now (updating the breakers); True if any is reachable."""
+        return any(await asyncio.gather(*(self._probe(b) for b in self.backends)))
+
+    async def close(self) -> None:
+        self._closed = True
+        await self.stop_probing()
+        for b in self.backends:
+            await b.service.close()
+
+    async def generate(self, prompt: str, n_predict: int = 512, temperature: float = 0.7,
+                       stop: Optional[List[str]] = None, deadline: Optional[float] = None, **kwargs) -> str:
+        """Completion from the least busy server, hedged to a second one when it runs long."""
+        return await self._call("generate", (prompt,), deadline,
+                                dict(n_predict=n_predict, temperature=temperature, stop=stop, **kwargs))
+
+    async def generate_batch(self, prompts: List[str], n_predict: int = 512, temperature: float = 0.7,
+                             stop: Optional[List[str]] = None, deadline: Optional[float] = None,
+                             **kwargs) -> List[str]:
+        return await self._call("generate_batch", (prompts,), deadline,
+                                dict(n_predict=n_predict, temperature=temperature, stop=stop, **kwargs))
+
+    async def stream(self, prompt: str, n_predict: int = 512, temperature: float = 0.7,
+                     stop: Optional[List[str]] = None, deadline: Optional[float] = None,
+                     **kwargs) -> AsyncIterator[str]:
+        """
+        Stream from the least busy server. A server failing before its first chunk is
+        failed over to another one; after that the stream is not hedged. A consumer that
+        stops reading after the first chunk (eviction, shutdown) counts as a success.
+        """
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (deadline or self.timeout)
+        requested = time.monotonic()
+        tried: List[Backend] = []
+        while True:
+            backend = self._choose(tried)
+            if backend is None:
+                if not tried:
+                    self.short_circuits += 1
+                raise RuntimeError("Failed to stream completion: no llama.cpp server available")
+            backend.breaker.acquire()
+            tried.append(backend)
+            t0 = time.monotonic()
+            started = False
+            outcome = False
+            try:
+                async for chunk in backend.service.stream(
+                        prompt, n_predict, temperature, stop, max(0.0, expires - loop.time()), **kwargs):
+                    if not started:
+                        started = True
+                        self._observe(backend, time.monotonic() - t0)
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - requested)
+                    yield chunk
+                outcome = True
+                backend.breaker.record_success()
+            except RuntimeError:
+                outcome = True
+                backend.breaker.record_failure(time.monotonic())
+                if started or loop.time() >= expires:
+                    raise
+                self.failovers += 1
+                continue
+            except Exception:
+                outcome = True
+                backend.breaker.record_failure(time.monotonic())
+                raise
+            finally:
+                if not outcome:
+                    if started:
+                        backend.breaker.record_success()  # the server was answering when the consumer left
+                    else:
+                        backend.breaker.release()  # consumer went away before the first chunk
+            return
+
+    # ---------------- routing ----------------
+
+    def _choose(self, exclude: List[Backend]) -> Optional[Backend]:
+        """Least outstanding requests among servers whose breaker allows one; ties go to the faster."""
+        if self._closed:
+            return None
+        now = time.monotonic()
+        best = None
+        for b in self.backends:
+            if b in exclude or not b.breaker.available(now):
+                continue
+            if best is None or (b.outstanding, b.latency_ewma) < (best.outstanding, best.latency_ewma):
+                best = b
+        return best
+
+    def _observe(self, backend: Backend, seconds: float) -> None:
+        backend.observe(seconds)
+        self._latencies.append(seconds)
+        if len(self._latencies) % 16 == 0:
+            self._hedge_after = None  # recomputed lazily
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds after which a second server is tried; None while hedging is off or unwarranted."""
+        if self.hedge_quantile <= 0 or len(self.backends) < 2 or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        if self.hedges >= HEDGE_MAX_FRACTION * self.requests:
+            return None
+        return self._latency_quantile()
+
+    def _latency_quantile(self) -> Optional[float]:
+        if self._hedge_after is None and self._latencies:
+            ordered = sorted(self._latencies)
+            q = ordered[min(len(ordered) - 1, int(self.hedge_quantile * len(ordered)))]
+            self._hedge_after = max(HEDGE_MIN_MS / 1000.0, q)
+        return self._hedge_after
+
+    async def _attempt(self, backend: Backend, method: str, args: tuple, params: Dict[str, Any]):
+        backend.breaker.acquire()
+        t0 = time.monotonic()
+        try:
+            # the gateway enforces the caller's deadline; the service only guards against a hung server
+            result = await getattr(backend.service, method)(*args, **params)
+        except asyncio.CancelledError:
+            backend.breaker.release()  # lost a hedge race, timed out in _call, or the caller gave up
+            raise
+        except Exception:
+            backend.breaker.record_failure(time.monotonic())
+            raise
+        backend.breaker.record_success()
+        self._observe(backend, time.monotonic() - t0)
+        return result
+
+    async def _call(self, method: str, args: tuple, deadline: Optional[float], params: Dict[str, Any]):
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (deadline or self.timeout)
+        tried: List[Backend] = []
+        tasks: Dict[asyncio.Task, Backend] = {}
+        error: Optional[BaseException] = None
+        hedged = False
+        hedge: Optional[Backend] = None
+
+        def launch() -> Optional[Backend]:
+            backend = self._choose(tried)
+            if backend is not None:
+                tried.append(backend)
+                tasks[asyncio.ensure_future(self._attempt(backend, method, args, params))] = backend
+            return backend
+
+        try:
+            if not launch():
+                self.short_circuits += 1
+                raise RuntimeError("Failed to generate completion: no llama.cpp server available")
+            while tasks:
+                remaining = expires - loop.time()
+                if remaining <= 0:
+                    # a server that never answers has to trip its breaker, not just give the trial back
+                    now = time.monotonic()
+                    for backend in tasks.values():
+                        backend.breaker.record_failure(now)
+                    raise RuntimeError("Failed to generate completion: TimeoutError()")
+                hedge_delay = None if hedged else self._hedge_delay()
+                done, _ = await asyncio.wait(
+                    tasks, timeout=min(remaining, hedge_delay) if hedge_delay else remaining,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_delay and not hedged and loop.time() < expires:
+                        hedged = True
+                        hedge = launch()
+                        if hedge is not None:
+                            self.hedges += 1
+                    continue
+                for task in done:
+                    backend = tasks.pop(task)
+                    if task.exception() is None:
+                        if backend is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                # every running attempt failed: fail over to a server not tried yet
+                if not tasks and launch() is not None:
+                    self.failovers += 1
+            raise error if error is not None else RuntimeError("Failed to generate completion")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # ---------------- health probes ----------------
+
+    async def _probe(self, backend: Backend) -> bool:
+        try:
+            ok = await asyncio.wait_for(backend.service.check_server(), PROBE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            ok = False
+        if ok:
+            backend.breaker.half_open()
+        else:
+            backend.breaker.trip(time.monotonic())
+        return ok
+
+    def start_probing(self) -> None:
+        """Probe every server each LLM_PROBE_INTERVAL_SECONDS, in the background."""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop_probing(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+            before = [b.breaker.state for b in self.backends]
+            await asyncio.gather(*(self._probe(b) for b in self.backends))
+            for b, state in zip(self.backends, before):
+                if b.breaker.state != state:
+                    logger.info(f"llama.cpp {b.service.api_url}: {state} -> {b.breaker.state}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "short_circuits": self.short_circuits,
+            "hedge_after_ms": round(self._latency_quantile() * 1000, 1) if self._latencies else None,
+            "servers": [
+                {
+                    "url": b.service.api_url,
+                    "state": b.breaker.state,
+                    "outstanding": b.outstanding,
+                    "latency_ms": round(b.latency_ewma * 1000, 1),
+                    "breaker_opens": b.breaker.opens,
+                }
+                for b in self.backends
+            ],
+        }
@@ -1,21 +1,37 @@
 import os
 import logging
 from llm_service import LlamaCppService
+from llm_gateway import LLMGateway
+from llm_batcher import CompletionBatcher
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 LLAMA_SERVER_URL = os.getenv("LLAMA_SERVER_URL", "http://127.0.0.1:8080")
+# comma-separated; requests are spread over all of them (see llm_gateway.py)
+LLAMA_SERVER_URLS = [u.strip() for u in os.getenv("LLAMA_SERVER_URLS", LLAMA_SERVER_URL).split(",") if u.strip()]
 TIMEOUT = int(os.getenv("LLAMA_TIMEOUT", 600))
+MAX_CONCURRENCY = int(os.getenv("LLAMA_MAX_CONCURRENCY", 8))
+POOL_SIZE = int(os.getenv("LLAMA_POOL_SIZE", 16))
 
+# Construction doesn't touch the network; the gateway probes the servers in the background,
+# so one that is down at startup is picked up once it answers
 try:
-    llm_service = LlamaCppService(
-        api_url=LLAMA_SERVER_URL,
-        timeout=TIMEOUT,
-    )
+    llm_service = LLMGateway([
+        LlamaCppService(
+            api_url=url,
+            timeout=TIMEOUT,
+            max_concurrency=MAX_CONCURRENCY,
+            pool_size=POOL_SIZE,
+        )
+        for url in LLAMA_SERVER_URLS
+    ], timeout=TIMEOUT)
+    # completions from request handlers go through the micro-batcher
+    llm_batcher = CompletionBatcher(llm_service)
     llm_initialized = True
-    logger.info("LlamaCppService initialized successfully")
+    logger.info(f"LLM gateway configured for {', '.join(LLAMA_SERVER_URLS)}")
 except Exception as e:
     logger.error(f"Failed to initialize LlamaCppService: {e}")
     llm_service = None
-    llm_initialized = False
\ No newline at end of file
+    llm_batcher = None
+    llm_initialized = False
@@ -1,97 +1,243 @@
 # llm_service.py
-import requests
+import json
+import asyncio
 import logging
-from typing import List, Optional, Dict, Any, Union
+import aiohttp
+from typing import List, Optional, Dict, Any, AsyncIterator, Union
+
+from metrics import LLM_PROMPT_TOKENS, LLM_PROMPT_SECONDS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class LlamaCppService:
     """
-    A client for llama.cpp server API.
-    Connects to a running llama-server instance via HTTP.
+    An async client for llama.cpp server API.
+    One instance is shared by the whole agent: it keeps a pooled keep-alive
+    aiohttp session, caps in-flight completions and applies a deadline per request.
     """
     def __init__(
         self,
         api_url: str = "http://127.0.0.1:8080",
         timeout: int = 600,
+        max_concurrency: int = 8,
+        pool_size: int = 16,
+        keepalive_timeout: float = 60,
     ):
         self.api_url = api_url.rstrip('/')
         self.completion_endpoint = f"{self.api_url}/completion"
         self.timeout = timeout
-        
-        # Verify server is available
-        try:
-            self._check_server_connection()
-            logger.info(f"Connected to llama.cpp server at {self.api_url}")
-        except Exception as e:
-            logger.error(f"Failed to connect to llama.cpp server: {e}")
-            raise ConnectionError(f"Cannot connect to llama.cpp server at {self.api_url}: {str(e)}")
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.in_flight = 0
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a completion slot."""
+        return len(getattr(self._semaphore, "_waiters", None) or ())
+
+    @property
+    def saturated(self) -> bool:
+        """True when every completion slot is busy and new requests would queue."""
+        return self._semaphore.locked()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Create the shared session lazily, inside the running event loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        """Close the pooled connections (call on shutdown)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
-    def _check_server_connection(self) -> None:
+    async def check_server(self) -> bool:
         """Verify the server is reachable"""
         try:
-            # Most llama.cpp servers have a root endpoint that returns info
-            response = requests.get(self.api_url, timeout=5)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            raise ConnectionError(f"Server connection check failed: {str(e)}")
-
-    def generate(
-        self, 
-        prompt: str, 
+            async with self._get_session().get(
+                self.api_url, timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                return response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Server connection check failed: {e}")
+            return False
+
+    def _payload(
+        self,
+        prompt: Union[str, List[str]],
+        n_predict: int,
+        temperature: float,
+        stop: Optional[List[str]],
+        stream: bool,
+        **kwargs
+    ) -> Dict[str, Any]:
+        if stop is None:
+            stop = ["</s>"]
+        return {
+            "prompt": prompt,
+            "n_predict": n_predict,
+            "temperature": temperature,
+            "stop": stop,
+            "stream": stream,
+            **kwargs
+        }
+
+    @staticmethod
+    def _extract_content(result: Dict[str, Any]) -> str:
+        # The exact structure depends on the llama.cpp server version
+        if "content" in result:
+            return result["content"]
+        elif "completion" in result:
+            return result["completion"]
+        elif "text" in result:
+            return result["text"]
+        logger.warning(f"Unexpected response format: {result}")
+        return str(result)
+
+    @staticmethod
+    def _record_timings(result: Dict[str, Any]) -> None:
+        """Prompt tokens evaluated vs. reused from the KV cache, when the server reports them."""
+        if "tokens_evaluated" in result:
+            LLM_PROMPT_TOKENS.observe(result["tokens_evaluated"], "evaluated")
+        if "tokens_cached" in result:
+            LLM_PROMPT_TOKENS.observe(result["tokens_cached"], "cached")
+        timings = result.get("timings")
+        if timings and "prompt_ms" in timings:
+            LLM_PROMPT_SECONDS.observe(timings["prompt_ms"] / 1000.0)
+
+    async def _post(self, payload: Dict[str, Any]) -> str:
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                async with self._get_session().post(self.completion_endpoint, json=payload) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+                    self._record_timings(result)
+                    return self._extract_content(result)
+            finally:
+                self.in_flight -= 1
+
+    async def generate(
+        self,
+        prompt: str,
         n_predict: int = 512,
         temperature: float = 0.7,
         stop: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
         **kwargs
     ) -> str:
         """
         Send a completion request to the llama.cpp server.
-        
+
         Args:
             prompt: The text prompt to generate from
             n_predict: Maximum number of tokens to predict
             temperature: Sampling temperature (higher = more random)
             stop: List of strings that will stop generation when encountered
+            deadline: Seconds allowed for the whole request, including the wait
+                for a free slot (defaults to the service timeout)
             **kwargs: Additional parameters to pass to the API
-            
+
         Returns:
             The generated text response
         """
-        if stop is None:
-            stop = ["</s>"]
-            
-        payload = {
-            "prompt": prompt,
-            "n_predict": n_predict,
-            "temperature": temperature,
-            "stop": stop,
-            **kwargs
-        }
-        
+        payload = self._payload(prompt, n_predict, temperature, stop, False, **kwargs)
         logger.info(f"Sending completion request: {prompt[:50]}...")
-        
         try:
-            response = requests.post(
+            return await asyncio.wait_for(self._post(payload), deadline or self.timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Request to llama.cpp server failed: {e!r}")
+            raise RuntimeError(f"Failed to generate completion: {e!r}")
+
+    async def generate_batch(
+        self,
+        prompts: List[str],
+        n_predict: int = 512,
+        temperature: float = 0.7,
+        stop: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> List[str]:
+        """
+        Send several prompts in one request (llama.cpp multi-prompt `/completion`).
+        Returns one generated text per prompt, in order.
+        """
+        payload = self._payload(prompts, n_predict, temperature, stop, False, **kwargs)
+        logger.info(f"Sending batched completion request: {len(prompts)} prompts")
+
+        async def post() -> List[str]:
+            async with self._semaphore:
+                self.in_flight += 1
+                try:
+                    async with self._get_session().post(self.completion_endpoint, json=payload) as response:
+                        response.raise_for_status()
+                        result = await response.json()
+                finally:
+                    self.in_flight -= 1
+            results = result if isinstance(result, list) else result.get("results", [result])
+            if len(results) != len(prompts):
+                raise ValueError(f"Expected {len(prompts)} completions, got {len(results)}")
+            for r in results:
+                self._record_timings(r)
+            return [self._extract_content(r) for r in results]
+
+        try:
+            return await asyncio.wait_for(post(), deadline or self.timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Batched request to llama.cpp server failed: {e!r}")
+            raise RuntimeError(f"Failed to generate completion: {e!r}")
+
+    async def stream(
+        self,
+        prompt: str,
+        n_predict: int = 512,
+        temperature: float = 0.7,
+        stop: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Stream a completion using the server's `stream: true` mode.
+        Yields text chunks as soon as llama.cpp emits them; the deadline bounds the whole stream.
+        """
+        payload = self._payload(prompt, n_predict, temperature, stop, True, **kwargs)
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (deadline or self.timeout)
+        logger.info(f"Sending streaming completion request: {prompt[:50]}...")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), expires - loop.time())
+        except asyncio.TimeoutError as e:
+            raise RuntimeError(f"Failed to generate completion: {e!r}")
+        self.in_flight += 1
+        try:
+            async with self._get_session().post(
                 self.completion_endpoint,
                 json=payload,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract the generated content from the response
-            # The exact structure depends on the llama.cpp server version
-            if "content" in result:
-                return result["content"]
-            elif "completion" in result:
-                return result["completion"]
-            elif "text" in result:
-                return result["text"]
-            else:
-                logger.warning(f"Unexpected response format: {result}")
-                return str(result)
-                
-        except requests.RequestException as e:
-            logger.error(f"Request to llama.cpp server failed: {e}")
-            raise RuntimeError(f"Failed to generate completion: {str(e)}")
\ No newline at end of file
+                timeout=aiohttp.ClientTimeout(total=max(0.0, expires - loop.time())),
+            ) as response:
+                response.raise_for_status()
+                async for raw in response.content:
+                    line = raw.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[5:].strip())
+                    content = chunk.get("content")
+                    if content:
+                        yield content
+                    if chunk.get("stop"):
+                        self._record_timings(chunk)
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Streaming request to llama.cpp server failed: {e!r}")
+            raise RuntimeError(f"Failed to stream completion: {e!r}")
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
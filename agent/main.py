@@ -1,17 +1,72 @@
 # main.py
+# `python main.py --prod` runs several worker processes on one port, each with its own
+# in-process state. Sessions must then live in a shared store (SESSION_STORE=postgres, the
+# default in --prod, or redis): with "memory" a session started on one worker is unknown
+# to the others. Exclusion sets are per-worker caches rebuilt from Postgres.
+# Speculation (prefetch.py) writes an answer behind the response on the worker that
+# served it; if the session's next answer reaches another worker first, the mastery and
+# ability updates apply out of order. So with several workers it is off by default
+# (PREFETCH_ENABLED=0); turn it on only with session affinity (sticky on sessionId) at the
+# load balancer. Streamed feedback (SSE) is held by the worker that made the decision too:
+# route /agent/feedback/{sessionId}/... sticky on sessionId, or use stream_message=false.
+# /metrics sums the workers' counters through AGENT_METRICS_DIR (see metrics.py).
 import os
+import sys
+import glob
+import socket
+import argparse
+import tempfile
 import logging
 import uvicorn
 
-from api import app  # Import the FastAPI app from api.py
-
 TIMEOUT = int(os.getenv("LLAMA_TIMEOUT", 600))
+HOST = os.getenv("AGENT_HOST", "0.0.0.0")
+PORT = int(os.getenv("AGENT_PORT", 8001))
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8001,
-        reload=True,
-        timeout_keep_alive=TIMEOUT,
-    )
+    parser = argparse.ArgumentParser(description="MentalMath agent")
+    parser.add_argument("--prod", action="store_true",
+                        help="production mode: several worker processes, no auto-reload")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AGENT_WORKERS", os.cpu_count() or 1)),
+                        help="worker processes in production mode (default: CPU count)")
+    args = parser.parse_args()
+
+    if args.prod:
+        # workers inherit the environment, so this is what their session_store is built from
+        store = os.environ.setdefault("SESSION_STORE", "postgres")
+        if store not in ("postgres", "redis") and args.workers > 1:
+            sys.exit(f"SESSION_STORE={store} keeps sessions per process; with {args.workers} workers "
+                     f"use SESSION_STORE=postgres or redis (or --workers 1)")
+        if args.workers > 1:
+            # answers written behind the response are only ordered within one worker
+            os.environ.setdefault("PREFETCH_ENABLED", "0")
+            if os.getenv("AGENT_WIRE_PORT"):
+                # every worker binds the wire port, which needs SO_REUSEPORT
+                if not hasattr(socket, "SO_REUSEPORT"):
+                    sys.exit(f"AGENT_WIRE_PORT needs SO_REUSEPORT with {args.workers} workers; "
+                             f"unset it (the REST routes still work) or use --workers 1")
+                os.environ["AGENT_WIRE_REUSE_PORT"] = "1"
+        # every worker writes its metrics here and /metrics sums them (see metrics.py);
+        # snapshots of a previous run would be counted again, so start empty
+        metrics_dir = os.environ.setdefault("AGENT_METRICS_DIR", tempfile.mkdtemp(prefix="agent-metrics-"))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+        # each worker runs the app lifespan: pools, question index and LLM
+        # connections are warm before it accepts requests
+        uvicorn.run(
+            "api:app",
+            host=HOST,
+            port=PORT,
+            workers=args.workers,
+            timeout_keep_alive=int(os.getenv("AGENT_KEEP_ALIVE", 75)),
+            log_level="info",
+        )
+    else:
+        uvicorn.run(
+            "api:app",
+            host=HOST,
+            port=PORT,
+            reload=True,
+            timeout_keep_alive=TIMEOUT,
+        )
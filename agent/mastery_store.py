@@ -0,0 +1,246 @@
+# mastery_store.py
+# Incremental per-user, per-topic mastery state.
+# Each (userId, topic) keeps a constant-size summary updated in O(1) per answer:
+# lifetime counts, a bitmask of the last WINDOW outcomes with its correct count,
+# and exponentially-weighted accuracy and answer time.
+# The state is folded from AnswerEvents, so the backend posts every answer, wrong ones
+# included; then it agrees with the backfill below, which reads the same question_session rows.
+# Rebuild it from history with: python mastery_store.py backfill
+import asyncio
+import logging
+from typing import Optional, Dict, Tuple, Any
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WINDOW = 50  # same horizon as the old "last 50 rows" query
+WINDOW_MASK = (1 << WINDOW) - 1
+EWMA_ALPHA = 2.0 / (WINDOW + 1)
+DEFAULT_MASTERY = 0.5
+REFERENCE_SECONDS = 30.0  # "on time" on the mastery time curve
+
+MASTERY_DDL = """
+    CREATE TABLE IF NOT EXISTS agent_mastery (
+        user_id TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        total_correct INT NOT NULL DEFAULT 0,
+        window_bits BIGINT NOT NULL DEFAULT 0,
+        window_len SMALLINT NOT NULL DEFAULT 0,
+        window_correct SMALLINT NOT NULL DEFAULT 0,
+        ewma_acc REAL NOT NULL DEFAULT 0,
+        ewma_time REAL NOT NULL DEFAULT 0,
+        last_question_id TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (user_id, topic)
+    )
+"""
+
+MASTERY_COLUMNS = """
+    (user_id, topic, total, total_correct, window_bits, window_len, window_correct,
+     ewma_acc, ewma_time, last_question_id, updated_at)
+"""
+
+# First-answer values; $1 user, $2 topic, $3 correct (0/1), $4 timeTaken, $5 questionId
+RECORD_VALUES = "$1::text, $2::text, 1, $3::int, $3::int, 1, $3::int, $3::int, $4::real, $5::text, NOW()"
+
+# $6 window mask, $7 window size, $8 EWMA alpha.
+# The WHERE clause makes a retried AnswerEvent for the same question a no-op.
+RECORD_ON_CONFLICT = """
+    ON CONFLICT (user_id, topic) DO UPDATE SET
+        total = m.total + 1,
+        total_correct = m.total_correct + $3::int,
+        window_bits = ((m.window_bits << 1) | $3::int::bigint) & $6::bigint,
+        window_len = LEAST(m.window_len + 1, $7::int),
+        window_correct = m.window_correct + $3::int
+            - CASE WHEN m.window_len >= $7::int THEN ((m.window_bits >> ($7::int - 1)) & 1)::int ELSE 0 END,
+        ewma_acc = m.ewma_acc + $8::real * ($3::int - m.ewma_acc),
+        ewma_time = m.ewma_time + $8::real * ($4::real - m.ewma_time),
+        last_question_id = $5,
+        updated_at = NOW()
+    WHERE m.last_question_id IS DISTINCT FROM $5
+"""
+
+STATE_COLUMNS = "total, total_correct, window_bits, window_len, window_correct, ewma_acc, ewma_time"
+
+# One atomic statement per answer, so concurrent workers never lose updates.
+RECORD_SQL = f"""
+    INSERT INTO agent_mastery AS m {MASTERY_COLUMNS}
+    VALUES ({RECORD_VALUES})
+    {RECORD_ON_CONFLICT}
+    RETURNING {STATE_COLUMNS}
+"""
+
+SELECT_SQL = f"""
+    SELECT {STATE_COLUMNS}
+    FROM agent_mastery WHERE user_id=$1 AND topic=$2
+"""
+
+UPSERT_SQL = """
+    INSERT INTO agent_mastery
+        (user_id, topic, total, total_correct, window_bits, window_len, window_correct,
+         ewma_acc, ewma_time, last_question_id, updated_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, NOW())
+    ON CONFLICT (user_id, topic) DO UPDATE SET
+        total = EXCLUDED.total,
+        total_correct = EXCLUDED.total_correct,
+        window_bits = EXCLUDED.window_bits,
+        window_len = EXCLUDED.window_len,
+        window_correct = EXCLUDED.window_correct,
+        ewma_acc = EXCLUDED.ewma_acc,
+        ewma_time = EXCLUDED.ewma_time,
+        last_question_id = EXCLUDED.last_question_id,
+        updated_at = NOW()
+"""
+
+
+class MasteryState:
+    """Constant-size mastery summary for one (userId, topic)."""
+    __slots__ = (
+        "total", "total_correct", "window_bits", "window_len", "window_correct",
+        "ewma_acc", "ewma_time", "last_question_id",
+    )
+
+    def __init__(self):
+        self.total = 0
+        self.total_correct = 0
+        self.window_bits = 0
+        self.window_len = 0
+        self.window_correct = 0
+        self.ewma_acc = 0.0
+        self.ewma_time = 0.0
+        self.last_question_id: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "MasteryState":
+        state = cls()
+        for field in ("total", "total_correct", "window_bits", "window_len",
+                      "window_correct", "ewma_acc", "ewma_time"):
+            setattr(state, field, row[field])
+        return state
+
+    def apply(self, correct: bool, time_taken: float, question_id: Optional[str] = None) -> None:
+        """Fold one answer into the state; mirrors RECORD_SQL."""
+        if question_id is not None and question_id == self.last_question_id:
+            return
+        bit = 1 if correct else 0
+        if self.total == 0:
+            self.ewma_acc = float(bit)
+            self.ewma_time = float(time_taken)
+        else:
+            self.ewma_acc += EWMA_ALPHA * (bit - self.ewma_acc)
+            self.ewma_time += EWMA_ALPHA * (time_taken - self.ewma_time)
+        if self.window_len >= WINDOW:
+            self.window_correct -= (self.window_bits >> (WINDOW - 1)) & 1
+        self.window_bits = ((self.window_bits << 1) | bit) & WINDOW_MASK
+        self.window_len = min(self.window_len + 1, WINDOW)
+        self.window_correct += bit
+        self.total += 1
+        self.total_correct += bit
+        self.last_question_id = question_id
+
+    def mastery(self) -> float:
+        """
+        Same blend as before: 60% recent accuracy, 40% time score on a 30 s / 60 s curve.
+        Times are recorded through `normalized_time`, so 30 s means "as long as the question takes".
+        """
+        if self.window_len == 0:
+            return DEFAULT_MASTERY
+        correct_rate = self.window_correct / self.window_len
+        avg_time = self.ewma_time
+        time_score = 1.0 if avg_time <= 30 else max(0, 1 - (avg_time-30)/60)
+        mastery = 0.6*correct_rate + 0.4*time_score
+        return max(0.0, min(1.0, mastery))
+
+    def as_row(self, user_id: str, topic: str) -> Tuple[Any, ...]:
+        return (user_id, topic, self.total, self.total_correct, self.window_bits,
+                self.window_len, self.window_correct, self.ewma_acc, self.ewma_time,
+                self.last_question_id)
+
+
+def normalized_time(time_taken: float, expected: Optional[float]) -> float:
+    """Answer time rescaled so that the question's expected time reads as REFERENCE_SECONDS."""
+    if not expected:
+        return float(time_taken)
+    return float(time_taken) * REFERENCE_SECONDS / expected
+
+async def ensure_mastery_table(conn) -> None:
+    """Create the agent_mastery table if missing."""
+    await conn.execute(MASTERY_DDL)
+
+def record_args(user_id: str, topic: str, correct: bool, time_taken: float,
+                question_id: Optional[str] = None) -> Tuple[Any, ...]:
+    """Positional parameters $1..$8 for RECORD_SQL (and statements embedding it)."""
+    return (user_id, topic, 1 if correct else 0, float(time_taken),
+            question_id, WINDOW_MASK, WINDOW, EWMA_ALPHA)
+
+async def record_answer(conn, user_id: str, topic: str, correct: bool, time_taken: float,
+                        question_id: Optional[str] = None) -> float:
+    """Apply one AnswerEvent to the stored state and return the updated mastery."""
+    row = await conn.fetchrow(RECORD_SQL, *record_args(user_id, topic, correct, time_taken, question_id))
+    if row is None:
+        # duplicate delivery of the same answer: state is unchanged
+        row = await conn.fetchrow(SELECT_SQL, user_id, topic)
+    return MasteryState.from_row(row).mastery() if row else DEFAULT_MASTERY
+
+async def get_mastery(conn, user_id: str, topic: str) -> float:
+    """Primary-key lookup of the current mastery."""
+    row = await conn.fetchrow(SELECT_SQL, user_id, topic)
+    return MasteryState.from_row(row).mastery() if row else DEFAULT_MASTERY
+
+
+# ---------------- batch backfill ----------------
+
+BACKFILL_SQL = """
+    SELECT s."userId" AS user_id, qs."questionId" AS question_id,
+           qs.correct, qs."timeTaken" AS time_taken
+    FROM question_session qs
+    JOIN session s ON qs."sessionId" = s.id
+    WHERE s."userId" IS NOT NULL AND qs.response <> ''
+    ORDER BY qs.timestamp
+"""
+
+async def backfill(pool, question_index, calibration=None, chunk_size: int = 5000) -> int:
+    """
+    Rebuild every mastery state from `question_session` history.
+    Rows are streamed through a server-side cursor and folded in timestamp order.
+    Answer times are normalized by the calibrated expected time when `calibration` is given.
+    """
+    states: Dict[Tuple[str, str], MasteryState] = {}
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            async for r in conn.cursor(BACKFILL_SQL, prefetch=chunk_size):
+                rec = question_index.get(r["question_id"])
+                if rec is None:
+                    continue
+                key = (str(r["user_id"]), rec.topic)
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = MasteryState()
+                expected = calibration.expected_seconds(r["question_id"]) if calibration else rec.estimatedTime
+                state.apply(r["correct"], normalized_time(r["time_taken"] or 0, expected), r["question_id"])
+        await ensure_mastery_table(conn)
+        rows = [state.as_row(user_id, topic) for (user_id, topic), state in states.items()]
+        for i in range(0, len(rows), chunk_size):
+            await conn.executemany(UPSERT_SQL, rows[i:i + chunk_size])
+    logger.info(f"Mastery backfill wrote {len(rows)} user/topic states")
+    return len(rows)
+
+
+async def _main(argv) -> None:
+    from helper import get_pg_pool, questions_coll
+    from question_index import question_index
+    from irt import item_calibration
+
+    if argv[1:] != ["backfill"]:
+        print("usage: python mastery_store.py backfill")
+        return
+    await question_index.load(questions_coll)
+    pool = await get_pg_pool()
+    await item_calibration.load(pool)
+    await backfill(pool, question_index, item_calibration)
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(_main(sys.argv))
@@ -0,0 +1,136 @@
+# message_pool.py
+import os
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, List, Dict, Tuple, Deque
+
+from models import STRATEGY_TIPS
+from prompts import Prompt, compile_prompt
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POOL_PER_KEY = int(os.getenv("MESSAGE_POOL_PER_KEY", 5))
+POOL_MAX_MESSAGES = int(os.getenv("MESSAGE_POOL_MAX_MESSAGES", 1000))
+POOL_IDLE_POLL_SECONDS = float(os.getenv("MESSAGE_POOL_IDLE_POLL_SECONDS", 2))
+
+DIFFICULTY_BANDS = ("easy", "medium", "hard")
+ACCURACY_BANDS = ("low", "medium", "high")
+
+PoolKey = Tuple[str, ...]
+
+
+def difficulty_band(difficulty: int) -> str:
+    """Map the 1-5 difficulty scale to three bands."""
+    if difficulty <= 2:
+        return "easy"
+    if difficulty == 3:
+        return "medium"
+    return "hard"
+
+def accuracy_band(accuracy: float) -> str:
+    """Map an accuracy percentage to the same bands the session recommendations use."""
+    if accuracy < 70:
+        return "low"
+    if accuracy < 90:
+        return "medium"
+    return "high"
+
+def answer_key(topic: str, was_correct: bool, difficulty: int) -> PoolKey:
+    return ("answer", topic, "correct" if was_correct else "incorrect", difficulty_band(difficulty))
+
+def summary_key(overall_accuracy: float) -> PoolKey:
+    return ("summary", accuracy_band(overall_accuracy))
+
+def _prompt_for(key: PoolKey) -> Prompt:
+    if key[0] == "summary":
+        return compile_prompt("pool_summary", accuracy=key[1])
+    _, topic, outcome, band = key
+    return compile_prompt("pool_correct" if outcome == "correct" else "pool_incorrect", topic=topic, difficulty=band)
+
+
+class MessagePool:
+    """
+    Pre-generated tutor messages for every (topic, outcome, difficulty band) plus session summaries.
+    A background worker fills the emptiest key whenever llama.cpp is idle;
+    request handlers take a ready message in O(1) when the LLM is saturated or slow.
+    """
+    def __init__(self, per_key: int = POOL_PER_KEY, max_messages: int = POOL_MAX_MESSAGES):
+        self.per_key = per_key
+        self.max_messages = max_messages
+        self.keys: List[PoolKey] = [
+            ("answer", topic, outcome, band)
+            for topic in STRATEGY_TIPS
+            for outcome in ("correct", "incorrect")
+            for band in DIFFICULTY_BANDS
+        ] + [("summary", band) for band in ACCURACY_BANDS]
+        self._messages: Dict[PoolKey, Deque[str]] = {k: deque(maxlen=per_key) for k in self.keys}
+        self._size = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def take(self, key: PoolKey) -> Optional[str]:
+        """A ready message for the key; the last one is kept so the key never runs dry."""
+        messages = self._messages.get(key)
+        if not messages:
+            return None
+        if len(messages) == 1:
+            return messages[0]
+        idx = random.randrange(len(messages))
+        messages.rotate(-idx)
+        self._size -= 1
+        return messages.popleft()
+
+    def add(self, key: PoolKey, text: str) -> None:
+        messages = self._messages.get(key)
+        text = (text or "").strip()
+        if messages is None or not text or self._size >= self.max_messages:
+            return
+        if len(messages) < messages.maxlen:
+            self._size += 1
+        messages.append(text)
+
+    def _emptiest_key(self) -> Optional[PoolKey]:
+        key = min(self.keys, key=lambda k: len(self._messages[k]))
+        return key if len(self._messages[key]) < self.per_key else None
+
+    # ---------------- background refill ----------------
+
+    def start(self, llm, generate) -> None:
+        """Start refilling in the background; `generate(prompt)` returns text or ''."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refill_loop(llm, generate))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refill_loop(self, llm, generate) -> None:
+        while True:
+            key = self._emptiest_key() if self._size < self.max_messages else None
+            # only use llama.cpp when no student request is waiting on it
+            if key is None or llm is None or llm.in_flight > 0:
+                await asyncio.sleep(POOL_IDLE_POLL_SECONDS)
+                continue
+            try:
+                text = await generate(_prompt_for(key))
+            except Exception as e:
+                logger.warning(f"Message pool refill failed: {e!r}")
+                text = ""
+            if text:
+                self.add(key, text)
+            else:
+                # LLM unavailable: back off instead of spinning
+                await asyncio.sleep(POOL_IDLE_POLL_SECONDS)
+
+
+message_pool = MessagePool()
@@ -0,0 +1,327 @@
+# metrics.py
+# In-process metrics, rendered in the Prometheus text format on GET /metrics.
+# Counters and histograms cost a dict lookup and an add on the hot path; gauges are
+# callbacks read only when scraped. Values are per process; with `main.py --prod` the
+# workers share one port, so each also writes its samples to AGENT_METRICS_DIR (every
+# METRICS_SNAPSHOT_SECONDS and on shutdown) and a scrape, whichever worker serves it,
+# reports counters and histograms summed over all workers (exited ones included, so
+# they never go backwards) and gauges per live worker, labelled with its pid.
+import os
+import json
+import time
+import random
+import bisect
+import asyncio
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, Any, Callable, Iterable
+
+from pymongo import monitoring
+
+TRACE_SAMPLE_RATE = float(os.getenv("AGENT_TRACE_SAMPLE_RATE", 0))
+METRICS_DIR = os.getenv("AGENT_METRICS_DIR")  # set by `main.py --prod`
+METRICS_SNAPSHOT_SECONDS = float(os.getenv("METRICS_SNAPSHOT_SECONDS", 5))
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY: List[Any] = []
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _quote(value: Any) -> str:
+    return '"' + _escape(value) + '"'
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f"{n}={_quote(v)}" for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter, optionally labelled: `errors.inc("llm")`."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Bucketed observations with sum and count: `latency.observe(0.012, "llm")`."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values: Dict[Tuple[Any, ...], list] = {}  # labels -> [per-bucket counts, sum, count]
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for le, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, 'le=%s' % _quote(le))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, 'le=%s' % _quote('+Inf'))} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Callback:
+    """
+    Value read at scrape time. `fn` returns a number, or a dict of label tuples to numbers;
+    None skips the metric (e.g. a pool that isn't open yet). `kind` is "gauge" or "counter".
+    """
+    def __init__(self, name: str, help: str, fn: Callable[[], Any],
+                 labelnames: Tuple[str, ...] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labelnames
+        self.kind = kind
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[str]:
+        value = self.fn()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in value.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {float(v)}"
+
+
+def _render(families: Iterable[Tuple[str, str, str, Iterable[str]]]) -> str:
+    lines = []
+    for name, help, kind, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format (all workers' with METRICS_DIR)."""
+    if METRICS_DIR:
+        write_snapshot()
+        return _render_all(METRICS_DIR)
+    return _render((m.name, m.help, m.kind, m.samples()) for m in REGISTRY)
+
+
+# ---------------- across worker processes ----------------
+
+def write_snapshot(directory: Optional[str] = METRICS_DIR) -> None:
+    """Write this process's samples to `<directory>/<pid>.json` (atomically)."""
+    if not directory:
+        return
+    families = [[m.name, m.help, m.kind, [line.rsplit(" ", 1) for line in m.samples()]] for m in REGISTRY]
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(families, f)
+    os.replace(path + ".tmp", path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _with_pid(series: str, pid: int) -> str:
+    name, brace, labels = series.partition("{")
+    return f'{name}{{pid="{pid}",{labels}' if brace else f'{name}{{pid="{pid}"}}'
+
+
+def _render_all(directory: str) -> str:
+    merged: "OrderedDict[str, Tuple[str, str, OrderedDict[str, float]]]" = OrderedDict()
+    for entry in sorted(os.listdir(directory)):
+        if not entry.endswith(".json"):
+            continue
+        pid = int(entry[:-len(".json")])
+        try:
+            with open(os.path.join(directory, entry)) as f:
+                families = json.load(f)
+        except (OSError, ValueError):
+            continue  # replaced while being read; the next scrape gets it
+        live = _alive(pid)
+        for name, help, kind, samples in families:
+            values = merged.setdefault(name, (help, kind, OrderedDict()))[2]
+            if kind == "gauge":
+                if live:
+                    for series, value in samples:
+                        values[_with_pid(series, pid)] = float(value)
+                continue
+            for series, value in samples:
+                values[series] = values.get(series, 0.0) + float(value)
+    return _render((name, help, kind, (f"{series} {value}" for series, value in values.items()))
+                   for name, (help, kind, values) in merged.items())
+
+
+class Snapshots:
+    """Background task writing this process's snapshot every METRICS_SNAPSHOT_SECONDS."""
+    def __init__(self, interval: float = METRICS_SNAPSHOT_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if METRICS_DIR and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            write_snapshot()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        write_snapshot()  # the final counts stay in the totals after this worker exits
+
+
+snapshots = Snapshots()
+
+
+# ---------------- hot-path spans ----------------
+
+STAGE_SECONDS = Histogram("agent_stage_seconds", "Time spent in each stage of a request", ("stage",))
+STAGE_ERRORS = Counter("agent_stage_errors_total", "Exceptions raised inside a stage", ("stage",))
+LLM_ERRORS = Counter("agent_llm_errors_total", "Failed llama.cpp completions", ("kind",))
+# as reported by llama.cpp: `evaluated` prompt tokens had to be processed, `cached` came from the slot's KV cache
+LLM_PROMPT_TOKENS = Histogram("agent_llm_prompt_tokens", "Prompt tokens per completion", ("source",),
+                              buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+LLM_PROMPT_SECONDS = Histogram("agent_llm_prompt_seconds", "llama.cpp prompt processing time per completion")
+LLM_FIRST_TOKEN_SECONDS = Histogram("agent_llm_first_token_seconds", "Time to the first streamed chunk")
+
+
+class span:
+    """`with span("pick"): ...` records the block's duration (and exceptions) under that stage."""
+    __slots__ = ("stage", "_t0")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "span":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        STAGE_SECONDS.observe(time.perf_counter() - self._t0, self.stage)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            STAGE_ERRORS.inc(self.stage)
+
+
+def sampled() -> bool:
+    """True for an AGENT_TRACE_SAMPLE_RATE fraction of calls; a single comparison when disabled."""
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+# ---------------- HTTP ----------------
+
+HTTP_REQUESTS = Counter("agent_http_requests_total", "HTTP requests by route and status", ("route", "status"))
+HTTP_SECONDS = Histogram("agent_http_request_seconds", "HTTP request latency by route", ("route",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template (not per raw path)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - t0, route)
+            HTTP_REQUESTS.inc(route, status[0])
+
+
+# ---------------- wire protocol ----------------
+
+WIRE_REQUESTS = Counter("agent_wire_requests_total", "Wire protocol calls by method and status", ("method", "status"))
+WIRE_SECONDS = Histogram("agent_wire_request_seconds", "Wire protocol call latency by method", ("method",))
+
+# ---------------- Mongo pool ----------------
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections of the driver's pools (pass via event_listeners)."""
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+mongo_pool_listener = MongoPoolListener()
+Callback("agent_mongo_pool_connections", "Mongo driver connections by state",
+         lambda: {("open",): mongo_pool_listener.open, ("checked_out",): mongo_pool_listener.checked_out},
+         ("state",))
+Callback("agent_mongo_pool_checkout_failures_total", "Failed Mongo connection checkouts",
+         lambda: mongo_pool_listener.checkout_failures, kind="counter")
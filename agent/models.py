@@ -19,6 +19,7 @@ class AnswerEvent(BaseModel):
     sessionId: str
     questionId: str
     topic: str
+    subTopic: Optional[str] = None
     difficulty: int
     wasCorrect: bool
     timeTaken: float  # seconds
@@ -31,6 +32,14 @@ class SuggestResponse(BaseModel):
     strategyTip: str
     message: str
     reflectionPrompt: Optional[str]
+    decisionId: Optional[str] = None  # set when the LLM message is streamed separately
+
+class SuggestBatchRequest(BaseModel):
+    # any number of sessions; answers of one session in the order they were given
+    events: List[AnswerEvent]
+
+class SuggestBatchResponse(BaseModel):
+    suggestions: List[SuggestResponse]  # one per event, in request order
 
 class EndSessionRequest(BaseModel):
     sessionId: str
@@ -43,9 +52,19 @@ class SessionSummary(BaseModel):
     overallAccuracy: float
     recommendations: List[str]
 
-# -------------- In-memory store (demo only) ----------
-# session_store[sessionId] = { startedAt, topicOrder, events: [AnswerEvent...], stats... }
-session_store: Dict[str, Dict[str, Any]] = {}
+class SessionAnalyticsRequest(BaseModel):
+    sessionIds: List[str] = []
+    userIds: List[str] = []
+
+class SessionAnalyticsResponse(BaseModel):
+    # sessionId -> topic -> stats
+    sessions: Dict[str, Dict[str, Dict[str, Any]]]
+    overallAccuracy: Dict[str, float]
+
+class UserRollupResponse(BaseModel):
+    userId: str
+    # one entry per (topic, subtopic, difficulty): the key plus its stats
+    rollups: List[Dict[str, Any]]
 
 # A small mapping of strategy tips per topic. Extend / move to DB.
 STRATEGY_TIPS = {
@@ -0,0 +1,91 @@
+# policy.py
+# The adaptive selection policy as pure functions: next difficulty, candidate tiers and
+# the weighted pick inputs. Shared by the live suggest path (api.py) and the offline replay (replay.py).
+import random
+from typing import Optional, List, Dict, Any, Iterable
+
+from sampling import PickContext
+
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+PROMOTE_MASTERY = 0.8
+TARGET_P_CORRECT = 0.7            # chance of a correct answer the next item should have
+REMEDIAL_TARGET_P_CORRECT = 0.8   # easier items after a miss
+
+
+def next_difficulty(difficulty: int, was_correct: bool, time_taken: float,
+                    estimated: Optional[float], mastery: float) -> int:
+    """
+    Step up after a quick correct answer at high mastery, step down after a miss
+    or a slow answer, otherwise stay. Without an estimate only correctness counts.
+    """
+    quick = estimated is None or time_taken <= estimated * 0.9
+    slow = estimated is not None and time_taken > estimated * 1.5
+    if mastery >= PROMOTE_MASTERY and was_correct and quick:
+        step = 1
+    elif not was_correct or slow:
+        step = -1
+    else:
+        step = 0
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, difficulty + step))
+
+
+def candidate_tiers(was_correct: bool, difficulty: int, next_diff: int,
+                    subtopic: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Candidate tiers, tried in order: after a miss, the same subtopic at the same or
+    one easier level; otherwise the next difficulty. Both fall back to any question.
+    """
+    if not was_correct:
+        return [
+            {"difficulty": difficulty, "subtopic": subtopic},
+            {"difficulty": difficulty - 1, "subtopic": subtopic},
+            {},
+        ]
+    return [{"difficulty": next_diff}, {}]
+
+
+def pick_context(was_correct: bool, answered_skills: Iterable[str], remaining_seconds: Optional[float],
+                 now: Optional[float] = None, theta: Optional[float] = None) -> PickContext:
+    """
+    Acceptance inputs for the sampler: after a correct answer, items that only repeat
+    the skills just practiced are drawn less often; after a miss, easier items are preferred.
+    `theta` is the user's IRT ability, when known.
+    """
+    if was_correct:
+        return PickContext(remaining_seconds, answered_skills, TARGET_P_CORRECT, now, theta)
+    return PickContext(remaining_seconds, (), REMEDIAL_TARGET_P_CORRECT, now, theta)
+
+
+# helper: pick from candidates with weighting (prefer unattempted + estimatedTime fit)
+def pick_question_from_candidates(candidates, remaining_seconds=None, rng=random):
+    """
+    Pick a question from the candidates based on a weighted random choice.
+    Used when the question index isn't loaded (see sampling.py otherwise).
+    Pass a seeded `random.Random` as `rng` for reproducible picks.
+    """
+    if not candidates:
+        return None
+    weights = []
+    for c in candidates:
+        # prefer shorter estimatedTime if low remaining_seconds
+        est = c.get("estimatedTime",30)
+        w = 1.0
+        if remaining_seconds and est > remaining_seconds/6:
+            w *= 0.5
+        # slightly prefer ones with no hints? (example)
+        if not c.get("hints"):
+            w *= 1.1
+        weights.append(w)
+    idx = rng.choices(range(len(candidates)), weights=weights, k=1)[0]
+    return candidates[idx]["_id"]
+
+# Decide next difficulty (basic rules)
+def decide_next_difficulty(current: int, was_correct: bool, timeTaken: float, estimated: Optional[float]) -> int:
+    if was_correct and (estimated is None or timeTaken <= max(estimated * 0.9, 1.0)):
+        # quick and correct: bump difficulty by 1 (cap at 5)
+        return min(current + 1, 5)
+    if not was_correct or (estimated and timeTaken > (estimated * 1.5)):
+        # struggle: reduce difficulty (min 1)
+        return max(current - 1, 1)
+    return current
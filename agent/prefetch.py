@@ -0,0 +1,282 @@
+# prefetch.py
+# Speculative planning of the next suggestion while the student works on a question.
+# When a question is served, the planner runs the policy for the likely answers to it
+# (correct and fast, on time or slow; incorrect): the mastery each would lead to, the next
+# difficulty, the next question and its strategy tip, and optionally the LLM message.
+# Branches are keyed by (correct, next difficulty), which is what the pick depends on
+# (besides the session's remaining time, planned with each branch's answer time).
+# The plan sits in a per-session slot with a short TTL. When the AnswerEvent arrives the
+# matching branch is confirmed by recomputing mastery and next difficulty from the real
+# answer (no I/O), and the Postgres write runs behind the response. A write that still
+# fails after its retries is kept and replayed before the session's next answer (which
+# then takes the synchronous path), at /session/end, or at shutdown. That ordering holds
+# within one process only: with several workers, route a session's answers to one worker
+# or leave PREFETCH_ENABLED off (main.py --prod does).
+import os
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Tuple, Set, Any
+
+from mastery_store import MasteryState, normalized_time
+from policy import next_difficulty, candidate_tiers, pick_context
+from prompts import feedback_prompt
+from llm_cache import timing_class
+from irt import item_calibration
+from question_index import question_index
+from sampling import question_sampler
+from llm_instance import llm_service
+from helper import answer_time, fetch_suggest_context, get_llm_response, strategy_tip_of
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_MESSAGES = os.getenv("PREFETCH_MESSAGES", "0") == "1"  # also generate each branch's LLM message
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", 300))
+PREFETCH_MAX_SESSIONS = int(os.getenv("PREFETCH_MAX_SESSIONS", 100000))
+PERSIST_ATTEMPTS = 3
+SESSION_SECONDS = 3600
+
+# answer times planned for, as multiples of the question's estimatedTime (see policy.next_difficulty)
+TIMING_FACTORS = {"fast": 0.7, "on-time": 1.2, "slow": 2.0}
+
+
+class Branch:
+    """The suggestion for one (correct, next difficulty) outcome."""
+    __slots__ = ("correct", "next_diff", "record", "strategy_tip", "timing", "mastery", "cache_key", "message")
+
+    def __init__(self, correct: bool, next_diff: int, record, strategy_tip: Optional[str],
+                 timing: str, mastery: float):
+        self.correct = correct
+        self.next_diff = next_diff
+        self.record = record            # QuestionRecord or None
+        self.strategy_tip = strategy_tip
+        self.timing = timing            # timing class and mastery of the planned answer, for the message
+        self.mastery = mastery
+        self.cache_key: Optional[str] = None  # the message's bucket; it fits an answer with the same key
+        self.message: Optional[str] = None
+
+
+class Plan:
+    """Branches for the answer to one served question."""
+    __slots__ = ("question", "state", "theta", "version", "branches", "expires")
+
+    def __init__(self, question, state: MasteryState, theta: Optional[float], version: int, expires: float):
+        self.question = question        # the served QuestionRecord
+        self.state = state              # the user's mastery state for its topic, before the answer
+        self.theta = theta
+        self.version = version          # question index version the picks were made against
+        self.branches: Dict[Tuple[bool, int], Branch] = {}
+        self.expires = expires
+
+
+class _Excluding:
+    """An exclusion set plus the question being answered (it isn't in the set until its row is read)."""
+    __slots__ = ("exclude", "ordinal")
+
+    def __init__(self, exclude, ordinal: int):
+        self.exclude = exclude
+        self.ordinal = ordinal
+
+    def __contains__(self, ordinal: int) -> bool:
+        return ordinal == self.ordinal or ordinal in self.exclude
+
+
+class SpeculativePlanner:
+    """Per-session plans, LRU-bounded and expired after PREFETCH_TTL_SECONDS."""
+    def __init__(self, index, sampler, llm=None, ttl: float = PREFETCH_TTL_SECONDS,
+                 max_sessions: int = PREFETCH_MAX_SESSIONS, messages: bool = PREFETCH_MESSAGES):
+        self.index = index
+        self.sampler = sampler
+        self.llm = llm
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.messages = messages
+        self._plans: "OrderedDict[str, Plan]" = OrderedDict()
+        self._writes: Dict[str, asyncio.Task] = {}  # latest pending write per session
+        self._pending: Set[asyncio.Task] = set()
+        self._failed: Dict[str, Tuple[Any, Any]] = {}  # session -> (event, exclude) of a lost write
+        self.planned = 0
+        self.hits = 0
+        self.misses = 0
+        self.cold = 0
+        self.drift = 0
+        self.persist_failed = 0
+        self.replayed = 0
+
+    # ---------------- planning ----------------
+
+    def schedule(self, session_id: str, question, row, theta: Optional[float], exclude) -> None:
+        """
+        Plan the answer to `question`, just served in the session. `row` is the suggest
+        context row the question was picked with (session start time, mastery state).
+        """
+        state = MasteryState.from_row(row) if row["total"] is not None else MasteryState()
+        plan = Plan(question, state, theta, self.index.version, time.monotonic() + self.ttl)
+        self._plan(plan, exclude, row["startTime"])
+        self._plans.pop(session_id, None)
+        self._plans[session_id] = plan
+        while len(self._plans) > self.max_sessions or next(iter(self._plans.values())).expires <= time.monotonic():
+            self._plans.popitem(last=False)
+        self.planned += 1
+        if self.messages and plan.branches:
+            asyncio.create_task(self._generate_messages(plan))
+
+    def _plan(self, plan: Plan, exclude, start_time: Optional[datetime]) -> None:
+        q = plan.question
+        est = q.estimatedTime or None
+        difficulty = q.difficulty or 1
+        expected = item_calibration.expected_seconds(q.key, est)  # as helper.answer_time normalizes
+        typical = est or expected or 30.0
+        outcomes = [(True, est * f) for f in TIMING_FACTORS.values()] if est else [(True, typical)]
+        outcomes.append((False, typical))
+        excluding = _Excluding(exclude, q.ordinal)
+        for correct, seconds in outcomes:
+            state = copy.copy(plan.state)
+            state.apply(correct, normalized_time(seconds, expected), q.key)
+            mastery = state.mastery()
+            next_diff = next_difficulty(difficulty, correct, seconds, est, mastery)
+            if (correct, next_diff) in plan.branches:
+                continue
+            tiers = candidate_tiers(correct, difficulty, next_diff, q.subtopic)
+            remaining = None
+            if start_time is not None:
+                elapsed = (datetime.utcnow() - start_time).total_seconds() + seconds
+                remaining = max(0, SESSION_SECONDS - int(elapsed))
+            ctx = pick_context(correct, q.mentalSkill, remaining, theta=plan.theta)
+            rec = self.sampler.pick(q.topic, tiers, excluding, ctx, commit=False)
+            plan.branches[(correct, next_diff)] = Branch(
+                correct, next_diff, rec, strategy_tip_of(rec.as_doc() if rec else None),
+                timing_class(seconds, est), mastery)
+
+    async def _generate_messages(self, plan: Plan) -> None:
+        """Generate each branch's LLM message while llama.cpp has spare capacity."""
+        for branch in plan.branches.values():
+            if self.llm is None or self.llm.saturated:
+                return
+            cache_key, prompt = feedback_prompt(plan.question.topic, branch.correct, branch.mastery,
+                                                branch.timing, branch.next_diff, branch.strategy_tip)
+            message = await get_llm_response(prompt, cache_key=cache_key)
+            if message:
+                branch.cache_key, branch.message = cache_key, message.strip()
+
+    # ---------------- the answer arrives ----------------
+
+    def take(self, session_id: str) -> Optional[Plan]:
+        """Remove and return the session's plan (None if there is none or it expired)."""
+        plan = self._plans.pop(session_id, None)
+        if plan is None or plan.expires <= time.monotonic() or plan.version != self.index.version:
+            self.cold += 1
+            return None
+        return plan
+
+    def confirm(self, plan: Plan, event, exclude) -> Optional[Tuple[Branch, float]]:
+        """
+        The branch matching the real answer and the mastery it leads to, or None (a miss).
+        Recomputes what the pick depends on; doesn't touch Postgres.
+        """
+        q = plan.question
+        if event.questionId != q.key or event.topic != q.topic or event.difficulty != (q.difficulty or 1):
+            self.misses += 1
+            return None
+        state = copy.copy(plan.state)
+        state.apply(event.wasCorrect, answer_time(event), event.questionId)
+        mastery = state.mastery()
+        next_diff = next_difficulty(event.difficulty, event.wasCorrect, event.timeTaken, event.estimatedTime, mastery)
+        branch = plan.branches.get((event.wasCorrect, next_diff))
+        if branch is None or (branch.record is not None and branch.record.ordinal in exclude):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return branch, mastery
+
+    # ---------------- writes behind the response ----------------
+
+    async def settle(self, session_id: str) -> None:
+        """
+        Wait for the session's pending write, so answers are recorded in order; if it failed,
+        record it now (raises, keeping it for later, if Postgres still fails).
+        """
+        task = self._writes.get(session_id)
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+        failed = self._failed.pop(session_id, None)
+        if failed is not None:
+            try:
+                await fetch_suggest_context(*failed)
+            except Exception:
+                self._failed.setdefault(session_id, failed)
+                raise
+            self.replayed += 1
+
+    def persist(self, event, exclude, mastery: float, served=None) -> None:
+        """Record a confirmed answer in the background, then plan the answer to `served`."""
+        task = self._writes[event.sessionId] = asyncio.create_task(self._persist(event, exclude, mastery, served))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _persist(self, event, exclude, mastery: float, served) -> None:
+        try:
+            for attempt in range(PERSIST_ATTEMPTS):
+                try:
+                    row, _, stored, theta = await fetch_suggest_context(event, exclude)
+                    break
+                except Exception as e:
+                    if attempt + 1 == PERSIST_ATTEMPTS:
+                        # no plan for the next answer, so it takes the synchronous path after the replay
+                        self.persist_failed += 1
+                        self._failed[event.sessionId] = (event, exclude)
+                        logger.error(f"Speculative answer write failed for {event.sessionId}, "
+                                     f"kept for replay: {e!r}")
+                        return
+                    await asyncio.sleep(0.05 * 2 ** attempt)
+            if row is None:
+                return
+            if abs(stored - mastery) > 1e-6:
+                self.drift += 1  # e.g. another device answered for the same user
+            if served is not None and self._writes.get(event.sessionId) is asyncio.current_task():
+                self.schedule(event.sessionId, served, row, theta, exclude)  # unless dropped meanwhile
+        finally:
+            if self._writes.get(event.sessionId) is asyncio.current_task():
+                del self._writes[event.sessionId]
+
+    async def stop(self) -> None:
+        """Finish the pending writes and replay the failed ones (on shutdown)."""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        for session_id in list(self._failed):
+            try:
+                await self.settle(session_id)
+            except Exception as e:
+                logger.error(f"Speculative answer write for {session_id} lost on shutdown: {e!r}")
+
+    def drop(self, session_id: str) -> None:
+        """
+        Forget the session (it ended); a pending write still completes but plans nothing.
+        A failed write stays for stop() to replay (settle first to replay it now).
+        """
+        self._plans.pop(session_id, None)
+        self._writes.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._plans),
+            "planned": self.planned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cold": self.cold,
+            "drift": self.drift,
+            "persist_failed": self.persist_failed,
+            "replayed": self.replayed,
+            "unreplayed": len(self._failed),
+        }
+
+
+speculation = SpeculativePlanner(question_index, question_sampler, llm_service)
@@ -0,0 +1,136 @@
+# prompts.py
+# Prompt templates for every LLM message type.
+# A prompt is the tutor prefix shared by all types, then the type's fixed instruction,
+# then the variable fields in compact `key=value` form, last. llama.cpp's `cache_prompt`
+# keeps the KV cache of a slot's previous prompt, so only the differing tail is evaluated.
+# Each type also carries its own n_predict, stop sequences and temperature.
+import os
+from typing import Optional, List, Dict, Any, Tuple
+
+from llm_cache import bucket_key, mastery_band
+
+PROMPT_MAX_TOKENS = int(os.getenv("LLM_PROMPT_MAX_TOKENS", 320))
+CHARS_PER_TOKEN = 4  # rough estimate for English text with llama tokenizers
+
+# Never interpolate anything into this: its bytes must not change between requests
+SYSTEM_PREFIX = """You are a warm, supportive math tutor in a mental-math app. Reply to the student in plain text \
+(no lists, markdown, emojis or greetings) and never invent numbers not given below.
+"""
+
+STOP = ["###", "\n\n", "</s>"]
+
+
+class Template:
+    """One message type: its instruction, the fields it takes (in order) and generation settings."""
+    __slots__ = ("kind", "instruction", "fields", "n_predict", "stop", "temperature")
+
+    def __init__(self, kind: str, instruction: str, fields: Tuple[str, ...], n_predict: int,
+                 stop: List[str] = STOP, temperature: float = 0.7):
+        self.kind = kind
+        self.instruction = instruction
+        self.fields = fields
+        self.n_predict = n_predict
+        self.stop = stop
+        self.temperature = temperature
+
+
+class Prompt:
+    """A compiled prompt: the text and the llama.cpp parameters that go with it."""
+    __slots__ = ("kind", "text", "params")
+
+    def __init__(self, kind: str, text: str, params: Dict[str, Any]):
+        self.kind = kind
+        self.text = text
+        self.params = params
+
+    @property
+    def estimated_tokens(self) -> int:
+        return len(self.text) // CHARS_PER_TOKEN
+
+    def __str__(self) -> str:
+        return self.text
+
+
+# n_predict: about 30 tokens per short sentence, plus headroom for the stop sequence
+TEMPLATES: Dict[str, Template] = {t.kind: t for t in (
+    Template("correct",
+             "Correct answer. Praise it in at most 2 short sentences.",
+             ("topic", "speed", "mastery", "next_difficulty"), n_predict=64),
+    Template("incorrect",
+             "Wrong answer. Reassure them in at most 2 short sentences, using the tip.",
+             ("topic", "mastery", "tip"), n_predict=72),
+    Template("summary",
+             "Session over. In one short paragraph, sum it up and give 2 actionable recommendations.",
+             ("accuracy", "topics"), n_predict=128),
+    # pre-generated messages (message_pool.py): generic enough to fit any student in the bucket
+    Template("pool_correct",
+             "Correct answer. Praise it in at most 2 short sentences, without numbers.",
+             ("topic", "difficulty"), n_predict=64, temperature=0.9),
+    Template("pool_incorrect",
+             "Wrong answer. Reassure them in at most 2 short sentences, without tips or numbers.",
+             ("topic", "difficulty"), n_predict=64, temperature=0.9),
+    Template("pool_summary",
+             "Session over. Write a friendly closing message in at most 2 short sentences, without numbers.",
+             ("accuracy",), n_predict=64, temperature=0.9),
+)}
+
+
+def _fit(values: List[str], budget_chars: int) -> List[str]:
+    """Halve the longest value until the fields fit the budget (or can't shrink further)."""
+    values = list(values)
+    while sum(map(len, values)) > budget_chars:
+        i = max(range(len(values)), key=lambda j: len(values[j]))
+        if len(values[i]) <= 16:
+            break
+        values[i] = values[i][:len(values[i]) // 2].rstrip() + "…"
+    return values
+
+
+def compile_prompt(kind: str, max_tokens: int = PROMPT_MAX_TOKENS, **fields: Any) -> Prompt:
+    """
+    Build the prompt for a message type. Fields missing or None are left out; values are
+    shortened, longest first, when the prompt would exceed `max_tokens` (estimated).
+    """
+    t = TEMPLATES[kind]
+    head = f"{SYSTEM_PREFIX}### Task\n{t.instruction}\n### Student\n"
+    names = [n for n in t.fields if fields.get(n) is not None]
+    overhead = len(head) + len("\n### Tutor\n") + sum(len(n) + 3 for n in names)
+    values = _fit([str(fields[n]) for n in names], max_tokens * CHARS_PER_TOKEN - overhead)
+    body = "; ".join(f"{n}={v}" for n, v in zip(names, values))
+    return Prompt(kind, f"{head}{body}\n### Tutor\n", {
+        "n_predict": t.n_predict,
+        "stop": t.stop,
+        "temperature": t.temperature,
+        "cache_prompt": True,
+    })
+
+
+def feedback_prompt(topic: str, was_correct: bool, mastery: float, timing: str, next_diff: int,
+                    strategy_tip: Optional[str]) -> Tuple[str, Prompt]:
+    """
+    Cache key and prompt for the message after an answer. Both are built from bucketed
+    fields, so one cached generation fits every student in the bucket.
+    """
+    band = mastery_band(mastery)
+    if was_correct:
+        cache_key = bucket_key("correct", topic=topic, band=band, timing=timing, next_diff=next_diff)
+        return cache_key, compile_prompt("correct", topic=topic, speed=timing if timing != "unknown" else None,
+                                         mastery=f"{band}%", next_difficulty=f"{next_diff}/5")
+    cache_key = bucket_key("incorrect", topic=topic, band=band, tip=strategy_tip)
+    return cache_key, compile_prompt("incorrect", topic=topic, mastery=f"{band}%", tip=strategy_tip)
+
+
+def topic_digest(per_topic: Dict[str, Dict[str, Any]]) -> str:
+    """Per-topic session stats in compact form: `addition 8/10 12s, fractions 3/6 25s`."""
+    return ", ".join(
+        f"{topic} {s['correct']}/{s['count']} {round(s['avg_time'])}s" for topic, s in per_topic.items())
+
+
+def summary_prompt(overall_accuracy: float, per_topic: Dict[str, Dict[str, Any]]) -> Tuple[str, Prompt]:
+    """
+    Cache key and prompt for the end-of-session summary. The summary quotes the session's
+    own numbers, so the key holds the exact fields: only an identical session shares it.
+    """
+    accuracy, topics = f"{round(overall_accuracy)}%", topic_digest(per_topic)
+    return bucket_key("summary", accuracy=accuracy, topics=topics), \
+        compile_prompt("summary", accuracy=accuracy, topics=topics)
@@ -0,0 +1,257 @@
+# question_index.py
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError, OperationFailure
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("QUESTION_INDEX_POLL_SECONDS", 30))
+
+# Only the fields the agent needs to select and describe a question
+INDEX_PROJECTION = {
+    "_id": 1,
+    "topic": 1,
+    "subtopic": 1,
+    "difficulty": 1,
+    "mentalSkill": 1,
+    "estimatedTime": 1,
+    "hints": 1,
+    "strategyTip": 1,
+    "updatedAt": 1,
+}
+
+
+class QuestionRecord:
+    """Compact in-memory view of a Mongo question document."""
+    __slots__ = (
+        "id", "key", "ordinal", "topic", "subtopic", "difficulty", "mentalSkill",
+        "estimatedTime", "hints", "strategyTip", "updatedAt",
+    )
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.id: ObjectId = doc["_id"]
+        self.key: str = str(doc["_id"])
+        self.ordinal: int = -1  # dense id, assigned by the index
+        self.topic: str = doc.get("topic")
+        self.subtopic: Optional[str] = doc.get("subtopic")
+        self.difficulty: Optional[int] = doc.get("difficulty")
+        self.mentalSkill: Tuple[str, ...] = tuple(doc.get("mentalSkill") or ())
+        self.estimatedTime: float = doc.get("estimatedTime", 30)
+        self.hints: Tuple[str, ...] = tuple(doc.get("hints") or ())
+        self.strategyTip: Optional[str] = doc.get("strategyTip")
+        self.updatedAt: Optional[datetime] = doc.get("updatedAt")
+
+    def as_candidate(self) -> Dict[str, Any]:
+        """Shape the record like the projected docs `fetch_candidate_questions` returns."""
+        return {
+            "_id": self.id,
+            "estimatedTime": self.estimatedTime,
+            "hints": list(self.hints),
+            "strategyTip": self.strategyTip,
+        }
+
+    def as_doc(self) -> Dict[str, Any]:
+        """Shape the record like a (projected) `find_one` result."""
+        return {
+            "_id": self.id,
+            "topic": self.topic,
+            "subtopic": self.subtopic,
+            "difficulty": self.difficulty,
+            "mentalSkill": list(self.mentalSkill),
+            "estimatedTime": self.estimatedTime,
+            "hints": list(self.hints),
+            "strategyTip": self.strategyTip,
+        }
+
+
+class QuestionIndex:
+    """
+    In-process index of the question bank.
+    Questions are bucketed by (topic, difficulty), (topic, subtopic) and (topic, mentalSkill)
+    so candidate selection never has to go to Mongo. Every question id also gets a dense
+    ordinal that stays fixed for the life of the process (see exclusion.py).
+    """
+    def __init__(self):
+        self.by_id: Dict[str, QuestionRecord] = {}
+        self._ordinals: Dict[str, int] = {}
+        self._by_topic: Dict[str, Dict[str, QuestionRecord]] = {}
+        self._by_difficulty: Dict[Tuple[str, int], Dict[str, QuestionRecord]] = {}
+        self._by_subtopic: Dict[Tuple[str, str], Dict[str, QuestionRecord]] = {}
+        self._by_skill: Dict[Tuple[str, str], Dict[str, QuestionRecord]] = {}
+        self.loaded = False
+        self.version = 0  # bumped on every change, so derived caches know to rebuild
+        self.last_updated: Optional[datetime] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    # ---------------- maintenance ----------------
+
+    def _buckets(self, rec: QuestionRecord) -> Iterable[Dict[str, QuestionRecord]]:
+        yield self._by_topic.setdefault(rec.topic, {})
+        yield self._by_difficulty.setdefault((rec.topic, rec.difficulty), {})
+        if rec.subtopic:
+            yield self._by_subtopic.setdefault((rec.topic, rec.subtopic), {})
+        for skill in rec.mentalSkill:
+            yield self._by_skill.setdefault((rec.topic, skill), {})
+
+    def upsert(self, doc: Dict[str, Any]) -> QuestionRecord:
+        """Insert or replace a question from its Mongo document."""
+        rec = QuestionRecord(doc)
+        rec.ordinal = self._ordinals.setdefault(rec.key, len(self._ordinals))
+        self.remove(rec.key)
+        self.by_id[rec.key] = rec
+        for bucket in self._buckets(rec):
+            bucket[rec.key] = rec
+        self.version += 1
+        if rec.updatedAt and (self.last_updated is None or rec.updatedAt > self.last_updated):
+            self.last_updated = rec.updatedAt
+        return rec
+
+    def remove(self, question_id: Any) -> None:
+        """Drop a question from every bucket it belongs to."""
+        rec = self.by_id.pop(str(question_id), None)
+        if rec is None:
+            return
+        for bucket in self._buckets(rec):
+            bucket.pop(rec.key, None)
+        self.version += 1
+
+    async def load(self, coll) -> None:
+        """Load the whole question bank from Mongo (startup)."""
+        fresh = QuestionIndex()
+        fresh._ordinals = self._ordinals  # keep ordinals stable across reloads
+        async for doc in coll.find({}, INDEX_PROJECTION):
+            fresh.upsert(doc)
+        # swap in one go so readers never see a half-built index
+        self.by_id = fresh.by_id
+        self._by_topic = fresh._by_topic
+        self._by_difficulty = fresh._by_difficulty
+        self._by_subtopic = fresh._by_subtopic
+        self._by_skill = fresh._by_skill
+        self.last_updated = fresh.last_updated
+        self.version += 1
+        self.loaded = True
+        logger.info(f"Question index loaded: {len(self.by_id)} questions")
+
+    # ---------------- lookups ----------------
+
+    def get(self, question_id: Any) -> Optional[QuestionRecord]:
+        """Look up a question by id (str or ObjectId)."""
+        return self.by_id.get(str(question_id))
+
+    def ordinal(self, question_id: Any) -> Optional[int]:
+        """Dense ordinal of a question id, if the index has ever seen it."""
+        return self._ordinals.get(str(question_id))
+
+    def records(self, topic: str, difficulty: Optional[int] = None,
+                subtopic: Optional[str] = None) -> List[QuestionRecord]:
+        """Every question in a topic, optionally narrowed to a difficulty and/or subtopic."""
+        buckets = [self._by_topic.get(topic, {})]
+        if difficulty is not None:
+            buckets.append(self._by_difficulty.get((topic, difficulty), {}))
+        if subtopic:
+            buckets.append(self._by_subtopic.get((topic, subtopic), {}))
+        buckets.sort(key=len)
+        smallest, others = buckets[0], buckets[1:]
+        return [rec for key, rec in smallest.items() if all(key in b for b in others)]
+
+    def candidates(
+        self,
+        topic: str,
+        difficulty: Optional[int] = None,
+        exclude_ids=None,
+        subtopic: Optional[str] = None,
+        mental_skill: Optional[str] = None,
+        limit: int = 50,
+        exclude=None,
+    ) -> List[Dict[str, Any]]:
+        """
+        In-memory equivalent of `fetch_candidate_questions`.
+        Starts from the narrowest bucket and filters the remaining conditions.
+        `exclude` is an ExclusionSet of ordinals, checked in constant time per question.
+        """
+        buckets = [self._by_topic.get(topic, {})]
+        if difficulty is not None:
+            buckets.append(self._by_difficulty.get((topic, difficulty), {}))
+        if subtopic:
+            buckets.append(self._by_subtopic.get((topic, subtopic), {}))
+        if mental_skill:
+            buckets.append(self._by_skill.get((topic, mental_skill), {}))
+        buckets.sort(key=len)
+        smallest, others = buckets[0], buckets[1:]
+
+        excluded = {str(e) for e in exclude_ids} if exclude_ids else ()
+        res = []
+        for key, rec in smallest.items():
+            if key in excluded or (exclude is not None and rec.ordinal in exclude) \
+                    or any(key not in b for b in others):
+                continue
+            res.append(rec.as_candidate())
+            if len(res) >= limit:
+                break
+        return res
+
+    # ---------------- incremental refresh ----------------
+
+    def start_refresh(self, coll) -> None:
+        """Start the background task that keeps the index in sync with Mongo."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(coll))
+
+    async def stop_refresh(self) -> None:
+        """Cancel the background refresh task."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self, coll) -> None:
+        try:
+            await self._watch(coll)
+        except OperationFailure as e:
+            # change streams need a replica set; standalone servers fall back to polling
+            logger.info(f"Question change stream unavailable ({e}); polling updatedAt every {POLL_SECONDS}s")
+        except PyMongoError as e:
+            logger.warning(f"Question change stream failed ({e}); polling updatedAt every {POLL_SECONDS}s")
+        await self._poll(coll)
+
+    async def _watch(self, coll) -> None:
+        async with coll.watch(full_document="updateLookup") as stream:
+            async for change in stream:
+                op = change.get("operationType")
+                if op in ("insert", "update", "replace") and change.get("fullDocument"):
+                    self.upsert(change["fullDocument"])
+                elif op == "delete":
+                    self.remove(change["documentKey"]["_id"])
+                elif op in ("drop", "invalidate"):
+                    await self.load(coll)
+
+    async def _poll(self, coll) -> None:
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            try:
+                if self.last_updated is None:
+                    await self.load(coll)
+                    continue
+                q = {"updatedAt": {"$gt": self.last_updated}}
+                async for doc in coll.find(q, INDEX_PROJECTION):
+                    self.upsert(doc)
+                # deletes are invisible to an updatedAt poll; reconcile ids when the count drifts
+                if await coll.estimated_document_count() != len(self.by_id):
+                    await self.load(coll)
+            except PyMongoError as e:
+                logger.warning(f"Question index poll failed: {e}")
+
+
+question_index = QuestionIndex()
@@ -0,0 +1,284 @@
+# replay.py
+# Offline replay of the adaptive selection policy (policy.py) over recorded history.
+# question_session rows, each with the agent_decision recorded for it, are streamed from
+# Postgres through a server-side cursor, cut into chunks of whole users and replayed in a
+# process pool against an in-memory copy of the question index. Replayed decisions are
+# written with COPY to agent_replay_decision, outcome metrics to agent_replay_run.
+#
+#   python replay.py --label tighter-promotion --workers 8
+#   python replay.py --dry-run          # metrics only, nothing written
+import os
+import json
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Optional, List, Dict, Tuple, Any, Iterable
+
+from question_index import QuestionIndex
+from exclusion import ExclusionSet
+from mastery_store import MasteryState, normalized_time
+from sampling import QuestionSampler
+from irt import ItemCalibration, ability_update, THETA_INFO_PRIOR
+from policy import next_difficulty, candidate_tiers, pick_context
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", os.cpu_count() or 1))
+REPLAY_CHUNK_ROWS = int(os.getenv("REPLAY_CHUNK_ROWS", 20000))
+SESSION_SECONDS = 3600
+
+# Every answer in (user, time) order, with the decision the live agent recorded for it
+REPLAY_SQL = """
+    SELECT s."userId"::text AS user_id, qs."sessionId"::text AS session_id, s."startTime" AS start_time,
+           qs."questionId" AS question_id, qs.correct, qs."timeTaken" AS time_taken, qs.timestamp,
+           d.next_question_id AS recorded_question_id, d.next_difficulty AS recorded_difficulty
+    FROM question_session qs
+    JOIN session s ON qs."sessionId" = s.id
+    LEFT JOIN LATERAL (
+        SELECT ad.next_question_id, ad.next_difficulty
+        FROM agent_decision ad
+        WHERE ad.session_id = qs."sessionId" AND ad.prev_question_id = qs."questionId"
+        ORDER BY ad.created_at
+        LIMIT 1
+    ) d ON TRUE
+    WHERE s."userId" IS NOT NULL AND qs.response <> ''
+    ORDER BY s."userId", qs.timestamp
+"""
+
+REPLAY_DDL = """
+    CREATE TABLE IF NOT EXISTS agent_replay_run (
+        run_id UUID PRIMARY KEY,
+        label TEXT,
+        seed INT NOT NULL,
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP NOT NULL,
+        events BIGINT NOT NULL,
+        metrics JSONB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS agent_replay_decision (
+        run_id UUID NOT NULL,
+        user_id TEXT NOT NULL,
+        session_id UUID NOT NULL,
+        prev_question_id VARCHAR(32) NOT NULL,
+        answered_at TIMESTAMP,
+        next_question_id VARCHAR(32),
+        next_difficulty INT NOT NULL,
+        mastery FLOAT NOT NULL,
+        reason VARCHAR(32) NOT NULL,
+        recorded_question_id VARCHAR(32),
+        recorded_difficulty INT
+    );
+    CREATE INDEX IF NOT EXISTS agent_replay_decision_run_idx ON agent_replay_decision (run_id, session_id)
+"""
+
+REPLAY_COLUMNS = (
+    "run_id", "user_id", "session_id", "prev_question_id", "answered_at", "next_question_id",
+    "next_difficulty", "mastery", "reason", "recorded_question_id", "recorded_difficulty",
+)
+
+RUN_INSERT_SQL = """
+    INSERT INTO agent_replay_run(run_id, label, seed, started_at, finished_at, events, metrics)
+    VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+"""
+
+
+# ---------------- worker side ----------------
+
+_sampler: Optional[QuestionSampler] = None
+
+
+def _init_worker(docs: List[Dict[str, Any]], item_params: List[Tuple[str, float, float, float]]) -> None:
+    """Process-pool initializer: rebuild the question index, item calibration and a sampler once per worker."""
+    global _sampler
+    index = QuestionIndex()
+    for doc in docs:
+        index.upsert(doc)
+    index.loaded = True
+    calibration = ItemCalibration(index)
+    calibration.load_rows(item_params)
+    _sampler = QuestionSampler(index, calibration=calibration)
+
+
+def replay_user(rows: Iterable[tuple], sampler: QuestionSampler, rng: random.Random,
+                run_id: str, metrics: Dict[str, int]) -> Iterable[Tuple[Any, ...]]:
+    """
+    Run the policy over one user's answers in time order, the way the suggest path sees them:
+    mastery folded per topic across sessions, ability across all answers, exclusions
+    accumulated per session.
+    Yields agent_replay_decision rows and counts outcomes into `metrics`.
+    """
+    index = sampler.index
+    calibration = sampler.calibration
+    theta, info, last_question_id = None, THETA_INFO_PRIOR, None
+    mastery_states: Dict[str, MasteryState] = {}
+    answered: Dict[str, ExclusionSet] = {}
+    for (user_id, session_id, start_time, question_id, correct, time_taken, answered_at,
+         recorded_qid, recorded_diff) in rows:
+        exclude = answered.get(session_id)
+        if exclude is None:
+            exclude = answered[session_id] = ExclusionSet()
+        rec = index.get(question_id)
+        if rec is None:
+            metrics["unknown_question"] = metrics.get("unknown_question", 0) + 1
+            continue
+        exclude.add(rec.ordinal)
+        time_taken = time_taken or 0.0
+        state = mastery_states.get(rec.topic)
+        if state is None:
+            state = mastery_states[rec.topic] = MasteryState()
+        state.apply(bool(correct), normalized_time(time_taken, calibration.expected_seconds(question_id)),
+                    question_id)
+        mastery = state.mastery()
+        a, b = calibration.params(question_id)
+        if a is not None and last_question_id != question_id:  # same dedupe as ABILITY_ON_CONFLICT
+            theta, info = ability_update(theta or 0.0, info, a, b, float(bool(correct)))
+            theta, info, last_question_id = float(theta), float(info), question_id
+
+        difficulty = rec.difficulty or 1
+        next_diff = next_difficulty(difficulty, correct, time_taken, rec.estimatedTime, mastery)
+        tiers = candidate_tiers(correct, difficulty, next_diff, rec.subtopic)
+        remaining_seconds = None
+        if start_time and answered_at:
+            remaining_seconds = max(0, SESSION_SECONDS - int((answered_at - start_time).total_seconds()))
+        sampler.record_answer(question_id, correct)
+        # recency runs on the recorded clock, not on how fast the replay goes
+        ctx = pick_context(correct, rec.mentalSkill, remaining_seconds,
+                           answered_at.timestamp() if answered_at else None, theta)
+        picked = sampler.pick(rec.topic, tiers, exclude, ctx, rng)
+        picked = picked.key if picked else None
+
+        metrics["events"] = metrics.get("events", 0) + 1
+        metrics["next_difficulty_sum"] = metrics.get("next_difficulty_sum", 0) + next_diff
+        if not correct:
+            metrics["remedial"] = metrics.get("remedial", 0) + 1
+        if picked is None:
+            metrics["no_candidate"] = metrics.get("no_candidate", 0) + 1
+        if next_diff != difficulty:
+            key = "difficulty_up" if next_diff > difficulty else "difficulty_down"
+            metrics[key] = metrics.get(key, 0) + 1
+        if recorded_diff is not None:
+            metrics["recorded"] = metrics.get("recorded", 0) + 1
+            if recorded_diff == next_diff:
+                metrics["difficulty_match"] = metrics.get("difficulty_match", 0) + 1
+            if recorded_qid is not None and recorded_qid == picked:
+                metrics["question_match"] = metrics.get("question_match", 0) + 1
+
+        yield (run_id, user_id, session_id, question_id, answered_at, picked, next_diff, mastery,
+               "progress" if correct else "remedial", recorded_qid, recorded_diff)
+
+
+def replay_chunk(rows: List[tuple], run_id: str, seed: int) -> Tuple[List[Tuple[Any, ...]], Dict[str, int]]:
+    """Replay a chunk of whole users (rows sorted by user, then time); runs in a pool worker."""
+    metrics: Dict[str, int] = {}
+    decisions: List[Tuple[Any, ...]] = []
+    for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+        # per-user seed; exposure and item statistics still accumulate per worker, as in a live process
+        rng = random.Random(f"{seed}:{user_id}")
+        decisions.extend(replay_user(user_rows, _sampler, rng, run_id, metrics))
+    return decisions, metrics
+
+
+# ---------------- driver ----------------
+
+def summarize_metrics(counts: Dict[str, int]) -> Dict[str, Any]:
+    """Raw counters plus the rates worth comparing between runs."""
+    events = counts.get("events", 0)
+    recorded = counts.get("recorded", 0)
+
+    def rate(n: str, total: int) -> Optional[float]:
+        return round(counts.get(n, 0) / total, 4) if total else None
+
+    return {
+        **counts,
+        "avg_next_difficulty": round(counts.get("next_difficulty_sum", 0) / events, 3) if events else None,
+        "remedial_rate": rate("remedial", events),
+        "no_candidate_rate": rate("no_candidate", events),
+        "difficulty_up_rate": rate("difficulty_up", events),
+        "difficulty_down_rate": rate("difficulty_down", events),
+        "difficulty_agreement": rate("difficulty_match", recorded),
+        "question_agreement": rate("question_match", recorded),
+    }
+
+
+async def replay(pool, question_index, seed: int = 0, label: Optional[str] = None,
+                 workers: int = REPLAY_WORKERS, chunk_rows: int = REPLAY_CHUNK_ROWS,
+                 write: bool = True, item_calibration: Optional[ItemCalibration] = None) -> Dict[str, Any]:
+    """
+    Replay the whole history. At most 2 x `workers` chunks are in flight, so memory stays
+    bounded by the chunk size however many events there are.
+    """
+    run_id = str(uuid.uuid4())
+    started_at = datetime.utcnow()
+    docs = [rec.as_doc() for rec in question_index.by_id.values()]
+    item_params = item_calibration.loaded_rows if item_calibration is not None else []
+    loop = asyncio.get_running_loop()
+    counts: Dict[str, int] = {}
+    pending: "deque[asyncio.Future]" = deque()
+    max_in_flight = 2 * workers
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(docs, item_params)) as executor:
+        async with pool.acquire() as read_conn, pool.acquire() as write_conn:
+            if write:
+                await write_conn.execute(REPLAY_DDL)
+
+            async def collect() -> None:
+                decisions, metrics = await pending.popleft()
+                for k, v in metrics.items():
+                    counts[k] = counts.get(k, 0) + v
+                if write and decisions:
+                    await write_conn.copy_records_to_table(
+                        "agent_replay_decision", records=decisions, columns=REPLAY_COLUMNS)
+
+            async with read_conn.transaction():
+                chunk: List[tuple] = []
+                async for r in read_conn.cursor(REPLAY_SQL, prefetch=min(chunk_rows, 5000)):
+                    # only cut between users so each user's history is replayed in one place
+                    if len(chunk) >= chunk_rows and r["user_id"] != chunk[-1][0]:
+                        pending.append(loop.run_in_executor(executor, replay_chunk, chunk, run_id, seed))
+                        chunk = []
+                        while len(pending) >= max_in_flight:
+                            await collect()
+                    chunk.append(tuple(r))
+                if chunk:
+                    pending.append(loop.run_in_executor(executor, replay_chunk, chunk, run_id, seed))
+            while pending:
+                await collect()
+
+            summary = summarize_metrics(counts)
+            if write:
+                await write_conn.execute(RUN_INSERT_SQL, run_id, label, seed, started_at, datetime.utcnow(),
+                                         counts.get("events", 0), json.dumps(summary))
+    logger.info(f"Replay {run_id} finished: {counts.get('events', 0)} events")
+    return {"run_id": run_id, "label": label, "seed": seed, "metrics": summary}
+
+
+async def _main(args) -> None:
+    from helper import get_pg_pool, close_pg_pool, questions_coll
+    from question_index import question_index
+    from irt import item_calibration
+
+    pool = await get_pg_pool()
+    await question_index.load(questions_coll)
+    await item_calibration.load(pool)
+    result = await replay(pool, question_index, args.seed, args.label, args.workers, args.chunk_rows,
+                          write=not args.dry_run, item_calibration=item_calibration)
+    await close_pg_pool()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the adaptive selection policy over recorded history")
+    parser.add_argument("--label", help="free-form name stored with the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=REPLAY_WORKERS)
+    parser.add_argument("--chunk-rows", type=int, default=REPLAY_CHUNK_ROWS)
+    parser.add_argument("--dry-run", action="store_true", help="report metrics without writing")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,221 @@
+# rollup.py
+# Per-user answer rollups for dashboards, keyed by (userId, topic, subtopic, difficulty).
+# Each row holds lifetime counts and time sums plus the last ROLLUP_WINDOW answers
+# (outcome bitmask and times), updated in O(1) per answer by the decision writer's
+# write-behind batches. Reads are primary-key lookups (a user's rows are a key prefix),
+# so their cost doesn't grow with the user's history.
+# Rebuild from history with: python rollup.py backfill
+import asyncio
+import logging
+from typing import Optional, List, Dict, Tuple, Any
+
+from mastery_store import BACKFILL_SQL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROLLUP_WINDOW = 20
+ROLLUP_WINDOW_MASK = (1 << ROLLUP_WINDOW) - 1
+
+ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS agent_rollup (
+        user_id TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        subtopic TEXT NOT NULL DEFAULT '',
+        difficulty SMALLINT NOT NULL DEFAULT 0,
+        answers INT NOT NULL DEFAULT 0,
+        correct INT NOT NULL DEFAULT 0,
+        time_sum REAL NOT NULL DEFAULT 0,
+        window_bits BIGINT NOT NULL DEFAULT 0,
+        window_len SMALLINT NOT NULL DEFAULT 0,
+        window_correct SMALLINT NOT NULL DEFAULT 0,
+        window_times REAL[] NOT NULL DEFAULT '{}',
+        last_question_id TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (user_id, topic, subtopic, difficulty)
+    )
+"""
+
+ROLLUP_KEY = ("user_id", "topic", "subtopic", "difficulty")
+ROLLUP_STATE = ("answers", "correct", "time_sum", "window_bits", "window_len", "window_correct", "window_times")
+
+# $1 user, $2 topic, $3 subtopic ('' if none), $4 difficulty (0 if unknown), $5 correct (0/1),
+# $6 timeTaken, $7 questionId, $8 window mask, $9 window size.
+# As with agent_mastery, a retried answer to the same question is a no-op.
+RECORD_SQL = """
+    INSERT INTO agent_rollup AS r
+        (user_id, topic, subtopic, difficulty, answers, correct, time_sum,
+         window_bits, window_len, window_correct, window_times, last_question_id, updated_at)
+    VALUES ($1, $2, $3, $4, 1, $5::int, $6::real, $5::int, 1, $5::int, ARRAY[$6::real], $7, NOW())
+    ON CONFLICT (user_id, topic, subtopic, difficulty) DO UPDATE SET
+        answers = r.answers + 1,
+        correct = r.correct + $5::int,
+        time_sum = r.time_sum + $6::real,
+        window_bits = ((r.window_bits << 1) | $5::int::bigint) & $8::bigint,
+        window_len = LEAST(r.window_len + 1, $9::int),
+        window_correct = r.window_correct + $5::int
+            - CASE WHEN r.window_len >= $9::int THEN ((r.window_bits >> ($9::int - 1)) & 1)::int ELSE 0 END,
+        window_times = (r.window_times || $6::real)[GREATEST(1, cardinality(r.window_times) + 2 - $9::int):],
+        last_question_id = $7,
+        updated_at = NOW()
+    WHERE r.last_question_id IS DISTINCT FROM $7
+"""
+
+UPSERT_SQL = """
+    INSERT INTO agent_rollup
+        (user_id, topic, subtopic, difficulty, answers, correct, time_sum,
+         window_bits, window_len, window_correct, window_times, last_question_id, updated_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, NOW())
+    ON CONFLICT (user_id, topic, subtopic, difficulty) DO UPDATE SET
+        answers = EXCLUDED.answers,
+        correct = EXCLUDED.correct,
+        time_sum = EXCLUDED.time_sum,
+        window_bits = EXCLUDED.window_bits,
+        window_len = EXCLUDED.window_len,
+        window_correct = EXCLUDED.window_correct,
+        window_times = EXCLUDED.window_times,
+        last_question_id = EXCLUDED.last_question_id,
+        updated_at = NOW()
+"""
+
+SELECT_SQL = f"""
+    SELECT {", ".join(ROLLUP_KEY + ROLLUP_STATE)}
+    FROM agent_rollup WHERE user_id = $1 AND ($2::text IS NULL OR topic = $2)
+    ORDER BY topic, subtopic, difficulty
+"""
+
+SELECT_ONE_SQL = f"""
+    SELECT {", ".join(ROLLUP_KEY + ROLLUP_STATE)}
+    FROM agent_rollup WHERE user_id = $1 AND topic = $2 AND subtopic = $3 AND difficulty = $4
+"""
+
+
+class RollupState:
+    """Counts for one (userId, topic, subtopic, difficulty)."""
+    __slots__ = ROLLUP_STATE + ("last_question_id",)
+
+    def __init__(self):
+        self.answers = 0
+        self.correct = 0
+        self.time_sum = 0.0
+        self.window_bits = 0
+        self.window_len = 0
+        self.window_correct = 0
+        self.window_times: List[float] = []
+        self.last_question_id: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "RollupState":
+        state = cls()
+        for field in ROLLUP_STATE:
+            setattr(state, field, row[field])
+        state.window_times = list(state.window_times)
+        return state
+
+    def apply(self, correct: bool, time_taken: float, question_id: Optional[str] = None) -> None:
+        """Fold one answer into the counts; mirrors RECORD_SQL."""
+        if question_id is not None and question_id == self.last_question_id:
+            return
+        bit = 1 if correct else 0
+        if self.window_len >= ROLLUP_WINDOW:
+            self.window_correct -= (self.window_bits >> (ROLLUP_WINDOW - 1)) & 1
+        self.window_bits = ((self.window_bits << 1) | bit) & ROLLUP_WINDOW_MASK
+        self.window_len = min(self.window_len + 1, ROLLUP_WINDOW)
+        self.window_correct += bit
+        self.window_times = (self.window_times + [float(time_taken)])[-ROLLUP_WINDOW:]
+        self.answers += 1
+        self.correct += bit
+        self.time_sum += float(time_taken)
+        self.last_question_id = question_id
+
+    def stats(self) -> Dict[str, Any]:
+        """What a dashboard shows: lifetime and recent accuracy (percent) and average time."""
+        times = self.window_times
+        return {
+            "count": self.answers,
+            "correct": self.correct,
+            "total_time": round(self.time_sum, 2),
+            "accuracy": round(100 * self.correct / self.answers, 2) if self.answers else 0.0,
+            "avg_time": round(self.time_sum / self.answers, 2) if self.answers else 0.0,
+            "recent_count": self.window_len,
+            "recent_accuracy": round(100 * self.window_correct / self.window_len, 2) if self.window_len else 0.0,
+            "recent_avg_time": round(sum(times) / len(times), 2) if times else 0.0,
+        }
+
+    def as_row(self, key: Tuple[str, str, str, int]) -> Tuple[Any, ...]:
+        return (*key, self.answers, self.correct, self.time_sum, self.window_bits,
+                self.window_len, self.window_correct, self.window_times, self.last_question_id)
+
+
+def rollup_key(user_id: Optional[str], topic: str, subtopic: Optional[str],
+               difficulty: Optional[int]) -> Tuple[str, str, str, int]:
+    return (user_id or "anonymous", topic, subtopic or "", int(difficulty or 0))
+
+def rollup_args(user_id: Optional[str], topic: str, subtopic: Optional[str], difficulty: Optional[int],
+                correct: bool, time_taken: float, question_id: Optional[str] = None) -> Tuple[Any, ...]:
+    """Positional parameters $1..$9 for RECORD_SQL."""
+    return (*rollup_key(user_id, topic, subtopic, difficulty), 1 if correct else 0,
+            float(time_taken), question_id, ROLLUP_WINDOW_MASK, ROLLUP_WINDOW)
+
+async def ensure_rollup_table(conn) -> None:
+    """Create the agent_rollup table if missing."""
+    await conn.execute(ROLLUP_DDL)
+
+async def record_rollups(conn, rows: List[Tuple[Any, ...]]) -> None:
+    """Apply a batch of rollup_args rows (one pipelined statement per answer, in order)."""
+    await conn.executemany(RECORD_SQL, rows)
+
+async def get_rollup(conn, user_id: str, topic: str, subtopic: Optional[str] = None,
+                     difficulty: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Stats of one (user, topic, subtopic, difficulty), or None if the user never answered one."""
+    row = await conn.fetchrow(SELECT_ONE_SQL, *rollup_key(user_id, topic, subtopic, difficulty))
+    return RollupState.from_row(row).stats() if row else None
+
+async def user_rollups(conn, user_id: str, topic: Optional[str] = None) -> List[Dict[str, Any]]:
+    """All of a user's rows (optionally for one topic), each with its key and stats."""
+    rows = await conn.fetch(SELECT_SQL, user_id, topic)
+    return [{"topic": r["topic"], "subtopic": r["subtopic"] or None, "difficulty": r["difficulty"] or None,
+             **RollupState.from_row(r).stats()} for r in rows]
+
+
+# ---------------- batch backfill ----------------
+
+async def backfill(pool, question_index, chunk_size: int = 5000) -> int:
+    """
+    Rebuild every rollup from `question_session` history, streamed in timestamp order
+    through a server-side cursor (the same rows as the mastery backfill).
+    """
+    states: Dict[Tuple[str, str, str, int], RollupState] = {}
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            async for r in conn.cursor(BACKFILL_SQL, prefetch=chunk_size):
+                rec = question_index.get(r["question_id"])
+                if rec is None:
+                    continue
+                key = rollup_key(str(r["user_id"]), rec.topic, rec.subtopic, rec.difficulty)
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = RollupState()
+                state.apply(r["correct"], r["time_taken"] or 0, r["question_id"])
+        await ensure_rollup_table(conn)
+        rows = [state.as_row(key) for key, state in states.items()]
+        for i in range(0, len(rows), chunk_size):
+            await conn.executemany(UPSERT_SQL, rows[i:i + chunk_size])
+    logger.info(f"Rollup backfill wrote {len(rows)} rows")
+    return len(rows)
+
+
+async def _main(argv) -> None:
+    from helper import get_pg_pool, questions_coll
+    from question_index import question_index
+
+    if argv[1:] != ["backfill"]:
+        print("usage: python rollup.py backfill")
+        return
+    await question_index.load(questions_coll)
+    await backfill(await get_pg_pool(), question_index)
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(_main(sys.argv))
@@ -0,0 +1,230 @@
+# sampling.py
+# Weighted question sampling over the question index.
+# Every (topic, difficulty, subtopic) pool gets a cached alias table built from static
+# scores computed with NumPy (hint-free bonus, exposure balancing), so a draw is O(1).
+# Per-request factors in [0, 1] (time fit, skill coverage, item difficulty fit, recency)
+# are applied by accept/reject, which keeps picks exactly proportional to
+# static x per-request weight without scoring the whole pool on every request.
+# Difficulty fit uses the IRT chance of a correct answer at the user's ability when both
+# are calibrated (irt.py), else the item's observed correct rate.
+import os
+import time
+import random
+from typing import Optional, List, Dict, Tuple, Any, Iterable
+
+import numpy as np
+
+from question_index import question_index
+from irt import item_calibration
+
+SAMPLER_EXPOSURE_POWER = float(os.getenv("SAMPLER_EXPOSURE_POWER", 1.0))
+SAMPLER_RECENCY_SECONDS = float(os.getenv("SAMPLER_RECENCY_SECONDS", 60))
+SAMPLER_MIN_ATTEMPTS = int(os.getenv("SAMPLER_MIN_ATTEMPTS", 20))
+MAX_REJECTIONS = 32
+REBUILD_FRACTION = 0.25  # rebuild a pool's table after this share of its size in picks (exposure drift)
+
+
+class PickContext:
+    """Per-request inputs to the acceptance factors."""
+    __slots__ = ("remaining_seconds", "skills", "target_p", "now", "theta")
+
+    def __init__(self, remaining_seconds: Optional[float] = None, skills: Iterable[str] = (),
+                 target_p: float = 0.7, now: Optional[float] = None, theta: Optional[float] = None):
+        self.remaining_seconds = remaining_seconds
+        self.skills = frozenset(skills)   # skills just practiced; others count as new coverage
+        self.target_p = target_p          # preferred chance of a correct answer on the next item
+        self.now = time.monotonic() if now is None else now
+        self.theta = theta                # the user's IRT ability, None until estimated
+
+
+class AliasTable:
+    """Vose's alias method: O(n) build, O(1) draw."""
+    __slots__ = ("n", "prob", "alias")
+
+    def __init__(self, weights: np.ndarray):
+        n = len(weights)
+        total = float(weights.sum())
+        scaled = (weights * (n / total) if total > 0 else np.ones(n)).tolist()
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        self.n = n
+        self.prob = prob
+        self.alias = alias
+
+    def draw(self, rng) -> int:
+        i = int(rng.random() * self.n)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class ItemPool:
+    """Questions of one (topic, difficulty, subtopic) pool as arrays, with their alias table."""
+    __slots__ = ("records", "ordinals", "has_hints", "weights", "table", "version", "picks")
+
+    def __init__(self, records: List[Any], version: int):
+        self.records = records
+        self.ordinals = np.fromiter((r.ordinal for r in records), dtype=np.int64, count=len(records))
+        self.has_hints = np.fromiter((bool(r.hints) for r in records), dtype=bool, count=len(records))
+        self.weights: Optional[np.ndarray] = None
+        self.table: Optional[AliasTable] = None
+        self.version = version
+        self.picks = 0
+
+
+class SelectionPolicy:
+    """
+    Default scoring. Subclass and pass to QuestionSampler to change selection:
+    `static_weights` is vectorized over a pool, `acceptance` must stay within [0, 1].
+    """
+    hint_free_bonus = 1.1
+    time_penalty = 0.5
+    skill_repeat = 0.7
+    difficulty_fit = 1.5
+    min_acceptance = 0.25
+
+    def static_weights(self, pool: ItemPool, exposure: np.ndarray) -> np.ndarray:
+        w = np.where(pool.has_hints, 1.0, self.hint_free_bonus)
+        # exposure balancing: items served more than the pool average are drawn less often
+        mean = exposure.mean() if len(exposure) else 0.0
+        return w * ((mean + 1.0) / (exposure + 1.0)) ** SAMPLER_EXPOSURE_POWER
+
+    def acceptance(self, rec, p_correct: Optional[float], since_served: float, ctx: PickContext) -> float:
+        a = 1.0
+        # prefer shorter estimatedTime if low remaining_seconds
+        if ctx.remaining_seconds and rec.estimatedTime > ctx.remaining_seconds / 6:
+            a *= self.time_penalty
+        if ctx.skills and rec.mentalSkill and ctx.skills.issuperset(rec.mentalSkill):
+            a *= self.skill_repeat
+        if p_correct is not None:
+            a *= max(self.min_acceptance, 1.0 - self.difficulty_fit * abs(p_correct - ctx.target_p))
+        if since_served < SAMPLER_RECENCY_SECONDS:
+            a *= 0.5 + 0.5 * since_served / SAMPLER_RECENCY_SECONDS
+        return a
+
+
+class QuestionSampler:
+    """Picks questions from the index; tracks exposure, recency and correct rates per ordinal."""
+    def __init__(self, index, policy: Optional[SelectionPolicy] = None, calibration=None):
+        self.index = index
+        self.policy = policy or SelectionPolicy()
+        self.calibration = calibration
+        self._pools: Dict[Tuple[str, Optional[int], Optional[str]], ItemPool] = {}
+        self._exposure = np.zeros(1024, dtype=np.int64)
+        self._last_served = np.full(1024, -np.inf)
+        self._attempts = np.zeros(1024, dtype=np.int64)
+        self._correct = np.zeros(1024, dtype=np.int64)
+        self.rebuilds = 0
+        self.fallbacks = 0
+
+    def _ensure(self, ordinal: int) -> None:
+        size = len(self._exposure)
+        if ordinal < size:
+            return
+        grow = max(size, ordinal + 1 - size)
+        self._exposure = np.concatenate([self._exposure, np.zeros(grow, dtype=np.int64)])
+        self._last_served = np.concatenate([self._last_served, np.full(grow, -np.inf)])
+        self._attempts = np.concatenate([self._attempts, np.zeros(grow, dtype=np.int64)])
+        self._correct = np.concatenate([self._correct, np.zeros(grow, dtype=np.int64)])
+
+    def _pool(self, topic: str, difficulty: Optional[int], subtopic: Optional[str]) -> Optional[ItemPool]:
+        key = (topic, difficulty, subtopic)
+        pool = self._pools.get(key)
+        if pool is None or pool.version != self.index.version:
+            records = self.index.records(topic, difficulty, subtopic)
+            if not records:
+                self._pools.pop(key, None)
+                return None
+            pool = self._pools[key] = ItemPool(records, self.index.version)
+        if pool.table is None or pool.picks > max(8, REBUILD_FRACTION * len(pool.records)):
+            if len(pool.ordinals):
+                self._ensure(int(pool.ordinals.max()))
+            pool.weights = self.policy.static_weights(pool, self._exposure[pool.ordinals])
+            pool.table = AliasTable(pool.weights)
+            pool.picks = 0
+            self.rebuilds += 1
+        return pool
+
+    def _acceptance(self, rec, ctx: PickContext) -> float:
+        o = rec.ordinal
+        p_correct = None
+        if ctx.theta is not None and self.calibration is not None:
+            p_correct = self.calibration.p_correct(o, ctx.theta)
+        if o >= len(self._attempts):
+            return self.policy.acceptance(rec, p_correct, np.inf, ctx)
+        attempts = self._attempts[o]
+        if p_correct is None and attempts >= SAMPLER_MIN_ATTEMPTS:
+            p_correct = self._correct[o] / attempts
+        return self.policy.acceptance(rec, p_correct, ctx.now - self._last_served[o], ctx)
+
+    def _draw(self, pool: ItemPool, exclude, ctx: PickContext, rng):
+        for _ in range(MAX_REJECTIONS):
+            rec = pool.records[pool.table.draw(rng)]
+            if exclude is not None and rec.ordinal in exclude:
+                continue
+            if rng.random() < self._acceptance(rec, ctx):
+                return rec
+        # heavily excluded pool or low acceptance: one exact pass over what's left
+        self.fallbacks += 1
+        eligible, weights = [], []
+        for rec, w in zip(pool.records, pool.weights.tolist()):
+            if exclude is not None and rec.ordinal in exclude:
+                continue
+            w *= self._acceptance(rec, ctx)
+            if w > 0:
+                eligible.append(rec)
+                weights.append(w)
+        return rng.choices(eligible, weights=weights, k=1)[0] if eligible else None
+
+    def pick(self, topic: str, tiers: List[Dict[str, Any]], exclude=None,
+             ctx: Optional[PickContext] = None, rng=random, commit: bool = True):
+        """
+        A QuestionRecord from the first tier with an eligible question (None if there is none).
+        With `commit=False` the pick isn't counted as served; call `commit` if it is used.
+        """
+        ctx = ctx or PickContext()
+        for tier in tiers:
+            pool = self._pool(topic, tier.get("difficulty"), tier.get("subtopic"))
+            if pool is None:
+                continue
+            rec = self._draw(pool, exclude, ctx, rng)
+            if rec is not None:
+                pool.picks += 1
+                if commit:
+                    self.commit(rec, ctx.now)
+                return rec
+        return None
+
+    def commit(self, rec, now: Optional[float] = None) -> None:
+        """Count a picked question as served (exposure and recency)."""
+        self._ensure(rec.ordinal)
+        self._exposure[rec.ordinal] += 1
+        self._last_served[rec.ordinal] = time.monotonic() if now is None else now
+
+    def record_answer(self, question_id: Any, correct: bool) -> None:
+        """Fold an answer into the item's historical correct rate."""
+        o = self.index.ordinal(question_id)
+        if o is None:
+            return
+        self._ensure(o)
+        self._attempts[o] += 1
+        self._correct[o] += bool(correct)
+
+    def stats(self) -> Dict[str, Any]:
+        served = self._exposure[self._exposure > 0]
+        return {
+            "pools": len(self._pools),
+            "rebuilds": self.rebuilds,
+            "fallbacks": self.fallbacks,
+            "items_served": int(len(served)),
+            "exposure_max": int(served.max()) if len(served) else 0,
+            "exposure_mean": round(float(served.mean()), 3) if len(served) else 0.0,
+        }
+
+
+question_sampler = QuestionSampler(question_index, calibration=item_calibration)
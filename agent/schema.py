@@ -0,0 +1,207 @@
+# schema.py
+# The indexes the agent's hot queries rely on, in Mongo (question bank) and Postgres
+# (backend tables; the agent's own tables are served by their primary keys).
+# `ensure_indexes` creates missing ones idempotently: run `python schema.py ensure` on
+# deploy; SCHEMA_ENSURE_INDEXES=1 also runs it at startup (off by default: with several
+# workers only the one holding the advisory lock builds, the others skip).
+# `audit` explains every hot query and flags collection and sequential scans.
+#
+#   python schema.py ensure
+#   python schema.py audit        # exit status 1 when a query would scan
+import os
+import sys
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+from typing import Optional, List, Dict, Tuple, Any
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA_ENSURE_INDEXES = os.getenv("SCHEMA_ENSURE_INDEXES", "0") == "1"
+SCHEMA_LOCK_KEY = "agent_schema_ensure"
+
+# (name, keys): candidate tiers filter topic, then difficulty and subtopic (prefixes of the
+# first index); fetch_candidate_questions may filter mentalSkill instead; the question index
+# polls updatedAt for changes.
+MONGO_INDEXES: List[Tuple[str, List[Tuple[str, int]]]] = [
+    ("topic_difficulty_subtopic", [("topic", 1), ("difficulty", 1), ("subtopic", 1)]),
+    ("topic_mentalSkill_difficulty", [("topic", 1), ("mentalSkill", 1), ("difficulty", 1)]),
+    ("updatedAt", [("updatedAt", 1)]),
+]
+
+# (name, table, definition)
+PG_INDEXES: List[Tuple[str, str, str]] = [
+    # a session's answered ids in answer order, index-only (suggest context, batch, analytics)
+    ("question_session_session_time_idx", "question_session", '("sessionId", timestamp, "questionId")'),
+    # answers to one question (item calibration and per-question reports)
+    ("question_session_question_idx", "question_session", '("questionId", timestamp)'),
+    # a user's sessions; the expression matches the "userId"::text filters
+    ("session_user_idx", "session", '(("userId"::text))'),
+    # the decision recorded for an answer (replay)
+    ("agent_decision_session_prev_idx", "agent_decision", "(session_id, prev_question_id, created_at)"),
+]
+
+PG_INDEX_STATE_SQL = """
+    SELECT c.relname AS name, i.indisvalid AS valid
+    FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+    WHERE c.relname = ANY($1::text[])
+"""
+
+
+async def ensure_mongo_indexes(coll) -> List[str]:
+    """Create the missing question bank indexes; returns the names created or confirmed."""
+    done = []
+    for name, keys in MONGO_INDEXES:
+        try:
+            await coll.create_indexes([IndexModel(keys, name=name)])
+            done.append(name)
+        except OperationFailure as e:
+            # code 85/86: the same keys exist under another name or with other options
+            logger.warning(f"Mongo index {name} not created: {e}")
+    return done
+
+async def ensure_pg_indexes(pool, wait: bool = True) -> List[str]:
+    """
+    Create the missing Postgres indexes with CREATE INDEX CONCURRENTLY (no write lock on
+    the backend tables); an invalid leftover of an interrupted build is dropped and rebuilt.
+    Runs under a session advisory lock, so one process builds at a time: an index still
+    being built by another reads as invalid and must not be dropped. With wait=False,
+    returns at once when another process holds the lock. Returns the names created.
+    """
+    created = []
+    async with pool.acquire() as conn:
+        if wait:
+            await conn.execute("SELECT pg_advisory_lock(hashtext($1))", SCHEMA_LOCK_KEY)
+        elif not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", SCHEMA_LOCK_KEY):
+            logger.info("Another process is ensuring the Postgres indexes; skipping")
+            return created
+        try:
+            # read under the lock: an invalid index now is a leftover, not a build in progress
+            state = {r["name"]: r["valid"] for r in await conn.fetch(PG_INDEX_STATE_SQL, [n for n, _, _ in PG_INDEXES])}
+            for name, table, definition in PG_INDEXES:
+                if state.get(name):
+                    continue
+                try:
+                    if name in state:
+                        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+                    created.append(name)
+                    logger.info(f"Created index {name} on {table}")
+                except Exception as e:
+                    # missing table or no privilege
+                    logger.warning(f"Postgres index {name} not created: {e!r}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", SCHEMA_LOCK_KEY)
+    return created
+
+async def ensure_indexes(pool, coll, wait: bool = True) -> Dict[str, List[str]]:
+    return {"mongo": await ensure_mongo_indexes(coll), "postgres": await ensure_pg_indexes(pool, wait)}
+
+
+# ---------------- audit ----------------
+
+def _pg_queries() -> List[Tuple[str, str, Tuple[Any, ...]]]:
+    """(name, sql, sample args) of the Postgres queries on the request path."""
+    from helper import SUGGEST_CONTEXT_SQL, BATCH_SESSIONS_SQL, BATCH_STATE_SQL
+    from mastery_store import record_args, SELECT_SQL as MASTERY_SELECT_SQL
+    from rollup import SELECT_SQL as ROLLUP_SELECT_SQL
+    from analytics import ANALYTICS_SQL
+    sid = uuid.uuid4()
+    return [
+        ("suggest_context", SUGGEST_CONTEXT_SQL,
+         (*record_args("audit", "audit", True, 30.0, "audit"), sid, 0, None, None)),
+        ("batch_sessions", BATCH_SESSIONS_SQL, ([sid], [0])),
+        ("batch_state", BATCH_STATE_SQL, (["audit"], ["audit"])),
+        ("mastery", MASTERY_SELECT_SQL, ("audit", "audit")),
+        ("user_rollup", ROLLUP_SELECT_SQL, ("audit", None)),
+        ("session_analytics", ANALYTICS_SQL, ([sid], ["audit"])),
+    ]
+
+def _plan_nodes(plan: Dict[str, Any]):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+async def audit_pg(pool) -> List[str]:
+    """
+    EXPLAIN each query with sequential scans disabled: a Seq Scan left in the plan means
+    no index can serve it, however small the table is today.
+    """
+    problems = []
+    async with pool.acquire() as conn:
+        for name, sql, args in _pg_queries():
+            async with conn.transaction():
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                try:
+                    plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))[0]["Plan"]
+                except Exception as e:
+                    problems.append(f"postgres {name}: EXPLAIN failed: {e!r}")
+                    continue
+            for node in _plan_nodes(plan):
+                if node["Node Type"] == "Seq Scan":
+                    problems.append(f"postgres {name}: Seq Scan on {node.get('Relation Name')}")
+    return problems
+
+def _mongo_stages(plan: Any):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for v in plan.values():
+            yield from _mongo_stages(v)
+    elif isinstance(plan, list):
+        for v in plan:
+            yield from _mongo_stages(v)
+
+async def audit_mongo(coll) -> List[str]:
+    """Explain the question bank queries with values from a real document; flag COLLSCAN plans."""
+    from helper import CANDIDATE_PROJECTION
+    from policy import candidate_tiers
+    from question_index import INDEX_PROJECTION
+    doc = await coll.find_one({}, {"topic": 1, "difficulty": 1, "subtopic": 1, "mentalSkill": 1, "updatedAt": 1})
+    if doc is None:
+        return ["mongo: the question collection is empty; nothing to explain"]
+    skill = (doc.get("mentalSkill") or [None])[0]
+    match = {"topic": doc["topic"], "_id": {"$nin": [doc["_id"]]}}
+    facets = {str(i): ([{"$match": t}] if t else []) + [{"$limit": 50}]
+              for i, t in enumerate(candidate_tiers(False, doc.get("difficulty") or 1, 1, doc.get("subtopic")))}
+    finds = {
+        "candidates": {"topic": doc["topic"], "difficulty": doc.get("difficulty"), "subtopic": doc.get("subtopic")},
+        "candidates_by_skill": {"topic": doc["topic"], "mentalSkill": skill},
+        "changed_since": {"updatedAt": {"$gt": doc.get("updatedAt")}},
+    }
+    plans = {name: await coll.find(q, INDEX_PROJECTION if name == "changed_since" else CANDIDATE_PROJECTION).explain()
+             for name, q in finds.items()}
+    plans["candidate_tiers"] = await coll.database.command(
+        "aggregate", coll.name, pipeline=[{"$match": match}, {"$facet": facets}], explain=True)
+    return [f"mongo {name}: COLLSCAN" for name, plan in plans.items() if "COLLSCAN" in _mongo_stages(plan)]
+
+async def audit(pool, coll) -> List[str]:
+    problems = await audit_mongo(coll) + await audit_pg(pool)
+    for p in problems:
+        logger.warning(f"Index audit: {p}")
+    return problems
+
+
+async def _main(argv) -> int:
+    from helper import get_pg_pool, questions_coll
+
+    parser = argparse.ArgumentParser(description="Agent index provisioning and query-plan audit")
+    parser.add_argument("command", choices=("ensure", "audit"))
+    args = parser.parse_args(argv)
+    pool = await get_pg_pool()
+    if args.command == "ensure":
+        print(json.dumps(await ensure_indexes(pool, questions_coll), indent=2))
+        return 0
+    problems = await audit(pool, questions_coll)
+    print("\n".join(problems) if problems else "no collection or sequential scans on the hot queries")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,214 @@
+# session_store.py
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Callable, Awaitable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # memory | postgres | redis
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 3600 + 15 * 60))  # one-hour session + grace
+SESSION_MEMORY_MAX = int(os.getenv("SESSION_MEMORY_MAX", 100000))
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+
+DATETIME_FIELDS = ("startedAt", "endedAt", "last_prompt_time")
+
+
+class SessionRecord:
+    """Compact agent-side session state (what /session/start and /session/end need)."""
+    __slots__ = (
+        "sessionId", "userId", "topicOrder", "startedAt", "events", "stats",
+        "last_prompt_time", "endedAt", "perTopicStats", "overallAccuracy", "recommendations",
+    )
+
+    def __init__(self, sessionId: str, userId: Optional[str], topicOrder: List[str], startedAt: datetime,
+                 events: Optional[List[Dict[str, Any]]] = None, stats: Optional[Dict[str, Any]] = None,
+                 last_prompt_time: Optional[datetime] = None, endedAt: Optional[datetime] = None,
+                 perTopicStats: Optional[Dict[str, Any]] = None, overallAccuracy: Optional[float] = None,
+                 recommendations: Optional[List[str]] = None):
+        self.sessionId = sessionId
+        self.userId = userId
+        self.topicOrder = topicOrder
+        self.startedAt = startedAt
+        self.events = events if events is not None else []
+        self.stats = stats if stats is not None else {}
+        self.last_prompt_time = last_prompt_time or startedAt
+        self.endedAt = endedAt
+        self.perTopicStats = perTopicStats
+        self.overallAccuracy = overallAccuracy
+        self.recommendations = recommendations
+
+    def to_json(self) -> str:
+        data = {f: getattr(self, f) for f in self.__slots__}
+        for f in DATETIME_FIELDS:
+            if data[f] is not None:
+                data[f] = data[f].isoformat()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "SessionRecord":
+        data = json.loads(raw)
+        for f in DATETIME_FIELDS:
+            if data.get(f):
+                data[f] = datetime.fromisoformat(data[f])
+        return cls(**data)
+
+
+class MemorySessionStore:
+    """Per-process tier: slotted records, LRU-bounded, evicted once the session TTL has passed."""
+    def __init__(self, ttl: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MEMORY_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._records: "OrderedDict[str, tuple]" = OrderedDict()  # sid -> (expires, record)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # records are kept in expiry order (insert/refresh moves to the end)
+        while self._records:
+            sid, (expires, _) = next(iter(self._records.items()))
+            if expires > now and len(self._records) <= self.max_sessions:
+                break
+            del self._records[sid]
+
+    async def get(self, session_id: str) -> Optional[SessionRecord]:
+        entry = self._records.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._records[session_id]
+            return None
+        return entry[1]
+
+    async def put(self, record: SessionRecord) -> None:
+        self._records.pop(record.sessionId, None)
+        self._records[record.sessionId] = (time.monotonic() + self.ttl, record)
+        self._evict()
+
+    async def delete(self, session_id: str) -> None:
+        self._records.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class PostgresSessionStore:
+    """Shared tier in Postgres, so any worker or node can serve any session."""
+    DDL = """
+        CREATE TABLE IF NOT EXISTS agent_session (
+            session_id TEXT PRIMARY KEY,
+            data JSONB NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        )
+    """
+
+    def __init__(self, get_pool: Callable[[], Awaitable[Any]], ttl: int = SESSION_TTL_SECONDS):
+        self.get_pool = get_pool
+        self.ttl = ttl
+
+    async def start(self) -> None:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(self.DDL)
+            await conn.execute("DELETE FROM agent_session WHERE expires_at < NOW()")
+
+    async def close(self) -> None:
+        pass
+
+    async def get(self, session_id: str) -> Optional[SessionRecord]:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            raw = await conn.fetchval(
+                "SELECT data FROM agent_session WHERE session_id=$1 AND expires_at > NOW()", session_id)
+        return SessionRecord.from_json(raw) if raw else None
+
+    async def put(self, record: SessionRecord) -> None:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO agent_session(session_id, data, expires_at)
+                VALUES ($1, $2, NOW() + make_interval(secs => $3))
+                ON CONFLICT (session_id) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+            """, record.sessionId, record.to_json(), float(self.ttl))
+
+    async def delete(self, session_id: str) -> None:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM agent_session WHERE session_id=$1", session_id)
+
+
+class RedisSessionStore:
+    """Shared tier in Redis (or any Redis-compatible server); keys expire with the session TTL."""
+    def __init__(self, url: str = REDIS_URL, ttl: int = SESSION_TTL_SECONDS):
+        import redis.asyncio as redis  # optional dependency, only needed for SESSION_STORE=redis
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+
+    async def start(self) -> None:
+        await self._redis.ping()
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    async def get(self, session_id: str) -> Optional[SessionRecord]:
+        raw = await self._redis.get(f"agent:session:{session_id}")
+        return SessionRecord.from_json(raw) if raw else None
+
+    async def put(self, record: SessionRecord) -> None:
+        await self._redis.set(f"agent:session:{record.sessionId}", record.to_json(), ex=self.ttl)
+
+    async def delete(self, session_id: str) -> None:
+        await self._redis.delete(f"agent:session:{session_id}")
+
+
+class TieredSessionStore:
+    """Local memory tier in front of a shared backend; writes go through to both."""
+    def __init__(self, shared, local: Optional[MemorySessionStore] = None):
+        self.shared = shared
+        self.local = local or MemorySessionStore()
+
+    async def start(self) -> None:
+        await self.shared.start()
+
+    async def close(self) -> None:
+        await self.shared.close()
+
+    async def get(self, session_id: str) -> Optional[SessionRecord]:
+        record = await self.local.get(session_id)
+        if record is None:
+            record = await self.shared.get(session_id)
+            if record is not None:
+                await self.local.put(record)
+        return record
+
+    async def put(self, record: SessionRecord) -> None:
+        await self.shared.put(record)
+        await self.local.put(record)
+
+    async def delete(self, session_id: str) -> None:
+        await self.shared.delete(session_id)
+        await self.local.delete(session_id)
+
+
+def make_session_store(kind: str = SESSION_STORE):
+    """Build the store selected by SESSION_STORE."""
+    if kind == "postgres":
+        from helper import get_pg_pool
+        return TieredSessionStore(PostgresSessionStore(get_pg_pool))
+    if kind == "redis":
+        return TieredSessionStore(RedisSessionStore())
+    if kind != "memory":
+        logger.warning(f"Unknown SESSION_STORE={kind!r}; using memory")
+    return MemorySessionStore()
+
+
+session_store = make_session_store()
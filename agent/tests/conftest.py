@@ -0,0 +1,10 @@
+# tests/conftest.py
+# The agent's modules import each other as top-level modules (they run from agent/),
+# so put agent/ on the path however pytest is started.
+#
+#   cd agent
+#   python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
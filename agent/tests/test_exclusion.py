@@ -0,0 +1,61 @@
+# tests/test_exclusion.py
+import random
+
+import pytest
+
+from exclusion import ExclusionSet, SessionExclusions
+
+
+@pytest.mark.parametrize("ordinal", [0, 1, 62, 63, 64, 65, 127, 128, 4095, 4096, 10**6])
+def test_membership_at_word_boundaries(ordinal):
+    excl = ExclusionSet([ordinal])
+    assert ordinal in excl
+    assert len(excl) == 1
+    for other in (ordinal - 1, ordinal + 1, ordinal + 64, ordinal - 64):
+        if other >= 0:
+            assert other not in excl
+
+
+def test_adjacent_words_do_not_leak():
+    # the last bit of one word and the first of the next
+    excl = ExclusionSet([63, 64])
+    assert 63 in excl and 64 in excl
+    assert 62 not in excl and 65 not in excl and 0 not in excl and 127 not in excl
+    assert len(excl) == 2
+
+
+def test_matches_a_set():
+    rng = random.Random(7)
+    ordinals = [rng.randrange(5000) for _ in range(800)]
+    excl = ExclusionSet(ordinals)
+    expected = set(ordinals)
+    assert len(excl) == len(expected)
+    assert all((o in excl) == (o in expected) for o in range(5100))
+
+
+def test_adding_twice_counts_once():
+    excl = ExclusionSet()
+    excl.add(64)
+    excl.add(64)
+    assert len(excl) == 1
+
+
+def test_session_sets_expire_and_evict(monkeypatch):
+    sessions = SessionExclusions(max_sessions=2, ttl=3600)
+    sessions.get("a").add(1)
+    sessions.get("b").add(2)
+    assert 1 in sessions.get("a")  # touched: "b" is now the oldest
+    sessions.get("c")
+    assert len(sessions) == 2
+    assert 2 not in sessions.get("b")  # evicted, so it comes back empty
+    sessions.drop("b")
+    assert len(sessions) == 1  # "c"; getting "b" again evicted "a"
+
+    clock = [1000.0]
+    monkeypatch.setattr("exclusion.time.monotonic", lambda: clock[0])
+    expiring = SessionExclusions(ttl=60)
+    expiring.get("a").add(1)
+    clock[0] += 59
+    assert 1 in expiring.get("a")  # a get renews the session
+    clock[0] += 61
+    assert 1 not in expiring.get("a")
@@ -0,0 +1,122 @@
+# tests/test_irt.py
+import math
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from question_index import QuestionIndex
+from irt import (
+    ability_update, ability_step, fit, expected_times, Responses, ItemCalibration,
+    THETA_INFO_PRIOR, THETA_LIMIT,
+)
+
+
+def p(theta, a, b):
+    return 1.0 / (1.0 + math.exp(-a * (theta - b)))
+
+
+def test_ability_update_is_one_newton_step():
+    theta, info = ability_update(0.5, 2.0, 1.2, -0.3, 1)
+    pc = p(0.5, 1.2, -0.3)
+    assert info == pytest.approx(2.0 + 1.2 ** 2 * pc * (1 - pc))
+    assert theta == pytest.approx(0.5 + 1.2 * (1 - pc) / info)
+
+
+def test_ability_update_direction_and_limits():
+    up, _ = ability_update(0.0, THETA_INFO_PRIOR, 1.0, 0.0, 1)
+    down, _ = ability_update(0.0, THETA_INFO_PRIOR, 1.0, 0.0, 0)
+    assert up > 0 > down
+    assert up == pytest.approx(-down)
+    clipped, _ = ability_update(THETA_LIMIT, 1e-6, 3.0, -10.0, 1)
+    assert clipped == THETA_LIMIT
+
+
+def test_ability_update_vectorized_matches_scalar():
+    theta, info = np.array([-1.0, 0.0, 2.0]), np.array([1.0, 3.0, 8.0])
+    a, b, y = np.array([0.8, 1.0, 1.6]), np.array([0.0, 1.0, -0.5]), np.array([1, 0, 1])
+    vt, vi = ability_update(theta, info, a, b, y)
+    for k in range(3):
+        st, si = ability_update(float(theta[k]), float(info[k]), float(a[k]), float(b[k]), int(y[k]))
+        assert vt[k] == pytest.approx(st) and vi[k] == pytest.approx(si)
+
+
+def test_ability_step_skips_uncalibrated_items_and_retries():
+    assert ability_step(None, None, None, True, "q1") is None
+    first = ability_step(None, 1.0, 0.0, True, "q1")
+    assert first[2] == "q1" and first[0] > 0 and first[1] > THETA_INFO_PRIOR
+    assert ability_step(first, 1.0, 0.0, False, "q1") is first  # retried AnswerEvent
+    assert ability_step(first, None, None, False, "q2") is first
+    assert ability_step(first, 1.0, 0.0, False, "q2")[0] < first[0]
+
+
+def test_online_steps_approach_the_true_ability():
+    rng = np.random.default_rng(5)
+    true_theta = 1.2
+    a, b = rng.uniform(0.7, 1.8, 400), rng.normal(0, 1.2, 400)
+    ability = None
+    for k in range(400):
+        correct = rng.random() < p(true_theta, a[k], b[k])
+        ability = ability_step(ability, float(a[k]), float(b[k]), correct, f"q{k}")
+    assert ability[0] == pytest.approx(true_theta, abs=0.35)
+
+
+def simulate(n_users=300, n_items=40, per_user=30, seed=11):
+    rng = np.random.default_rng(seed)
+    theta = rng.normal(0, 1, n_users)
+    a = np.exp(rng.normal(0, 0.3, n_items))
+    b = rng.normal(0, 1, n_items)
+    users = np.repeat(np.arange(n_users), per_user).astype(np.int32)
+    items = np.concatenate([rng.choice(n_items, per_user, replace=False) for _ in range(n_users)]).astype(np.int32)
+    prob = 1.0 / (1.0 + np.exp(-a[items] * (theta[users] - b[items])))
+    correct = (rng.random(len(users)) < prob).astype(np.float64)
+    log_time = np.log(rng.uniform(5, 60, len(users))).astype(np.float32)
+    resp = Responses(users, items, correct, log_time,
+                     [f"u{k}" for k in range(n_users)], [f"q{k}" for k in range(n_items)])
+    return resp, theta, a, b
+
+
+def test_fit_recovers_simulated_parameters():
+    # the joint MAP fit pins the scale only through the priors (theta and b come out
+    # shrunk, a inflated to match), so compare orderings and the predicted P(correct)
+    resp, theta, a, b = simulate()
+    est = fit(resp, np.zeros(len(b)), workers=1)
+    assert np.corrcoef(est["b"], b)[0, 1] > 0.95
+    assert np.corrcoef(est["a"], a)[0, 1] > 0.8
+    assert np.corrcoef(est["theta"], theta)[0, 1] > 0.85
+    true_p = 1.0 / (1.0 + np.exp(-a[None, :] * (theta[:, None] - b[None, :])))
+    est_p = 1.0 / (1.0 + np.exp(-est["a"][None, :] * (est["theta"][:, None] - est["b"][None, :])))
+    assert np.abs(true_p - est_p).mean() < 0.08
+    assert (est["info"] > THETA_INFO_PRIOR).all()
+
+
+def test_fit_does_not_depend_on_the_thread_split():
+    resp, *_ = simulate(n_users=120, n_items=20, per_user=15)
+    one = fit(resp, np.zeros(20), workers=1)
+    many = fit(resp, np.zeros(20), workers=4)
+    for name in ("theta", "a", "b", "info"):
+        assert np.allclose(one[name], many[name], atol=1e-9)
+
+
+def test_expected_times_shrink_to_the_prior():
+    resp = Responses(np.zeros(50, dtype=np.int32), np.zeros(50, dtype=np.int32), np.ones(50),
+                     np.full(50, math.log(10), dtype=np.float32), ["u"], ["q0", "q1"])
+    t = expected_times(resp, np.array([40.0, 40.0]))
+    assert t[1] == pytest.approx(40.0)  # no answers
+    assert 10.0 < t[0] < 40.0 and t[0] == pytest.approx(10.0, rel=0.25)
+
+
+def test_item_calibration_lookups():
+    index = QuestionIndex()
+    ids = [str(index.upsert({"_id": ObjectId(), "topic": "t", "estimatedTime": 25}).id) for _ in range(3)]
+    cal = ItemCalibration(index)
+    cal.load_rows([(ids[1], 1.5, 0.5, 12.0), ("not-in-the-index", 1.0, 0.0, 9.0)])
+    assert cal.items == 1
+    assert cal.params(ids[1]) == (1.5, 0.5)
+    assert cal.params(ids[0]) == (None, None)
+    assert cal.params(ids[2]) == (None, None)  # beyond the loaded arrays
+    assert cal.p_correct(index.ordinal(ids[1]), 0.5) == pytest.approx(0.5)
+    assert cal.p_correct(index.ordinal(ids[0]), 0.5) is None
+    assert cal.expected_seconds(ids[1]) == 12.0
+    assert cal.expected_seconds(ids[0]) == 25
+    assert cal.expected_seconds("unknown", 30.0) == 30.0
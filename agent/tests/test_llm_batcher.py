@@ -0,0 +1,146 @@
+# tests/test_llm_batcher.py
+import asyncio
+
+import pytest
+
+from llm_batcher import CompletionBatcher
+
+
+class FakeLLM:
+    """Records every request; completions take `latency` seconds."""
+    timeout = 10
+
+    def __init__(self, latency: float = 0.05, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = []
+        self.cancelled = 0
+
+    async def _complete(self, result):
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError("Failed to generate completion: boom")
+        return result
+
+    async def generate(self, prompt, deadline=None, **params):
+        self.calls.append(("generate", prompt, deadline, params))
+        return await self._complete(f"<{prompt}>")
+
+    async def generate_batch(self, prompts, deadline=None, **params):
+        self.calls.append(("generate_batch", list(prompts), deadline, params))
+        return await self._complete([f"<{p}>" for p in prompts])
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_identical_prompts_share_one_request():
+    async def main():
+        llm = FakeLLM()
+        batcher = CompletionBatcher(llm, window_ms=2)
+        results = await asyncio.gather(*(batcher.generate("hi", temperature=0.5) for _ in range(5)),
+                                       batcher.generate("hi", temperature=0.9))
+        return llm, batcher, results
+
+    llm, batcher, results = run(main())
+    assert results == ["<hi>"] * 6
+    assert len(llm.calls) == 2  # the other sampling parameters are a different completion
+    assert batcher.stats()["deduplicated"] == 4
+
+
+def test_multi_prompt_groups_by_parameters():
+    async def main():
+        llm = FakeLLM()
+        batcher = CompletionBatcher(llm, window_ms=2, multi_prompt=True)
+        results = await asyncio.gather(batcher.generate("a", n_predict=8), batcher.generate("b", n_predict=8),
+                                       batcher.generate("c", n_predict=16))
+        return llm, results
+
+    llm, results = run(main())
+    assert results == ["<a>", "<b>", "<c>"]
+    assert sorted((c[0], c[1]) for c in llm.calls) == [("generate_batch", ["a", "b"]), ("generate_batch", ["c"])]
+
+
+def test_request_gets_the_latest_waiter_deadline():
+    async def main():
+        llm = FakeLLM()
+        batcher = CompletionBatcher(llm, window_ms=5)
+        await asyncio.gather(batcher.generate("x", deadline=1), batcher.generate("x", deadline=3))
+        return llm
+
+    (_, _, deadline, _), = run(main()).calls
+    assert deadline == pytest.approx(3, abs=0.05)
+
+
+def test_later_caller_joins_only_a_request_that_outlives_its_deadline():
+    async def main():
+        llm = FakeLLM(latency=0.1)
+        batcher = CompletionBatcher(llm, window_ms=1)
+        first = asyncio.ensure_future(batcher.generate("x", deadline=2))
+        await asyncio.sleep(0.02)  # dispatched
+        shorter = asyncio.ensure_future(batcher.generate("x", deadline=1))
+        longer = asyncio.ensure_future(batcher.generate("x", deadline=5))
+        return llm, batcher, await asyncio.gather(first, shorter, longer)
+
+    llm, batcher, results = run(main())
+    assert results == ["<x>"] * 3
+    assert [round(c[2]) for c in llm.calls] == [2, 5]
+    assert batcher.stats() == {"submitted": 3, "deduplicated": 1, "batches": 2, "waiting": 0,
+                               "in_flight": 0, "abandoned": 0}
+    assert not (batcher._params or batcher._expires or batcher._waiters or batcher._requests)
+
+
+def test_request_is_cancelled_once_every_waiter_gives_up():
+    async def main():
+        llm = FakeLLM(latency=1.0)
+        batcher = CompletionBatcher(llm, window_ms=1)
+        results = await asyncio.gather(batcher.generate("x", deadline=0.05), batcher.generate("x", deadline=0.08),
+                                       return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return llm, batcher, results
+
+    llm, batcher, results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert llm.cancelled == 1
+    assert batcher.abandoned == 1
+    assert batcher.stats()["in_flight"] == 0
+
+
+def test_request_keeps_running_while_someone_waits():
+    async def main():
+        llm = FakeLLM(latency=0.1)
+        batcher = CompletionBatcher(llm, window_ms=1)
+        return llm, batcher, await asyncio.gather(batcher.generate("x", deadline=0.02),
+                                                  batcher.generate("x", deadline=2), return_exceptions=True)
+
+    llm, batcher, (early, late) = run(main())
+    assert isinstance(early, RuntimeError) and late == "<x>"
+    assert llm.cancelled == 0 and batcher.abandoned == 0
+
+
+def test_waiters_gone_before_dispatch_send_nothing():
+    async def main():
+        llm = FakeLLM()
+        batcher = CompletionBatcher(llm, window_ms=50)
+        with pytest.raises(RuntimeError):
+            await batcher.generate("x", deadline=0.01)
+        await asyncio.sleep(0.08)
+        return llm, batcher
+
+    llm, batcher = run(main())
+    assert llm.calls == []
+    assert batcher.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter():
+    async def main():
+        batcher = CompletionBatcher(FakeLLM(fail=True), window_ms=1)
+        return await asyncio.gather(batcher.generate("x"), batcher.generate("x"), return_exceptions=True)
+
+    results = run(main())
+    assert [str(r) for r in results] == ["Failed to generate completion: boom"] * 2
@@ -0,0 +1,235 @@
+# tests/test_llm_gateway.py
+import time
+import asyncio
+
+import pytest
+
+from llm_gateway import LLMGateway, CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeService:
+    """LlamaCppService stand-in: `behaviour` is "ok", "fail" (RuntimeError), "bad_json" or "hang"."""
+    def __init__(self, name: str, behaviour: str = "ok", chunks=("a", "b", "c"), latency: float = 0.0):
+        self.api_url = f"http://{name}"
+        self.behaviour = behaviour
+        self.chunks = chunks
+        self.latency = latency
+        self.timeout = 5
+        self.in_flight = 0
+        self.queued = 0
+        self.saturated = False
+        self.calls = 0
+
+    async def _act(self):
+        self.calls += 1
+        if self.behaviour == "hang":
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency)
+        if self.behaviour == "fail":
+            raise RuntimeError("Failed to generate completion: 503")
+        if self.behaviour == "bad_json":
+            raise ValueError("Expecting value: line 1 column 1")
+
+    async def generate(self, prompt, **params):
+        await self._act()
+        return f"{self.api_url}:{prompt}"
+
+    async def stream(self, prompt, n_predict, temperature, stop, deadline, **params):
+        await self._act()
+        for chunk in self.chunks:
+            yield chunk
+            await asyncio.sleep(0.01)
+
+    async def check_server(self):
+        return self.behaviour != "fail"
+
+    async def close(self):
+        pass
+
+
+def half_open(breaker: CircuitBreaker) -> None:
+    breaker.trip(time.monotonic())
+    breaker.half_open()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# ---------------- breaker ----------------
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown():
+    b = CircuitBreaker(threshold=3, cooldown=10)
+    for _ in range(2):
+        b.acquire()
+        b.record_failure(100.0)
+    assert b.state == CLOSED and b.available(100.0)
+    b.record_failure(100.0)
+    assert b.state == OPEN and not b.available(105.0) and b.opens == 1
+    assert b.available(110.0) and b.state == HALF_OPEN
+    b.acquire()
+    assert not b.available(110.0)  # one trial at a time
+    b.record_success()
+    assert b.state == CLOSED and b.failures == 0 and b.available(110.0)
+
+
+def test_breaker_trial_failure_reopens_and_release_returns_the_trial():
+    b = CircuitBreaker(threshold=3, cooldown=10)
+    half_open(b)
+    b.acquire()
+    b.release()
+    assert b.available(0.0)
+    b.acquire()
+    b.record_failure(50.0)
+    assert b.state == OPEN and b.opens == 2 and not b.available(55.0)
+
+
+# ---------------- gateway ----------------
+
+def test_fails_over_and_trips_a_failing_server():
+    async def main():
+        bad, good = FakeService("bad", "fail"), FakeService("good")
+        gw = LLMGateway([bad, good], hedge_quantile=0)
+        gw.backends[1].service.in_flight = 1  # route to "bad" first
+        results = [await gw.generate("p") for _ in range(3)]
+        return gw, results
+
+    gw, results = run(main())
+    assert results == ["http://good:p"] * 3
+    assert gw.backends[0].breaker.state == OPEN and gw.failovers == 3
+
+
+def test_non_runtime_errors_count_as_failures():
+    async def main():
+        gw = LLMGateway([FakeService("s", "bad_json")], hedge_quantile=0)
+        b = gw.backends[0].breaker
+        half_open(b)
+        with pytest.raises(ValueError):
+            await gw.generate("p")
+        return b
+
+    b = run(main())
+    assert b.state == OPEN and not b.trial
+
+
+def test_a_hanging_server_trips_on_the_deadline():
+    async def main():
+        gw = LLMGateway([FakeService("s", "hang")], hedge_quantile=0)
+        gw.backends[0].breaker.threshold = 2
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await gw.generate("p", deadline=0.02)
+        return gw
+
+    gw = run(main())
+    assert gw.backends[0].breaker.state == OPEN
+    assert not gw.available and gw.saturated
+
+
+def test_short_circuits_when_every_breaker_is_open():
+    async def main():
+        svc = FakeService("s")
+        gw = LLMGateway([svc], hedge_quantile=0)
+        gw.backends[0].breaker.trip(time.monotonic())
+        with pytest.raises(RuntimeError):
+            await gw.generate("p")
+        return gw, svc
+
+    gw, svc = run(main())
+    assert gw.short_circuits == 1 and svc.calls == 0
+
+
+def test_stream_closed_after_first_chunk_counts_as_success():
+    async def main():
+        gw = LLMGateway([FakeService("s")], hedge_quantile=0)
+        b = gw.backends[0].breaker
+        half_open(b)
+        stream = gw.stream("p")
+        assert await stream.__anext__() == "a"
+        await stream.aclose()  # e.g. a feedback stream evicted mid-generation
+        return b
+
+    b = run(main())
+    assert b.state == CLOSED and not b.trial and b.available(time.monotonic())
+
+
+def test_stream_cancelled_after_first_chunk_counts_as_success():
+    async def main():
+        gw = LLMGateway([FakeService("s", chunks=("a",) * 50)], hedge_quantile=0)
+        b = gw.backends[0].breaker
+        half_open(b)
+        first = asyncio.Event()
+
+        async def consume():
+            async for _ in gw.stream("p"):
+                first.set()
+
+        task = asyncio.ensure_future(consume())
+        await first.wait()
+        task.cancel()  # e.g. shutdown
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return b
+
+    b = run(main())
+    assert b.state == CLOSED and not b.trial
+
+
+def test_stream_cancelled_before_first_chunk_returns_the_trial():
+    async def main():
+        gw = LLMGateway([FakeService("s", latency=1.0)], hedge_quantile=0)
+        b = gw.backends[0].breaker
+        half_open(b)
+
+        async def consume():
+            async for _ in gw.stream("p"):
+                pass
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return b
+
+    b = run(main())
+    assert b.state == HALF_OPEN and not b.trial and b.available(time.monotonic())
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    async def main():
+        bad, good = FakeService("bad", "fail"), FakeService("good")
+        gw = LLMGateway([bad, good], hedge_quantile=0)
+        gw.backends[1].service.in_flight = 1
+        chunks = [c async for c in gw.stream("p")]
+        return gw, chunks
+
+    gw, chunks = run(main())
+    assert chunks == ["a", "b", "c"] and gw.failovers == 1
+    assert gw.backends[0].breaker.failures == 1 and gw.backends[1].breaker.state == CLOSED
+
+
+def test_stream_non_runtime_error_is_a_failure():
+    async def main():
+        gw = LLMGateway([FakeService("s", "bad_json")], hedge_quantile=0)
+        b = gw.backends[0].breaker
+        half_open(b)
+        with pytest.raises(ValueError):
+            async for _ in gw.stream("p"):
+                pass
+        return b
+
+    b = run(main())
+    assert b.state == OPEN and not b.trial
+
+
+def test_probe_half_opens_a_reachable_server():
+    async def main():
+        gw = LLMGateway([FakeService("up"), FakeService("down", "fail")], hedge_quantile=0)
+        gw.backends[0].breaker.trip(time.monotonic())
+        await gw.check_server()
+        return gw
+
+    gw = run(main())
+    assert gw.backends[0].breaker.state == HALF_OPEN
+    assert gw.backends[1].breaker.state == OPEN
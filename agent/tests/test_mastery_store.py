@@ -0,0 +1,115 @@
+# tests/test_mastery_store.py
+# MasteryState.apply must fold answers exactly as RECORD_SQL does (backfill and the
+# speculative path rely on it). The SQL comparison needs a Postgres to run against:
+#
+#   TEST_DATABASE_URL=postgresql://user@localhost/scratch python -m pytest tests
+#
+# it works in a transaction that is rolled back.
+import os
+import random
+import asyncio
+import uuid
+
+import pytest
+
+from mastery_store import (
+    MasteryState, RECORD_SQL, SELECT_SQL, MASTERY_DDL, record_args,
+    WINDOW, EWMA_ALPHA, DEFAULT_MASTERY,
+)
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def answers(n: int, seed: int = 3):
+    """(correct, time_taken, question_id) with some immediate repeats of a question."""
+    rng = random.Random(seed)
+    out, qid = [], None
+    for k in range(n):
+        if qid is None or rng.random() > 0.15:
+            qid = f"q{k}"
+        out.append((rng.random() < 0.65, rng.uniform(5, 90), qid))
+    return out
+
+
+def test_first_answer_seeds_the_averages():
+    state = MasteryState()
+    state.apply(True, 12.0, "q1")
+    assert (state.total, state.total_correct, state.window_bits, state.window_len, state.window_correct) == (1, 1, 1, 1, 1)
+    assert (state.ewma_acc, state.ewma_time) == (1.0, 12.0)
+
+
+def test_window_keeps_the_last_answers():
+    state = MasteryState()
+    outcomes = [k % 3 == 0 for k in range(WINDOW + 37)]
+    for k, correct in enumerate(outcomes):
+        state.apply(correct, 20.0, f"q{k}")
+        recent = outcomes[max(0, k + 1 - WINDOW):k + 1]
+        assert state.window_len == len(recent)
+        assert state.window_correct == sum(recent)
+        assert state.window_bits == sum(bit << i for i, bit in enumerate(reversed(recent)))
+    assert state.total == len(outcomes) and state.total_correct == sum(outcomes)
+
+
+def test_ewma_follows_its_recurrence():
+    state, acc, t = MasteryState(), None, None
+    for correct, time_taken, qid in answers(80):
+        if qid == state.last_question_id:
+            continue
+        acc = float(correct) if acc is None else acc + EWMA_ALPHA * (correct - acc)
+        t = time_taken if t is None else t + EWMA_ALPHA * (time_taken - t)
+        state.apply(correct, time_taken, qid)
+        assert state.ewma_acc == pytest.approx(acc) and state.ewma_time == pytest.approx(t)
+
+
+def test_repeated_question_is_a_no_op():
+    state = MasteryState()
+    state.apply(True, 10.0, "q1")
+    before = state.as_row("u", "t")
+    state.apply(False, 50.0, "q1")
+    assert state.as_row("u", "t") == before
+    state.apply(False, 50.0, "q2")
+    state.apply(True, 10.0, "q1")  # not the last question any more
+    assert state.total == 3
+
+
+def test_mastery_blend():
+    state = MasteryState()
+    assert state.mastery() == DEFAULT_MASTERY
+    for k in range(10):
+        state.apply(k < 8, 30.0, f"q{k}")
+    assert state.mastery() == pytest.approx(0.6 * 0.8 + 0.4 * 1.0)
+    slow = MasteryState()
+    slow.apply(False, 200.0, "q")
+    assert slow.mastery() == 0.0
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_apply_matches_record_sql():
+    import asyncpg
+
+    async def run():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        tx = conn.transaction()
+        await tx.start()
+        try:
+            await conn.execute(MASTERY_DDL)
+            user, topic = f"test-{uuid.uuid4()}", "addition"
+            state = MasteryState()
+            for correct, time_taken, qid in answers(WINDOW * 3):
+                row = await conn.fetchrow(RECORD_SQL, *record_args(user, topic, correct, time_taken, qid))
+                if row is None:  # skipped by the WHERE clause
+                    row = await conn.fetchrow(SELECT_SQL, user, topic)
+                state.apply(correct, time_taken, qid)
+                stored = MasteryState.from_row(row)
+                assert (stored.total, stored.total_correct, stored.window_bits, stored.window_len,
+                        stored.window_correct) == (state.total, state.total_correct, state.window_bits,
+                                                   state.window_len, state.window_correct)
+                # REAL columns: single precision
+                assert stored.ewma_acc == pytest.approx(state.ewma_acc, rel=1e-4, abs=1e-5)
+                assert stored.ewma_time == pytest.approx(state.ewma_time, rel=1e-4)
+                assert stored.mastery() == pytest.approx(state.mastery(), abs=1e-4)
+        finally:
+            await tx.rollback()
+            await conn.close()
+
+    asyncio.run(run())
@@ -0,0 +1,112 @@
+# tests/test_sampling.py
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from exclusion import ExclusionSet
+from question_index import QuestionIndex
+from sampling import AliasTable, QuestionSampler, SelectionPolicy, PickContext
+
+DRAWS = 200_000
+
+
+def frequencies(draw, n: int, draws: int = DRAWS) -> np.ndarray:
+    counts = Counter(draw() for _ in range(draws))
+    return np.array([counts[i] for i in range(n)]) / draws
+
+
+@pytest.mark.parametrize("weights", [[1, 2, 3, 4], [5, 0, 1, 0, 94], [1] * 7, [0.001, 1000]])
+def test_alias_table_draws_in_proportion(weights):
+    weights = np.array(weights, dtype=float)
+    table = AliasTable(weights)
+    rng = random.Random(1)
+    freq = frequencies(lambda: table.draw(rng), len(weights))
+    assert np.allclose(freq, weights / weights.sum(), atol=0.005)
+    assert all(freq[i] == 0 for i in np.flatnonzero(weights == 0))
+
+
+def test_alias_table_all_zero_weights_is_uniform():
+    table = AliasTable(np.zeros(4))
+    rng = random.Random(2)
+    assert np.allclose(frequencies(lambda: table.draw(rng), 4), 0.25, atol=0.005)
+
+
+class FixedPolicy(SelectionPolicy):
+    """Static weight from the question's estimatedTime, acceptance 1 or `accept` for skill 'slow'."""
+    def __init__(self, accept: float = 1.0):
+        self.accept = accept
+
+    def static_weights(self, pool, exposure):
+        return np.array([float(r.estimatedTime) for r in pool.records])
+
+    def acceptance(self, rec, p_correct, since_served, ctx):
+        return self.accept if "slow" in rec.mentalSkill else 1.0
+
+
+def make_index(weights, difficulty=2, skills=()):
+    index = QuestionIndex()
+    for w in weights:
+        index.upsert({"_id": ObjectId(), "topic": "addition", "difficulty": difficulty,
+                      "estimatedTime": w, "mentalSkill": list(skills)})
+    return index
+
+
+def pick_frequencies(sampler, index, tiers, exclude=None, draws=50_000):
+    rng = random.Random(3)
+    ordinals = sorted(r.ordinal for r in index.by_id.values())
+    counts = Counter()
+    for _ in range(draws):
+        rec = sampler.pick("addition", tiers, exclude, PickContext(now=0.0), rng, commit=False)
+        counts[rec.ordinal] += 1
+    return np.array([counts[o] for o in ordinals]) / draws
+
+
+def test_pick_follows_static_weights():
+    weights = [10, 20, 30, 40]
+    index = make_index(weights)
+    sampler = QuestionSampler(index, FixedPolicy())
+    freq = pick_frequencies(sampler, index, [{"difficulty": 2}])
+    assert np.allclose(freq, np.array(weights) / sum(weights), atol=0.01)
+
+
+def test_pick_is_proportional_to_static_times_acceptance():
+    index = make_index([10, 10])
+    index.upsert({"_id": ObjectId(), "topic": "addition", "difficulty": 2, "estimatedTime": 20,
+                  "mentalSkill": ["slow"]})
+    sampler = QuestionSampler(index, FixedPolicy(accept=0.25))
+    # static 10, 10, 20; accepted 10, 10, 5
+    freq = pick_frequencies(sampler, index, [{"difficulty": 2}])
+    assert np.allclose(freq, [0.4, 0.4, 0.2], atol=0.01)
+
+
+def test_pick_never_returns_an_excluded_question():
+    index = make_index([1, 1, 1, 1000])
+    sampler = QuestionSampler(index, FixedPolicy())
+    heavy = max(index.by_id.values(), key=lambda r: r.estimatedTime)
+    exclude = ExclusionSet([heavy.ordinal])
+    freq = pick_frequencies(sampler, index, [{"difficulty": 2}], exclude, draws=5000)
+    ordinals = sorted(r.ordinal for r in index.by_id.values())
+    assert freq[ordinals.index(heavy.ordinal)] == 0
+    assert sampler.fallbacks > 0  # rejections of the heavy item end in the exact pass
+    assert np.allclose(np.delete(freq, ordinals.index(heavy.ordinal)), 1 / 3, atol=0.03)
+
+
+def test_pick_falls_through_tiers():
+    index = make_index([1, 1], difficulty=3)
+    sampler = QuestionSampler(index, FixedPolicy())
+    everything = ExclusionSet(r.ordinal for r in index.by_id.values())
+    assert sampler.pick("addition", [{"difficulty": 5}, {"difficulty": 3}], commit=False).difficulty == 3
+    assert sampler.pick("addition", [{"difficulty": 3}], everything, commit=False) is None
+    assert sampler.pick("geometry", [{}], commit=False) is None
+
+
+def test_commit_counts_exposure():
+    index = make_index([1, 1])
+    sampler = QuestionSampler(index)
+    rec = sampler.pick("addition", [{}], ctx=PickContext(now=5.0))
+    assert sampler._exposure[rec.ordinal] == 1
+    assert sampler._last_served[rec.ordinal] == 5.0
+    assert sampler.stats()["items_served"] == 1
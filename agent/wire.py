@@ -0,0 +1,218 @@
+# wire.py
+# Binary alternative to the REST routes for the backend: msgpack frames over persistent
+# TCP connections, next to the HTTP port (AGENT_WIRE_PORT; off when unset).
+# Methods are the REST paths and take the same request models, validated the same way,
+# and return the same response models, serialized as the REST route would (mode="json"),
+# so switching transports changes nothing but the codec and the connection handling.
+#
+# Frame: a 4-byte big-endian length, then a msgpack array.
+#   request:  [id, method, body, params]   e.g. [7, "/agent/suggest-next-question-final", {...}, {"stream_message": false}]
+#   response: [id, status, body]           status as the HTTP status code; errors as {"detail": ...}
+# Requests on one connection run concurrently (up to WIRE_MAX_IN_FLIGHT, then reading
+# pauses), and responses come back as they finish, matched by id.
+import os
+import time
+import socket
+import asyncio
+import logging
+from typing import Optional, Dict, Tuple, Set, Any, Callable, Awaitable, Type
+
+import msgpack
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WIRE_HOST = os.getenv("AGENT_HOST", "0.0.0.0")
+WIRE_PORT = os.getenv("AGENT_WIRE_PORT")  # "0" binds an ephemeral port
+WIRE_MAX_FRAME = int(os.getenv("AGENT_WIRE_MAX_FRAME", 4 * 1024 * 1024))
+WIRE_MAX_IN_FLIGHT = int(os.getenv("AGENT_WIRE_MAX_IN_FLIGHT", 64))
+# set by `main.py --prod` with several workers, which then all listen on the port;
+# SO_REUSEPORT is missing on Windows and some other platforms
+WIRE_REUSE_PORT = os.getenv("AGENT_WIRE_REUSE_PORT") == "1" and hasattr(socket, "SO_REUSEPORT")
+
+_HEADER = 4
+
+
+def encode_frame(message: Any) -> bytes:
+    payload = msgpack.packb(message)
+    return len(payload).to_bytes(_HEADER, "big") + payload
+
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int = WIRE_MAX_FRAME) -> Any:
+    """The next decoded frame; IncompleteReadError at EOF, ValueError if it exceeds max_size."""
+    size = int.from_bytes(await reader.readexactly(_HEADER), "big")
+    if size > max_size:
+        raise ValueError(f"frame of {size} bytes exceeds {max_size}")
+    return msgpack.unpackb(await reader.readexactly(size))
+
+
+class Route:
+    """One method: the request model, the handler and its query parameters (name -> type)."""
+    __slots__ = ("model", "handler", "params")
+
+    def __init__(self, model: Type[BaseModel], handler: Callable[..., Awaitable[BaseModel]],
+                 params: Dict[str, type]):
+        self.model = model
+        self.handler = handler
+        self.params = params
+
+
+def _validation_detail(e: ValidationError):
+    # as FastAPI reports an invalid body
+    return [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False, include_context=False)]
+
+
+class WireServer:
+    def __init__(self, host: str = WIRE_HOST, max_in_flight: int = WIRE_MAX_IN_FLIGHT):
+        self.host = host
+        self.max_in_flight = max_in_flight
+        self.routes: Dict[str, Route] = {}
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    def route(self, method: str, model: Type[BaseModel], handler: Callable[..., Awaitable[BaseModel]],
+              **params: type) -> None:
+        """Expose `handler` (a REST route function) as `method`."""
+        self.routes[method] = Route(model, handler, params)
+
+    async def start(self, port: int) -> int:
+        kwargs = {"reuse_port": True} if WIRE_REUSE_PORT else {}
+        self._server = await asyncio.start_server(self._serve, self.host, port, **kwargs)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Wire protocol listening on {self.host}:{self.port}")
+        return self.port
+
+    async def stop(self) -> None:
+        """Stop accepting, finish the calls in flight and close the connections."""
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(asyncio.current_task())
+        slots = asyncio.Semaphore(self.max_in_flight)
+        calls: Set[asyncio.Task] = set()
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    frame = await read_frame(reader)
+                except Exception:
+                    slots.release()
+                    raise
+                call = asyncio.create_task(self._call(frame, writer, slots))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.warning(f"Closing wire connection: {e!r}")
+        finally:
+            if calls:
+                await asyncio.gather(*calls, return_exceptions=True)
+            writer.close()
+            self._connections.discard(asyncio.current_task())
+
+    async def _call(self, frame: Any, writer: asyncio.StreamWriter, slots: asyncio.Semaphore) -> None:
+        t0 = time.perf_counter()
+        rid = frame[0] if isinstance(frame, list) and frame else None
+        method = None
+        if isinstance(frame, list) and len(frame) == 4 and isinstance(frame[1], str) \
+                and isinstance(frame[3], (dict, type(None))):
+            _, method, body, params = frame
+            status, result = await self._dispatch(method, body, params or {})
+        else:
+            status, result = 400, {"detail": "Malformed frame"}
+        try:
+            writer.write(encode_frame([rid, status, result]))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            slots.release()
+            route = method if method in self.routes else "unmatched"  # bounded label values
+            metrics.WIRE_SECONDS.observe(time.perf_counter() - t0, route)
+            metrics.WIRE_REQUESTS.inc(route, status)
+
+    async def _dispatch(self, method: str, body: Any, params: Dict[str, Any]) -> Tuple[int, Any]:
+        route = self.routes.get(method)
+        if route is None:
+            return 404, {"detail": "Not Found"}
+        try:
+            request = route.model.model_validate(body)
+        except ValidationError as e:
+            return 422, {"detail": _validation_detail(e)}
+        kwargs = {}
+        for name, value in params.items():
+            kind = route.params.get(name)
+            if kind is None or not isinstance(value, kind):
+                return 422, {"detail": [{"type": "invalid_param", "loc": ["query", name], "msg": "Invalid parameter"}]}
+            kwargs[name] = value
+        try:
+            response = await route.handler(request, **kwargs)
+        except HTTPException as e:
+            return e.status_code, {"detail": e.detail}
+        except Exception:
+            logger.exception(f"Wire call {method} failed")
+            return 500, {"detail": "Internal Server Error"}
+        return 200, response.model_dump(mode="json")
+
+
+class WireClient:
+    """A multiplexed connection to a WireServer: `status, body = await client.call(method, body)`."""
+    def __init__(self):
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._receiving: Optional[asyncio.Task] = None
+
+    async def connect(self, host: str, port: int) -> "WireClient":
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._receiving = asyncio.create_task(self._receive())
+        return self
+
+    async def call(self, method: str, body: Dict[str, Any], **params: Any) -> Tuple[int, Any]:
+        self._next_id += 1
+        rid = self._next_id
+        future = self._waiting[rid] = asyncio.get_running_loop().create_future()
+        self._writer.write(encode_frame([rid, method, body, params]))
+        await self._writer.drain()
+        return await future
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                rid, status, body = await read_frame(self._reader)
+                future = self._waiting.pop(rid, None)
+                if future is not None and not future.done():
+                    future.set_result((status, body))
+        except Exception as e:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"wire connection lost: {e!r}"))
+            self._waiting.clear()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+        if self._receiving is not None:
+            self._receiving.cancel()
+
+
+wire_server = WireServer()
@@ -278,84 +278,83 @@ export class SessionsService {
     // Save the updated session
     await this.sessionRepository.save(session);
 
-    // If answered correctly, call agent for next question suggestion
-    const nextQuestion: QuestionDocument | null = null;
-    if (currentQuestionSession.correct) {
-      // Prepare payload for agent
-      const agentPayload = {
-        questionId: questionDetails._id, // MongoDB question ID
-        topic: questionDetails.topic,
-        subTopic: questionDetails.subtopic,
-        difficulty: questionDetails.difficulty,
-        wasCorrect: currentQuestionSession.correct,
-        timeTaken: answerDto.timeTaken,
-        estimatedTime: questionDetails.estimatedTime,
-        answer: answerDto.response,
-        sessionId: session.id,
-        userId: session.user.id,
-      };
+    // Every answer goes to the agent, correct or not: it folds the outcome into the
+    // user's mastery and ability, and after a wrong answer suggests a remedial question.
+
+    // Prepare payload for agent
+    const agentPayload = {
+      questionId: questionDetails._id, // MongoDB question ID
+      topic: questionDetails.topic,
+      subTopic: questionDetails.subtopic,
+      difficulty: questionDetails.difficulty,
+      wasCorrect: currentQuestionSession.correct,
+      timeTaken: answerDto.timeTaken,
+      estimatedTime: questionDetails.estimatedTime,
+      answer: answerDto.response,
+      sessionId: session.id,
+      userId: session.user.id,
+    };
 
-      // Call agent API (adjust URL and payload as needed)
-      const agentResponse = await axios.post(
-        'http://localhost:8001/agent/suggest-next-question-final',
-        agentPayload,
-      );
+    // Call agent API (adjust URL and payload as needed)
+    const agentResponse = await axios.post(
+      'http://localhost:8001/agent/suggest-next-question-final',
+      agentPayload,
+    );
+
+    console.log('[postCurrentQuestionAnswer] agent response:', agentResponse);
 
-      console.log('[postCurrentQuestionAnswer] agent response:', agentResponse);
+    // Fetch the next question details from MongoDB using nextQuestionId
+    let nextQuestion: QuestionDocument | null = null;
+    if (agentResponse.data?.nextQuestionId) {
+      nextQuestion = await this.questionModel
+        .findById(agentResponse.data.nextQuestionId)
+        .lean()
+        .exec();
 
-      // Fetch the next question details from MongoDB using nextQuestionId
-      let nextQuestion: QuestionDocument | null = null;
-      if (agentResponse.data?.nextQuestionId) {
-        nextQuestion = await this.questionModel
-          .findById(agentResponse.data.nextQuestionId)
-          .lean()
-          .exec();
+      if (nextQuestion) {
+        // Create a new QuestionSession entity
+        const newQuestionSession = this.sessionRepository.manager.create(
+          QuestionSession,
+          {
+            questionId: agentResponse.data.nextQuestionId,
+            response: '',
+            correct: false,
+            timeTaken: 0,
+            timestamp: new Date(),
+          },
+        );
 
-        if (nextQuestion) {
-          // Create a new QuestionSession entity
-          const newQuestionSession = this.sessionRepository.manager.create(
+        // Save the QuestionSession entity
+        const savedQuestionSession =
+          await this.sessionRepository.manager.save(
             QuestionSession,
-            {
-              questionId: agentResponse.data.nextQuestionId,
-              response: '',
-              correct: false,
-              timeTaken: 0,
-              timestamp: new Date(),
-            },
+            newQuestionSession,
           );
 
-          // Save the QuestionSession entity
-          const savedQuestionSession =
-            await this.sessionRepository.manager.save(
-              QuestionSession,
-              newQuestionSession,
-            );
-
-          // Add the saved QuestionSession to the session
-          session.questions.push(savedQuestionSession);
-          await this.sessionRepository.save(session);
-
-          // Add the full question details to the response
-          const questionWithStrategy = {
-            ...nextQuestion,
-            strategyTip: agentResponse.data.strategyTip,
-          };
-          nextQuestion = questionWithStrategy as unknown as QuestionDocument;
-        }
-      }
+        // Add the saved QuestionSession to the session
+        session.questions.push(savedQuestionSession);
+        await this.sessionRepository.save(session);
 
-      return {
-        success: true,
-        data: {
-          session,
-          currentQuestionSession,
-          nextQuestion,
-          agentMessage: agentResponse.data.message,
+        // Add the full question details to the response
+        const questionWithStrategy = {
+          ...nextQuestion,
           strategyTip: agentResponse.data.strategyTip,
-          reflectionPrompt: agentResponse.data.reflectionPrompt,
-        },
-      };
+        };
+        nextQuestion = questionWithStrategy as unknown as QuestionDocument;
+      }
     }
+
+    return {
+      success: true,
+      data: {
+        session,
+        currentQuestionSession,
+        nextQuestion,
+        agentMessage: agentResponse.data.message,
+        strategyTip: agentResponse.data.strategyTip,
+        reflectionPrompt: agentResponse.data.reflectionPrompt,
+      },
+    };
   }
 
   async getDashboardData(user: any, topic?: string) {